@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Benchmark of the XLS to CSV conversion (etl_to_csv.py), using synthetic
+organograms of various sizes and hierarchy shapes.
+
+Each stage of load_xls_and_stop_on_errors is timed separately, as well as
+writing the CSVs, and the results are saved as JSON, so that runs on
+different commits can be compared:
+
+    ./benchmark_etl.py --output benchmark-before.json
+    git checkout my-branch
+    ./benchmark_etl.py --output benchmark-after.json
+    ./benchmark_etl.py --compare benchmark-before.json benchmark-after.json
+
+The synthetic XLS files are kept in --data-dir, so they are only generated
+once.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+
+import pandas
+import xlwt
+
+import etl_to_csv
+from etl_to_csv import (
+    open_workbook, get_references, standard_references, load_senior,
+    load_junior, verify_graph, save_csvs, ValidationFatalError,
+    SENIOR_SHEET_NAME, JUNIOR_SHEET_NAME)
+from csv2xls import XLS_COL_HEADERS
+
+args = None
+
+DEFAULT_SIZES = (100, 1000, 10000, 50000)
+SHAPES = ('balanced', 'wide', 'deep')
+VARIANTS = ('valid', 'invalid')
+STAGES = ('open workbook', 'references', 'senior load',
+          'senior in-sheet validation', 'junior load',
+          'junior in-sheet validation', 'verify graph', 'save csvs')
+
+
+def generate_organogram(xls_filepath, num_posts, shape='balanced',
+                        invalid=False, seed=0):
+    '''Writes a synthetic organogram XLS, with about a fifth of the posts
+    being senior.
+
+    shape - how the senior posts report to each other:
+            'balanced' - a tree where each post has 5 reports
+            'wide' - everyone reports to the top post
+            'deep' - a single chain of command
+    invalid - make about 1% of the rows invalid, with a mix of errors
+
+    Job shares, vacant posts and eliminated posts are included.
+    '''
+    random_ = random.Random(seed)
+    references = standard_references()
+    grades = references['listSeniorGrades']
+    professions = references['professions']
+    num_senior = max(2, num_posts // 5)
+    num_junior = max(1, num_posts - num_senior)
+    units = ['Unit %s' % i for i in range(max(1, min(200, num_senior // 20)))]
+    refs = ['P%s' % i for i in range(num_senior)]
+
+    def boss_index(i):
+        if shape == 'wide':
+            return 0
+        elif shape == 'deep':
+            return i - 1
+        return (i - 1) // 5
+    bosses = set(boss_index(i) for i in range(1, num_senior))
+
+    senior_rows = []
+    for i, ref in enumerate(refs):
+        unit = random_.choice(units)
+        floor = random_.randrange(60000, 200000, 5000)
+        row = [ref, 'Person %s' % i, random_.choice(grades),
+               'Director of %s' % unit, 'Leads %s' % unit,
+               'Department of Benchmarks', 'Benchmark Agency', unit,
+               '0300 123 %04d' % (i % 10000), 'person%s@example.gov.uk' % i,
+               refs[boss_index(i)] if i else 'XX',
+               random_.randrange(0, 2000000), 1.0, floor, floor + 4999,
+               floor + 2000, random_.choice(professions), '', 1]
+        # posts with nobody reporting to them can be vacant or eliminated
+        # (eliminated posts are ignored by verify_graph)
+        if i not in bosses and i % 50 == 7:
+            row[1] = 'Eliminated' if i % 100 == 7 else 'Vacant'
+            row[8] = row[9] = 'N/A'
+        senior_rows.append(row)
+        if i and i % 50 == 3:
+            job_share = list(row)
+            job_share[1] = 'Person %s share' % i
+            job_share[9] = 'person%s.share@example.gov.uk' % i
+            job_share[12] = 0.5
+            row[12] = 0.5
+            senior_rows.append(job_share)
+
+    in_post_refs = [senior_row[0] for senior_row in senior_rows
+                    if senior_row[1] not in ('Eliminated', 'Vacant')]
+    junior_rows = []
+    for i in range(num_junior):
+        pay_min = random_.randrange(15000, 50000, 1000)
+        junior_rows.append([
+            'Department of Benchmarks', 'Benchmark Agency',
+            random_.choice(units), random_.choice(in_post_refs),
+            random_.choice(('Band A', 'Band B', 'Band C')), pay_min,
+            pay_min + 5000, 'Assistant', random_.choice((1.0, 2.5, 10.0)),
+            random_.choice(professions), 1])
+
+    if invalid:
+        corrupt_rows(senior_rows, junior_rows, random_)
+
+    workbook = xlwt.Workbook()
+    for sheet_name, headers, rows in (
+            (SENIOR_SHEET_NAME, XLS_COL_HEADERS['senior'], senior_rows),
+            (JUNIOR_SHEET_NAME, XLS_COL_HEADERS['junior'], junior_rows)):
+        write_sheet(workbook, sheet_name, [headers] + rows)
+    for sheet_name, header, values in (
+            ('(reference) senior-staff-grades', 'Grades', grades),
+            ('(reference) professions', 'Professions', professions),
+            ('(reference) units', 'Units', units)):
+        write_sheet(workbook, sheet_name, [[header]] + [[v] for v in values])
+    workbook.save(xls_filepath)
+
+
+def corrupt_rows(senior_rows, junior_rows, random_):
+    '''Introduces errors into about 1% of the rows, and marks those rows as
+    invalid (the red colour in the "Valid?" column of the real template).'''
+    senior_corruptions = (
+        (2, 'SCS9'),              # grade not in the list
+        (3, ''),                  # blank job title
+        (9, 'not an email'),
+        (10, 'UNKNOWN'),          # reports to an unknown post
+        )
+    for n, row in enumerate(random_.sample(
+            senior_rows[1:], max(1, len(senior_rows) // 100))):
+        column, value = senior_corruptions[n % len(senior_corruptions)]
+        row[column] = value
+        row[-1] = 0
+    for row in random_.sample(junior_rows, max(1, len(junior_rows) // 100)):
+        row[3] = 'UNKNOWN'
+        row[-1] = 0
+
+
+def write_sheet(workbook, sheet_name, rows):
+    sheet = workbook.add_sheet(sheet_name)
+    for r, row in enumerate(rows):
+        for c, value in enumerate(row):
+            sheet.write(r, c, value)
+
+
+def time_stages(xls_filepath, output_folder):
+    '''Runs the stages of load_xls_and_stop_on_errors, plus save_csvs, timing
+    each one.
+    Returns: (timings, error_counts, senior_rows, junior_rows)
+    '''
+    timings = OrderedDict((stage, 0.0) for stage in STAGES)
+    error_counts = OrderedDict()
+    load_errors = []
+    validation_errors = []
+    warnings = []
+
+    def timed(stage, function, *args_):
+        start = timeit.default_timer()
+        result = function(*args_)
+        timings[stage] += timeit.default_timer() - start
+        return result
+
+    # the in-sheet validation happens within load_senior/load_junior, so time
+    # it by wrapping it, and take its time off the load stage
+    in_sheet_validation = etl_to_csv.in_sheet_validation
+
+    def timed_in_sheet_validation(df, validation_errors_, sheet_name,
+                                  junior_or_senior, references_):
+        timed('%s in-sheet validation' % junior_or_senior, in_sheet_validation,
+              df, validation_errors_, sheet_name, junior_or_senior,
+              references_)
+    etl_to_csv.in_sheet_validation = timed_in_sheet_validation
+    try:
+        workbook = timed('open workbook', open_workbook, xls_filepath)
+        references = timed('references', get_references, workbook,
+                           load_errors, validation_errors, warnings)
+        senior_df = timed('senior load', load_senior, workbook, load_errors,
+                          validation_errors, references)
+        timings['senior load'] -= timings['senior in-sheet validation']
+        junior_df = timed('junior load', load_junior, workbook, load_errors,
+                          validation_errors, references)
+        timings['junior load'] -= timings['junior in-sheet validation']
+    finally:
+        etl_to_csv.in_sheet_validation = in_sheet_validation
+    error_counts['load'] = len(load_errors)
+    error_counts['validation'] = len(validation_errors)
+
+    # carry on regardless of errors, so every stage is timed
+    graph_errors = []
+    try:
+        timed('verify graph', verify_graph, senior_df, junior_df,
+              graph_errors)
+    except ValidationFatalError:
+        pass
+    error_counts['verify graph'] = len(graph_errors)
+
+    timed('save csvs', save_csvs,
+          os.path.join(output_folder, 'senior.csv'),
+          os.path.join(output_folder, 'junior.csv'), senior_df, junior_df)
+    return timings, error_counts, len(senior_df), len(junior_df)
+
+
+def run_benchmark(sizes, shapes, variants, repeat, data_dir):
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    output_folder = tempfile.mkdtemp(prefix='benchmark_etl')
+    results = []
+    try:
+        for num_posts in sizes:
+            for shape in shapes:
+                for variant in variants:
+                    name = '%s-%s-%s' % (num_posts, shape, variant)
+                    xls_filepath = os.path.join(data_dir, name + '.xls')
+                    if not os.path.exists(xls_filepath):
+                        print 'Generating', xls_filepath
+                        generate_organogram(xls_filepath, num_posts, shape,
+                                            invalid=(variant == 'invalid'))
+                    results.append(benchmark_xls(
+                        name, xls_filepath, output_folder, repeat))
+                    results[-1].update(posts=num_posts, shape=shape,
+                                       variant=variant)
+    finally:
+        shutil.rmtree(output_folder)
+    return results
+
+
+def benchmark_xls(name, xls_filepath, output_folder, repeat):
+    '''Times the stages, taking the fastest of the repeats for each stage.'''
+    best_timings = None
+    for i in range(repeat):
+        timings, error_counts, senior_rows, junior_rows = \
+            time_stages(xls_filepath, output_folder)
+        if best_timings is None:
+            best_timings = timings
+        else:
+            for stage, seconds in timings.items():
+                best_timings[stage] = min(best_timings[stage], seconds)
+    total = sum(best_timings.values())
+    print '%-24s %8.3fs  %s' % (
+        name, total, '  '.join('%s=%.3f' % (stage, seconds)
+                               for stage, seconds in best_timings.items()))
+    return OrderedDict((
+        ('name', name),
+        ('senior_rows', senior_rows),
+        ('junior_rows', junior_rows),
+        ('stages', best_timings),
+        ('total', total),
+        ('error_counts', error_counts),
+        ))
+
+
+def get_git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_filepath, after_filepath):
+    '''Prints the change in time of each stage between two result files.'''
+    with open(before_filepath, 'rb') as f:
+        before = json.load(f)
+    with open(after_filepath, 'rb') as f:
+        after = json.load(f)
+    print 'Before: %s %s' % (before['commit'], before['date'])
+    print 'After:  %s %s' % (after['commit'], after['date'])
+    before_results = dict((result['name'], result)
+                          for result in before['results'])
+    for result in after['results']:
+        if result['name'] not in before_results:
+            continue
+        before_result = before_results[result['name']]
+        print result['name']
+        for stage in list(STAGES) + ['total']:
+            if stage == 'total':
+                before_seconds = before_result['total']
+                after_seconds = result['total']
+            else:
+                before_seconds = before_result['stages'].get(stage)
+                after_seconds = result['stages'].get(stage)
+            if before_seconds is None or after_seconds is None:
+                continue
+            print '  %-28s %8.3fs -> %8.3fs  %s' % (
+                stage, before_seconds, after_seconds,
+                '%.2fx' % (before_seconds / after_seconds)
+                if after_seconds else '')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Number of posts (senior and junior)')
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES,
+                        default=SHAPES, help='Shape of the senior hierarchy')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS,
+                        default=VARIANTS,
+                        help='Whether to benchmark valid and/or invalid XLS')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs - the fastest time is recorded')
+    parser.add_argument('--data-dir', default='.benchmark_etl',
+                        help='Folder for the generated XLS files')
+    parser.add_argument('--output', default='benchmark-etl.json',
+                        help='Filename for the JSON results')
+    parser.add_argument('--compare', nargs=2,
+                        metavar=('BEFORE_JSON', 'AFTER_JSON'),
+                        help='Compare the results of two runs, instead of '
+                             'running the benchmark')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    results = run_benchmark(args.sizes, args.shapes, args.variants,
+                            args.repeat, args.data_dir)
+    output = OrderedDict((
+        ('commit', get_git_commit()),
+        ('date', datetime.datetime.now().isoformat()),
+        ('python_version', platform.python_version()),
+        ('pandas_version', pandas.__version__),
+        ('results', results),
+        ))
+    with open(args.output, 'wb') as f:
+        json.dump(output, f, indent=2)
+    print 'Written', args.output
@@ -0,0 +1,153 @@
+'''
+Index of strings (e.g. canonized department titles) for finding the best
+fuzzywuzzy WRatio matches for a name, without scoring the name against every
+one of them.
+
+The strings that share a word with the name are always scored. The others can
+still get a decent WRatio (e.g. an acronym, or a spelling mistake), so they
+are scored in order of an upper bound of their WRatio, which is cheap to work
+out from the characters the two strings have in common, stopping when the
+bound drops below the score needed to get into the results. So the results
+are exactly the same as scoring every string, just quicker.
+
+Example:
+
+from candidate_index import CandidateIndex
+index = CandidateIndex(['cabinet office', 'home office', 'hm treasury'])
+index.extract('cabinet ofice', limit=2, score_cutoff=50)
+# [('cabinet office', 96), ('home office', 58)]
+'''
+
+from collections import Counter
+
+# pip install fuzzywuzzy
+# pip install python-levenshtein
+import fuzzywuzzy.fuzz
+import fuzzywuzzy.utils
+
+
+class Candidate(object):
+    '''A string, processed the way WRatio does, with the bits needed to
+    work out the upper bound of its WRatio against another string.'''
+    __slots__ = ('string', 'processed', 'words', 'char_counts', 'lengths')
+
+    def __init__(self, string):
+        self.string = string
+        self.processed = fuzzywuzzy.utils.full_process(string,
+                                                       force_ascii=True)
+        words = self.processed.split()
+        self.words = set(words)
+        self.char_counts = Counter(self.processed)
+        # lengths of the strings that WRatio compares: processed, with the
+        # words sorted and with the words sorted and deduplicated
+        self.lengths = (len(self.processed), len(' '.join(words)),
+                        len(' '.join(self.words)))
+
+
+def _ratio_bound(common, length1, length2):
+    # ratio is 2 * matching characters / total length
+    return 2.0 * min(common, length1, length2) / (length1 + length2)
+
+
+def _partial_ratio_bound(common, length1, length2):
+    # partial_ratio compares the shorter string with a window of the longer
+    # one, which can be cut short at the end of the longer string
+    shorter = min(length1, length2)
+    matching = min(common, shorter)
+    return 2.0 * matching / (shorter + matching)
+
+
+def wratio_bound(candidate1, candidate2):
+    '''Returns an upper bound of the WRatio of two Candidates that have no
+    words in common.
+
+    Every ratio WRatio takes is of strings made of the two strings'
+    characters, so is limited by the number of characters they have in
+    common. (With no words in common, the token_set ratios are of the sorted,
+    deduplicated words.)
+    '''
+    counts1, counts2 = candidate1.char_counts, candidate2.char_counts
+    if len(counts1) > len(counts2):
+        counts1, counts2 = counts2, counts1
+    common = sum(min(count, counts2.get(char, 0))
+                 for char, count in counts1.iteritems())
+    lengths = zip(candidate1.lengths, candidate2.lengths)
+    length1, length2 = lengths[0]
+    if not length1 or not length2:
+        return 0
+    bound = _ratio_bound(common, length1, length2)
+    len_ratio = float(max(length1, length2)) / min(length1, length2)
+    if len_ratio < 1.5:
+        bound = max([bound] + [0.95 * _ratio_bound(common, *lengths_)
+                               for lengths_ in lengths[1:]])
+    else:
+        partial_scale = 0.6 if len_ratio > 8 else 0.9
+        bound = max([bound, partial_scale *
+                     _partial_ratio_bound(common, length1, length2)] +
+                    [0.95 * partial_scale *
+                     _partial_ratio_bound(common, *lengths_)
+                     for lengths_ in lengths[1:]])
+    # WRatio rounds each ratio and then the result
+    return 100 * bound + 1
+
+
+class CandidateIndex(object):
+    def __init__(self, strings=()):
+        self.candidates = {}  # {string: Candidate}
+        self._by_word = {}  # {word: set of Candidates}
+        for string in strings:
+            self.add(string)
+
+    def add(self, string):
+        if string in self.candidates:
+            return
+        candidate = self.candidates[string] = Candidate(string)
+        for word in candidate.words:
+            self._by_word.setdefault(word, set()).add(candidate)
+
+    def extract(self, name, limit=10, score_cutoff=0):
+        '''Returns a list of the (string, score) that score best against the
+        name with fuzzywuzzy WRatio, at least score_cutoff, best first (and
+        then alphabetically).'''
+        name = Candidate(name)
+        if not name.processed:
+            return []
+        results = []  # (-score, string)
+
+        def score(candidate):
+            score = fuzzywuzzy.fuzz.WRatio(name.processed,
+                                           candidate.processed,
+                                           full_process=False)
+            if score >= score_cutoff:
+                results.append((-score, candidate.string))
+
+        sharing_a_word = set()
+        for word in name.words:
+            sharing_a_word.update(self._by_word.get(word, ()))
+        for candidate in sharing_a_word:
+            score(candidate)
+        results.sort()
+        others = sorted(
+            ((wratio_bound(name, candidate), candidate.string, candidate)
+             for candidate in self.candidates.itervalues()
+             if candidate not in sharing_a_word), reverse=True)
+        for bound, string, candidate in others:
+            if len(results) >= limit:
+                score_needed = max(score_cutoff, -results[limit - 1][0])
+            else:
+                score_needed = score_cutoff
+            if bound < score_needed:
+                break
+            score(candidate)
+            results.sort()
+        return [(string, -negative_score)
+                for negative_score, string in results[:limit]]
+
+    def extract_many(self, names, limit=10, score_cutoff=0):
+        '''Like extract, for several names. Returns {name: results}. Each
+        distinct name is only scored once.'''
+        return dict((name, self.extract(name, limit, score_cutoff))
+                    for name in set(names))
+
+    def __len__(self):
+        return len(self.candidates)
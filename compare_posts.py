@@ -2,28 +2,56 @@
 import re
 import csv
 import argparse
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import os.path
+import threading
 import traceback
-import copy
+import json
+import time
 from pprint import pprint
 
-import requests_cache
 import requests
 from requests.utils import quote
 from progress.bar import Bar
 # pip install unicodecsv
 import unicodecsv
 from departments_tidy import match_to_dgu_dept
+from normalize import canonize_value
 
 from compare_departments import date_to_year_first
 from uploads_scrape import munge_org
 from csv2xls import int_if_possible
+from crawler import Crawler, DEFAULT_CONCURRENCY, imap_unordered
+import http_client
+import triplestore_sparql
+from triplestore_snapshot import get_snapshot
+from triplestore_query import NEW_SPARQL_ENDPOINT
 
 
-requests_cache.install_cache('.compare_posts.cache')
 global args
 args = None
+crawler = None
+# {(body_uri, graph): label}
+parent_departments = None
+PARENT_DEPARTMENTS_FILENAME = '.triplestore_parent_departments.memo'
+
+
+def get_crawler():
+    '''Returns the Crawler, which uses the shared HttpClient, so that
+    connections are reused.'''
+    global crawler
+    if crawler is None:
+        crawler = Crawler(concurrency=getattr(args, 'concurrency', None) or
+                          DEFAULT_CONCURRENCY)
+    return crawler
+
+
+def get_triplestore_snapshot():
+    '''Returns the local triplestore Snapshot, if one is being used instead
+    of the live triplestore, otherwise None.'''
+    snapshot_path = getattr(args, 'snapshot', None)
+    if snapshot_path:
+        return get_snapshot(snapshot_path)
 
 
 def compare():
@@ -164,6 +192,7 @@ def triplestore_posts_to_csv(body_title_filter, graph_filter, where_uploads_unre
 
     in_filename = 'triplestore_departments_tidied.csv'
     done_anything = False
+    pairs = []
     with open(in_filename, 'rb') as csv_read_file:
         csv_reader = csv.DictReader(csv_read_file)
         for row in csv_reader:
@@ -178,23 +207,27 @@ def triplestore_posts_to_csv(body_title_filter, graph_filter, where_uploads_unre
                         can_we_use_the_upload_spreadsheet(
                             row['title'], graph):
                     continue
-                body_uri = uris[i]
-                senior_posts, junior_posts, num_eliminated_senior_posts, source_files = \
-                    get_triplestore_posts(body_uri, graph, print_urls=args.verbose)
-                print '%s %s Senior:%s Junior:%s' % (
-                    row['title'], graph,
-                    len(senior_posts) - num_eliminated_senior_posts,
-                    len(junior_posts) if args.junior else 'not checked'
-                    )
-                pprint(dict(source_files))
-                parent_department = \
-                    get_triplestore_parent_department(body_uri, graph, print_urls=args.verbose)
-                save_posts_csv(row['title'], graph, 'senior', senior_posts,
-                               parent_department)
-                if junior_posts is not None:
-                    save_posts_csv(row['title'], graph, 'junior',
-                                   junior_posts, parent_department)
-                done_anything = True
+                pairs.append((row['title'], uris[i], graph))
+    prefetch_triplestore_parent_departments(
+        [(body_uri, graph) for title, body_uri, graph in pairs],
+        print_urls=args.verbose)
+    for title, body_uri, graph in pairs:
+        senior_posts, junior_posts, num_eliminated_senior_posts, source_files = \
+            get_triplestore_posts(body_uri, graph, print_urls=args.verbose)
+        print '%s %s Senior:%s Junior:%s' % (
+            title, graph,
+            len(senior_posts) - num_eliminated_senior_posts,
+            len(junior_posts) if args.junior else 'not checked'
+            )
+        pprint(dict(source_files))
+        parent_department = \
+            get_triplestore_parent_department(body_uri, graph, print_urls=args.verbose)
+        save_posts_csv(title, graph, 'senior', senior_posts,
+                       parent_department)
+        if junior_posts is not None:
+            save_posts_csv(title, graph, 'junior',
+                           junior_posts, parent_department)
+        done_anything = True
     if not done_anything:
         print 'Have not done anything - check arguments'
 
@@ -296,36 +329,37 @@ def save_posts_csv(body_title, graph, senior_or_junior, posts,
                 for post in posts:
                     # convert the LD post to the standard organogram type
                     row = {}
-                    row['Post Unique Reference'] = get_id_from_uri(post['uri'])
-                    row['Name'] = post['name']
-                    row['Grade (or equivalent)'] = post['grade']
-                    row['Job Title'] = post['label']
-                    row['Job/Team Function'] = post['comment']
+                    row['Post Unique Reference'] = get_id_from_uri(post.uri)
+                    row['Name'] = post.name
+                    row['Grade (or equivalent)'] = post.grade
+                    row['Job Title'] = post.label
+                    row['Job/Team Function'] = post.comment
                     row['Parent Department'] = parent_department
                     row['Organisation'] = body_title
-                    row['Unit'] = post['unit']
-                    row['Contact Phone'] = post['phone']
-                    row['Contact E-mail'] = post['email']
+                    row['Unit'] = post.unit
+                    row['Contact Phone'] = post.phone
+                    row['Contact E-mail'] = post.email
                     row['Reports to Senior Post'] = \
-                        get_id_from_uri(post['reports_to_uri']) or 'XX'
+                        get_id_from_uri(post.reports_to_uri) or 'XX'
                     row[u'Salary Cost of Reports (£)'] = \
-                        post.get('salary_cost_of_reports', '')
-                    salary_range = parse_salary_range(post['salary_range'])
-                    row['FTE'] = post['fte']
+                        '' if post.salary_cost_of_reports is None \
+                        else post.salary_cost_of_reports
+                    salary_range = parse_salary_range(post.salary_range)
+                    row['FTE'] = post.fte
                     if not salary_range[0] or not salary_range[1]:
                         # simple correction
-                        if post['grade'] == 'SCS1':
+                        if post.grade == 'SCS1':
                             salary_range[0] = salary_range[1] = 'N/D'
                     row[u'Actual Pay Floor (£)'] = salary_range[0]
                     row[u'Actual Pay Ceiling (£)'] = salary_range[1]
                     row['Professional/Occupational Group'] = \
-                        resolve_profession(post['profession'])
+                        resolve_profession(post.profession)
                     row['Notes'] = ''
                     row['Valid?'] = ''
                     # linked data CSV only
-                    row['URI'] = post['uri']
-                    row['source_file'] = post['source_file']
-                    row['source_line'] = post['source_line']
+                    row['URI'] = post.uri
+                    row['source_file'] = post.source_file
+                    row['source_line'] = post.source_line
 
                     # MOD denotes heads of navy/army etc as reporting to
                     # themselves. Convert to the 'XX' convention
@@ -336,23 +370,23 @@ def save_posts_csv(body_title, graph, senior_or_junior, posts,
 
                     csv_writer.writerow(row)
             else:
-                for post in sorted(posts, key=lambda p: p['row_index']):
+                for post in sorted(posts, key=lambda p: p.row_index):
                     row = {}
                     row['Parent Department'] = parent_department
                     row['Organisation'] = body_title
-                    row['Unit'] = post['unit']
-                    row['Reporting Senior Post'] = post['reports_to']
-                    row['Grade'] = post['grade']
-                    salary_range = parse_salary_range(post['salary_range'])
+                    row['Unit'] = post.unit
+                    row['Reporting Senior Post'] = post.reports_to
+                    row['Grade'] = post.grade
+                    salary_range = parse_salary_range(post.salary_range)
                     row[u'Payscale Minimum (£)'] = salary_range[0]
                     row[u'Payscale Maximum (£)'] = salary_range[1]
-                    row['Generic Job Title'] = post['job_title']
-                    row['Number of Posts in FTE'] = post['fte']
-                    row['Professional/Occupational Group'] = post['profession']
+                    row['Generic Job Title'] = post.job_title
+                    row['Number of Posts in FTE'] = post.fte
+                    row['Professional/Occupational Group'] = post.profession
 
                     # linked data CSV only
-                    row['source_file'] = post['source_file']
-                    row['source_line'] = post['source_line']
+                    row['source_file'] = post.source_file
+                    row['source_line'] = post.source_line
 
                     csv_writer.writerow(row)
         except Exception:
@@ -361,36 +395,130 @@ def save_posts_csv(body_title, graph, senior_or_junior, posts,
     print 'Written', out_filepath
 
 
+class ThroughputBar(Bar):
+    '''Progress bar that shows the rate of (body, graph) pairs done.'''
+    suffix = '%(index)d/%(max)d - %(pairs_per_minute).1f pairs/min - ' \
+        'eta %(eta_td)s'
+
+    @property
+    def pairs_per_minute(self):
+        # time since the bar started, not since the first pair was done
+        elapsed = time.time() - self.start_ts
+        return self.index * 60.0 / elapsed if elapsed else 0.0
+
+
+def load_checkpoint(filename, options=None):
+    '''Returns the results saved by append_checkpoint, as a dict of
+    {key: value}.
+
+    options - if given, the results are only returned if they were saved
+              with the same options (see write_checkpoint_options)
+    '''
+    results = {}
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            if options is not None:
+                try:
+                    saved_options = json.loads(f.readline())['options']
+                except (ValueError, TypeError, KeyError):
+                    saved_options = None
+                if saved_options != options:
+                    print 'Not resuming from %s - it was made with different ' \
+                        'options: %r' % (filename, saved_options)
+                    return results
+            for line in f:
+                try:
+                    key, value = json.loads(line)
+                except ValueError:
+                    # the last line is incomplete if the run was killed
+                    # while writing it
+                    continue
+                results[tuple(key)] = value
+    return results
+
+
+def write_checkpoint_options(checkpoint_file, options):
+    '''Writes the options of the run, as the first line of the checkpoint,
+    so that a run with different ones doesn't resume from it.'''
+    checkpoint_file.write(json.dumps(dict(options=options)) + '\n')
+
+
+def append_checkpoint(checkpoint_file, key, value):
+    checkpoint_file.write(json.dumps([key, value]) + '\n')
+    checkpoint_file.flush()
+
+
 def triplestore_post_counts(body_title, graph):
     '''Gets a list of triplestore departments/graphs, gets the posts,
     and saves post counts in a CSV.
+
+    The (body, graph) pairs are done concurrently (--pair-concurrency). Each
+    one is saved to a checkpoint file as it completes, so an interrupted run
+    resumes where it left off (unless --restart).
     '''
     in_filename = 'triplestore_departments_tidied.csv'
     out_filename_counts = 'triplestore_post_counts.csv'
+    checkpoint_filename = out_filename_counts + '.checkpoint'
     with open(in_filename, 'rb') as csv_read_file:
         csv_reader = csv.DictReader(csv_read_file)
-        counts = []
         rows = [row for row in csv_reader]
-        for row in Bar('Reading posts from organizations').iter(rows):
-            if body_title and body_title not in (row['title'], row['name']):
+    pairs = []
+    for row in rows:
+        if body_title and body_title not in (row['title'], row['name']):
+            continue
+        uris = row['uris'].split()
+        for i, graph_ in enumerate(row['graphs'].split()):
+            if graph and graph != graph_:
                 continue
-            #print row['title']
-            uris = row['uris'].split()
-            for i, graph_ in enumerate(row['graphs'].split()):
-                if graph and graph != graph_:
-                    continue
-                body_uri = uris[i]
-                (senior_posts, junior_posts, num_eliminated_senior_posts,
-                    source_files) = \
-                    get_triplestore_posts(body_uri, graph_)
-                counts.append(dict(
-                    body_title=row['title'],
-                    graph=graph_,
-                    senior_posts=len(senior_posts) - num_eliminated_senior_posts,
-                    junior_posts=len(junior_posts) if junior_posts is not None else None,
-                    source_files=repr(dict(source_files)),
-                    num_source_files=len(source_files),
-                    ))
+            pairs.append((row['title'], uris[i], graph_))
+
+    # the options that affect the counts, including the filters, so that
+    # neither a different run nor a filtered one's counts are resumed from
+    checkpoint_options = dict(
+        body_title=body_title, graph=graph,
+        junior=bool(getattr(args, 'junior', False)),
+        sparql=bool(getattr(args, 'sparql', False)) and
+        getattr(args, 'sparql_endpoint', NEW_SPARQL_ENDPOINT),
+        snapshot=getattr(args, 'snapshot', None))
+    if getattr(args, 'restart', False) and \
+            os.path.exists(checkpoint_filename):
+        os.remove(checkpoint_filename)
+    counts_by_pair = load_checkpoint(checkpoint_filename, checkpoint_options)
+    pairs_to_do = [pair for pair in pairs
+                   if pair[1:] not in counts_by_pair]
+    if len(pairs_to_do) < len(pairs):
+        print 'Resuming from %s - %s of %s (body, graph) pairs already done' \
+            % (checkpoint_filename, len(pairs) - len(pairs_to_do), len(pairs))
+
+    def count_posts(pair):
+        body_title_, body_uri, graph_ = pair
+        (senior_posts, junior_posts, num_eliminated_senior_posts,
+            source_files) = \
+            get_triplestore_posts(body_uri, graph_)
+        return dict(
+            body_title=body_title_,
+            graph=graph_,
+            senior_posts=len(senior_posts) - num_eliminated_senior_posts,
+            junior_posts=len(junior_posts) if junior_posts is not None else None,
+            source_files=repr(dict(source_files)),
+            num_source_files=len(source_files),
+            )
+    bar = ThroughputBar('Reading posts from organizations',
+                        max=len(pairs_to_do))
+    with open(checkpoint_filename, 'wb') as checkpoint_file:
+        # rewrite what was done, leaving out any incomplete last line
+        write_checkpoint_options(checkpoint_file, checkpoint_options)
+        for key, pair_counts in counts_by_pair.items():
+            append_checkpoint(checkpoint_file, key, pair_counts)
+        for pair, pair_counts in imap_unordered(
+                count_posts, pairs_to_do,
+                getattr(args, 'pair_concurrency', 1)):
+            counts_by_pair[pair[1:]] = pair_counts
+            append_checkpoint(checkpoint_file, pair[1:], pair_counts)
+            bar.next()
+    bar.finish()
+    # in the same order as the departments CSV, whatever order they finished
+    counts = [counts_by_pair[pair[1:]] for pair in pairs]
     # save
     if not (body_title or graph):
         headers = ['body_title', 'graph', 'senior_posts', 'junior_posts', 'source_files', 'num_source_files']
@@ -406,6 +534,7 @@ def triplestore_post_counts(body_title, graph):
             from pprint import pprint
             pprint(counts[0])
         print 'Not written counts because of filters make them incomplete'
+    os.remove(checkpoint_filename)
 
 
 
@@ -442,6 +571,122 @@ def triplestore_post_counts_all_departments():
     print 'Written', out_filename
 
 def get_triplestore_parent_department(body_uri, graph, print_urls=False):
+    '''Returns the label of the body's parent department in the graph (or
+    the body's own label, if it is a department). They are memoized - see
+    prefetch_triplestore_parent_departments().'''
+    parent_departments = get_parent_departments_memo()
+    if (body_uri, graph) not in parent_departments:
+        primary_topic = get_triplestore_body_item(body_uri, graph,
+                                                  print_urls=print_urls)
+        memoize_parent_departments({(body_uri, graph): parent_department_label(
+            body_uri, primary_topic)})
+    return parent_departments[(body_uri, graph)]
+
+
+def prefetch_triplestore_parent_departments(body_graphs, print_urls=False):
+    '''Resolves the parent departments of all the (body_uri, graph) pairs
+    that aren't already memoized. With --sparql/--snapshot it is one query per
+    body, for all its graphs. The linked data API has a document per body and
+    graph, so those are fetched concurrently.'''
+    parent_departments = get_parent_departments_memo()
+    graphs_by_body = OrderedDict()
+    for body_uri, graph in body_graphs:
+        if (body_uri, graph) not in parent_departments:
+            graphs_by_body.setdefault(body_uri, []).append(graph)
+    if not graphs_by_body:
+        return
+    print 'Getting the parent departments of %s bodies' % len(graphs_by_body)
+    crawler = get_crawler()
+    snapshot = get_triplestore_snapshot()
+    if snapshot is not None:
+        # the lookups are local, and the snapshot's SQLite connection can
+        # only be used in this thread, so not done in the crawler's threads
+        items_by_body = dict(
+            (body_uri, triplestore_sparql.get_body_items_by_graph(
+                body_uri, graphs, snapshot=snapshot))
+            for body_uri, graphs in graphs_by_body.items())
+    elif getattr(args, 'sparql', False):
+        items_by_body = crawler.map_unique(
+            lambda body_uri: triplestore_sparql.get_body_items_by_graph(
+                body_uri, graphs_by_body[body_uri],
+                sparql_endpoint=getattr(args, 'sparql_endpoint',
+                                        NEW_SPARQL_ENDPOINT)),
+            graphs_by_body.keys())
+    else:
+        items_by_body = None
+    if items_by_body is not None:
+        items_by_pair = dict(((body_uri, graph), item)
+                             for body_uri, items in items_by_body.items()
+                             for graph, item in items.items())
+    else:
+        def get_body_item(pair):
+            try:
+                return get_triplestore_body_item(*pair, print_urls=print_urls)
+            except requests.RequestException:
+                # leave it to get_triplestore_parent_department to complain
+                # about
+                return None
+        items_by_pair = crawler.map_unique(
+            get_body_item,
+            [(body_uri, graph) for body_uri, graphs in graphs_by_body.items()
+             for graph in graphs])
+    # match_to_dgu_dept might ask the user, so not done in the threads
+    labels = {}
+    for (body_uri, graph), item in sorted(items_by_pair.items()):
+        try:
+            labels[(body_uri, graph)] = parent_department_label(body_uri,
+                                                                item)
+        except (KeyError, IndexError, TypeError):
+            # e.g. the body isn't in the graph - leave it to
+            # get_triplestore_parent_department to complain about
+            continue
+    memoize_parent_departments(labels)
+
+
+def get_triplestore_source():
+    '''Returns where the triplestore data is got from - the --snapshot, the
+    --sparql endpoint or the linked data API.'''
+    snapshot_path = getattr(args, 'snapshot', None)
+    if snapshot_path:
+        return 'snapshot %s' % os.path.abspath(snapshot_path)
+    if getattr(args, 'sparql', False):
+        return 'sparql %s' % getattr(args, 'sparql_endpoint',
+                                     NEW_SPARQL_ENDPOINT)
+    return 'linked data API'
+
+
+def get_parent_departments_memo():
+    '''Returns the memo of {(body_uri, graph): parent department label},
+    loading what previous runs resolved from the same source (see
+    get_triplestore_source), unless --refresh-parent-departments. (The
+    triplestore graphs don't change, so neither do the labels - unless a
+    match to a DGU department was answered wrongly.)'''
+    global parent_departments
+    if parent_departments is None:
+        parent_departments = {}
+        if not getattr(args, 'refresh_parent_departments', False):
+            source = get_triplestore_source()
+            for key, label in load_checkpoint(
+                    PARENT_DEPARTMENTS_FILENAME).items():
+                # key is (source, body_uri, graph)
+                if len(key) == 3 and key[0] == source:
+                    parent_departments[key[1:]] = label
+    return parent_departments
+
+
+def memoize_parent_departments(labels):
+    '''labels - {(body_uri, graph): parent department label}'''
+    get_parent_departments_memo().update(labels)
+    if labels:
+        source = get_triplestore_source()
+        with open(PARENT_DEPARTMENTS_FILENAME, 'ab') as f:
+            for (body_uri, graph), label in sorted(labels.items()):
+                append_checkpoint(f, [source, body_uri, graph], label)
+
+
+def get_triplestore_body_item(body_uri, graph, print_urls=False):
+    '''Returns the linked data API's item for the body (department etc.)
+    in the graph.'''
     # body_uri
     # http://reference.data.gov.uk/id/department/co
     # http://reference.data.gov.uk/id/public-body/consumer-focus
@@ -454,10 +699,22 @@ def get_triplestore_parent_department(body_uri, graph, print_urls=False):
         graph=graph,
         body_type=body_type,
         body_name=quote(body_name))
+    snapshot = get_triplestore_snapshot()
+    if snapshot is not None or getattr(args, 'sparql', False):
+        return triplestore_sparql.get_body_item(
+            body_uri, graph,
+            sparql_endpoint=getattr(args, 'sparql_endpoint',
+                                    NEW_SPARQL_ENDPOINT),
+            snapshot=snapshot)
     if print_urls:
         print 'Getting: ', url
-    response = requests.get(url)
-    primary_topic = response.json()['result']['primaryTopic']
+    response = http_client.get_client().get(url)
+    return response.json()['result']['primaryTopic']
+
+
+def parent_department_label(body_uri, primary_topic):
+    body_type = \
+        re.match('http://reference.data.gov.uk/id/(.*)/(.*)', body_uri).group(1)
     if body_type == 'department':
         # in the spreadsheet, a department's parent is itself
         label = primary_topic['label'][0]
@@ -478,12 +735,11 @@ def get_triplestore_parent_department(body_uri, graph, print_urls=False):
     #match = match_to_dgu_dept(parent_department_uri, label)
     #return match['title']
 
-def canonize_value(value):
-    value = value.strip(' \'\"\.').lower()  # remove enclosing junk
-    value = re.sub('(and|the)', '', value)  # remove stop words
-    value = re.sub('[^a-z0-9]', '', value)  # leave only chars
-    value = re.sub('\s+', ' ', value)  # no double spaces
-    return value
+def in_worker_thread():
+    '''Returns whether this is one of the --pair-concurrency threads. They
+    can't share the terminal for pdb, so they raise errors instead, and
+    imap_unordered raises them again in the main thread.'''
+    return threading.current_thread().name != 'MainThread'
 
 def get_value(value, dict_key='label', list_index=None,
               multiple_ok=False):
@@ -520,6 +776,8 @@ def get_value(value, dict_key='label', list_index=None,
             deduped_values.append(value__)
             deduped_canonized_values.append(canonized_value)
         if len(deduped_values) > 1 and not multiple_ok:
+            if in_worker_thread():
+                raise ValueError('Which value is it? %r' % deduped_values)
             print 'Which value is it?', deduped_values
             import pdb; pdb.set_trace()
         return '; '.join(deduped_values)
@@ -531,6 +789,48 @@ def get_value(value, dict_key='label', list_index=None,
         import pdb; pdb.set_trace()
         raise NotImplementedError
 
+class PostRecord(object):
+    '''A post got from the triplestore. The fields are __slots__, rather than
+    a dict, because a whole graph's posts are held in memory until they are
+    saved. Fields not given are None. post['field'] works too.'''
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError('Unknown fields for %s: %s' % (
+                self.__class__.__name__, ', '.join(sorted(fields))))
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % (name, getattr(self, name))
+            for name in self.__slots__))
+
+
+class SeniorPost(PostRecord):
+    '''A senior post - one per holder of the post'''
+    __slots__ = ('uri', 'label', 'comment', 'unit', 'note', 'reports_to_uri',
+                 'status', 'name', 'fte', 'profession', 'email', 'phone',
+                 'salary_range', 'grade', 'source_file', 'source_line',
+                 'salary_cost_of_reports')
+
+
+class JuniorPost(PostRecord):
+    __slots__ = ('uri', 'reports_to', 'row_index', 'unit', 'fte', 'grade',
+                 'salary_range', 'job_title', 'profession', 'source_file',
+                 'source_line')
+
+
 def get_triplestore_posts(body_uri, graph, print_urls=False):
     # body_uri
     # http://reference.data.gov.uk/id/department/co
@@ -541,12 +841,13 @@ def get_triplestore_posts(body_uri, graph, print_urls=False):
     # http://reference.data.gov.uk/2015-09-30/doc/department/co/post.json?_page=1
     # http://reference.data.gov.uk/2012-09-30/doc/public-body/consumer-focus/post?_page=1
     url_base = 'http://reference.data.gov.uk/{graph}/doc/{body_type}/{body_name}/post.json?_page={page}'
-    page = 1
     senior_posts = []
     source_files = defaultdict(int)
+    crawler = get_crawler()
 
     def get_posts_from_triplestore_item(item):
         posts = []
+        # the fields common to each holder of the post
         post = {}
         post['uri'] = item['_about']
         post['label'] = item['label'][0]
@@ -577,73 +878,79 @@ def get_triplestore_posts(body_uri, graph, print_urls=False):
         # We save this as two or more "post_"s as that is how it is
         # represented in the organogram CSV.
         for i, held_by in enumerate(held_by_list):
-            post_ = copy.deepcopy(post)
             if isinstance(held_by, basestring):
                 # Some posts have a URI in the heldBy list, which is a duplicate we can ignore
                 # e.g. http://reference.data.gov.uk/2011-03-31/doc/public-body/ofqual/post.json?_page=1
                 continue
-            post_['source_file'], post_['source_line'] = \
+            post_ = SeniorPost(**post)
+            post_.source_file, post_.source_line = \
                 parse_source(held_by['_about'])
-            source_files[post_['source_file']] += 1
-            post_['name'] = held_by.get('name', '')
-            post_['fte'] = get_value(held_by.get('tenure'), 'workingTime', list_index=i)
+            source_files[post_.source_file] += 1
+            post_.name = held_by.get('name', '')
+            post_.fte = get_value(held_by.get('tenure'), 'workingTime', list_index=i)
 
             if 'profession' in held_by:
                 profession_values = get_value(held_by['profession'], dict_key='prefLabel')
                 profession = profession_values
             else:
                 profession = None
-            post_['profession'] = profession
+            post_.profession = profession
 
-            post_['email'] = get_value(held_by.get('email'), 'label', list_index=i)
-            post_['phone'] = get_value(held_by.get('phone'), 'label', list_index=i)
-            post_['salary_range'] = get_value(
+            post_.email = get_value(held_by.get('email'), 'label', list_index=i)
+            post_.phone = get_value(held_by.get('phone'), 'label', list_index=i)
+            post_.salary_range = get_value(
                 item.get('salaryRange'), list_index=i)
-            post_['grade'] = get_value(item.get('grade'), list_index=i)
+            post_.grade = get_value(item.get('grade'), list_index=i)
             posts.append(post_)
         if not held_by_list:
             # Some posts have no heldBy
             # e.g. http://reference.data.gov.uk/id/public-body/animal-health-veterinary-laboratories-agency/post/12 2011-03-31
             # so just record what we have
-            post_ = copy.deepcopy(post)
-            post_['name'] = ''
-            post_['fte'] = ''
-            post_['profession'] = ''
-            post_['email'] = ''
-            post_['phone'] = ''
-            # multiples usually mean 2 posts have the same ID but different
-            # values, which is a mistake in the spreadsheet
-            post_['salary_range'] = get_value(item.get('salaryRange'),
-                                              list_index=0)
-            post_['grade'] = get_value(item.get('grade'), list_index=0)
-            post_['source_file'] = ''
-            post_['source_line'] = ''
-            posts.append(post_)
+            posts.append(SeniorPost(
+                name='', fte='', profession='', email='', phone='',
+                # multiples usually mean 2 posts have the same ID but
+                # different values, which is a mistake in the spreadsheet
+                salary_range=get_value(item.get('salaryRange'),
+                                       list_index=0),
+                grade=get_value(item.get('grade'), list_index=0),
+                source_file='', source_line='', **post))
 
         return posts
 
-    while True:
-        url = url_base.format(
-            graph=graph,
-            body_type=body_type,
-            body_name=quote(body_name),
-            page=page)
-        if print_urls:
-            print 'Getting: ', url
-        response = requests.get(url)
-        items = response.json()['result']['items']
-        for item in items:
-            try:
-                posts = get_posts_from_triplestore_item(item)
-                senior_posts.extend(posts)
-            except Exception:
-                traceback.print_exc()
-                import pdb; pdb.set_trace()
-        # is there another page?
-        per_page = response.json()['result']['itemsPerPage']
-        if len(items) < per_page:
-            break
-        page += 1
+    snapshot = get_triplestore_snapshot()
+    if snapshot is not None or getattr(args, 'sparql', False):
+        # get all the posts (and juniors) in a couple of big queries (or
+        # lookups in the snapshot), rather than a request per page/post
+        sparql_senior_items, sparql_junior_items = \
+            triplestore_sparql.get_post_items(
+                body_uri, graph, junior=args.junior,
+                sparql_endpoint=getattr(args, 'sparql_endpoint',
+                                        NEW_SPARQL_ENDPOINT),
+                print_queries=print_urls, snapshot=snapshot)
+        # like the linked data API, leave out the eliminated posts, unless
+        # they are missing bosses
+        items = [item for item in sparql_senior_items
+                 if not triplestore_sparql.is_eliminated(item)]
+        sparql_items_by_uri = dict((item['_about'], item)
+                                   for item in sparql_senior_items)
+    else:
+        items = crawler.get_paged_items(
+            lambda page: url_base.format(
+                graph=graph,
+                body_type=body_type,
+                body_name=quote(body_name),
+                page=page),
+            print_url=print_urls)
+        sparql_items_by_uri = sparql_junior_items = None
+    for item in items:
+        try:
+            posts = get_posts_from_triplestore_item(item)
+            senior_posts.extend(posts)
+        except Exception:
+            if in_worker_thread():
+                raise
+            traceback.print_exc()
+            import pdb; pdb.set_trace()
 
     # Get any missing bosses
     # e.g. this MOD post reports to an Eliminated post which is not returned by
@@ -653,72 +960,84 @@ def get_triplestore_posts(body_uri, graph, print_urls=False):
     # post, so that they are not orphaned.
     # http://reference.data.gov.uk/2012-03-31/doc/department/mod/post/00109782.json
     num_eliminated_senior_posts = 0
-    boss_to_post_uri = dict((post['reports_to_uri'], post['uri'])
-                            for post in senior_posts)
-    post_uris = set(post['uri'] for post in senior_posts)
-    missing_posts = set(boss_to_post_uri.keys()) \
+    # reverse index, so that the posts reporting to an eliminated post can be
+    # found without scanning all the posts
+    posts_by_boss_uri = defaultdict(list)
+    for post in senior_posts:
+        posts_by_boss_uri[post.reports_to_uri].append(post)
+    post_uris = set(post.uri for post in senior_posts)
+    missing_posts = set(posts_by_boss_uri.keys()) \
         - post_uris \
         - set(('XX', 'xx', None, ''))
     if missing_posts:
         print 'Missing posts: ', missing_posts
-        for post_uri in missing_posts:
+
+        def missing_post_url(post_uri):
             #e.g. http://reference.data.gov.uk/id/department/mod/post/00105232
-            url = post_uri.replace('/id/',
-                                   '/{graph}/doc/'.format(graph=graph)) \
+            return post_uri.replace('/id/',
+                                    '/{graph}/doc/'.format(graph=graph)) \
                 + '.json'
-            if print_urls:
-                print 'Getting: ', url
-            response = requests.get(url)
-            item = response.json()['result']['primaryTopic']
+        if sparql_items_by_uri is not None:
+            items_by_uri = dict((post_uri, sparql_items_by_uri.get(post_uri, {}))
+                                for post_uri in missing_posts)
+        else:
+            # get them all at once, rather than one after the other
+            items_by_uri = crawler.map_unique(
+                lambda post_uri: crawler.get_json(
+                    missing_post_url(post_uri),
+                    print_url=print_urls)['result']['primaryTopic'],
+                sorted(missing_posts))
+        eliminated_posts = []
+        for post_uri in sorted(missing_posts):
+            item = items_by_uri[post_uri]
             try:
                 if not 'label' in item:
                     # this means the triplestore doesn't have the item
                     # which can happen pre 2016 when things weren't validated
                     print 'Warning: Missing post %s (boss of %s) is not in the triplestore '\
-                        'either: %s' % (post_uri, boss_to_post_uri.get(post_uri), url)
+                        'either: %s' % (post_uri,
+                                        posts_by_boss_uri[post_uri][0].uri,
+                                        missing_post_url(post_uri))
                     continue
                 posts = get_posts_from_triplestore_item(item)
                 # just check it is eliminated
                 for post in posts:
-                    assert post['name'] == 'Eliminated' or \
-                        post['status'] in ('Eliminated', 'http://reference.data.gov.uk/def/civil-service-post-status/eliminated') or \
-                        post['uri'] == 'http://reference.data.gov.uk/id/public-body/health-education-england/post/NORTH029'  # not sure why it's missing
-                # record the eliminated post
-                senior_posts.extend(posts)
-                num_eliminated_senior_posts += len(posts)
-                # change the post that reported to the eliminated post to
-                # report to the eliminated post's boss
-                for eliminated_post in posts:
-                    for post in senior_posts:
-                        if post['reports_to_uri'] == eliminated_post['uri']:
-                            post['reports_to_uri'] = eliminated_post['reports_to_uri']
-
+                    assert post.name == 'Eliminated' or \
+                        post.status in ('Eliminated', 'http://reference.data.gov.uk/def/civil-service-post-status/eliminated') or \
+                        post.uri == 'http://reference.data.gov.uk/id/public-body/health-education-england/post/NORTH029'  # not sure why it's missing
+                eliminated_posts.extend(posts)
             except Exception:
+                if in_worker_thread():
+                    raise
                 traceback.print_exc()
                 import pdb; pdb.set_trace()
+        # record the eliminated posts
+        senior_posts.extend(eliminated_posts)
+        num_eliminated_senior_posts += len(eliminated_posts)
+        for post in eliminated_posts:
+            posts_by_boss_uri[post.reports_to_uri].append(post)
+        # change the posts that reported to an eliminated post to report to
+        # the eliminated post's boss
+        bypass_eliminated_posts(eliminated_posts, posts_by_boss_uri)
 
     # include_salary_cost_of_reports
     # http://reference.data.gov.uk/2012-09-30/doc/public-body/advisory-conciliation-and-arbitration-service/post/1/statistics.json
     if args.include_salary_cost_of_reports:
         url_base = 'http://reference.data.gov.uk/{graph}/doc/{body_type}/{body_name}/post/{post_id}/statistics.json?_page=1'
-        for senior_post in senior_posts:
-            senior_post_id = get_id_from_uri(senior_post['uri'])
+
+        def get_statistics_items(senior_post_id):
             url = url_base.format(
                 graph=graph,
                 body_type=body_type,
                 body_name=quote(body_name),
-                post_id=senior_post_id,
-                page=page)
-            if print_urls:
-                print 'Getting: ', url
-            # Retry if failure
-            for i in range(3):
-                response = requests.get(url)
-                if response.ok:
-                    break
-                else:
-                    print "Failed request: %s" % response.reason
-            items = response.json()['result']['items']
+                post_id=senior_post_id)
+            return crawler.get_json(url, print_url=print_urls)['result']['items']
+        items_by_post_id = crawler.map_unique(
+            get_statistics_items,
+            [get_id_from_uri(senior_post.uri)
+             for senior_post in senior_posts])
+        for senior_post in senior_posts:
+            items = items_by_post_id[get_id_from_uri(senior_post.uri)]
             # expect 2 items - one has the salary and the other is something
             # about 'total pay' but just seems to repeat basic info
             if not items:
@@ -737,11 +1056,16 @@ def get_triplestore_posts(body_uri, graph, print_urls=False):
                     post['salary_cost_of_reports'] = \
                         item['salaryCostOfReports']
                 except Exception:
+                    if in_worker_thread():
+                        raise
                     traceback.print_exc()
                     import pdb; pdb.set_trace()
             if 'salary_cost_of_reports' not in post:
+                if in_worker_thread():
+                    raise ValueError('No salary cost of reports for %s'
+                                     % senior_post.uri)
                 import pdb; pdb.set_trace()
-            senior_post['salary_cost_of_reports'] = \
+            senior_post.salary_cost_of_reports = \
                 post['salary_cost_of_reports']
 
     if not args.junior:
@@ -751,87 +1075,107 @@ def get_triplestore_posts(body_uri, graph, print_urls=False):
     # https://secure-reference.data.gov.uk/2012-09-30/doc/public-body/consumer-focus/post/CE1/immediate-junior-staff
     url_base = 'http://reference.data.gov.uk/{graph}/doc/{body_type}/{body_name}/post/{post_id}/immediate-junior-staff.json?_page={page}'
     junior_posts = []
-    for senior_post in senior_posts:
-        page = 1
-        senior_post_id=get_id_from_uri(senior_post['uri'])
-        while True:
-            url = url_base.format(
+
+    def get_junior_items(senior_post_id):
+        return crawler.get_paged_items(
+            lambda page: url_base.format(
                 graph=graph,
                 body_type=body_type,
                 body_name=quote(body_name),
                 post_id=senior_post_id,
-                page=page)
-            if print_urls:
-                print 'Getting: ', url
-            # Retry if failure
-            for i in range(3):
-                response = requests.get(url)
-                if response.ok:
-                    break
-                else:
-                    print "Failed request: %s" % response.reason
-            items = response.json()['result']['items']
-            for item in items:
-                try:
-                    post = {}
-                    post['uri'] = item['_about']
-                    post['source_file'], post['source_line'] = \
-                        parse_source(item['_about'])
-                    source_files[post['source_file']] += 1
-                    post['reports_to'] = senior_post_id
-                    post['row_index'] = \
-                        int(post['uri'].split('#juniorPosts')[-1])
-                    post['unit'] = get_value(item['inUnit'])
-                    post['fte'] = item['fullTimeEquivalent']
-                    if 'atGrade' in item:
-                        post['grade'] = get_value(
-                            item['atGrade'], dict_key='prefLabel',
+                page=page),
+            print_url=print_urls)
+    if sparql_junior_items is not None:
+        items_by_post_id = defaultdict(list)
+        for item in sparql_junior_items:
+            senior_post_uri = get_value(item['reportingTo'],
+                                        dict_key='_about', list_index=0)
+            items_by_post_id[get_id_from_uri(senior_post_uri)].append(item)
+    else:
+        items_by_post_id = crawler.map_unique(
+            get_junior_items,
+            [get_id_from_uri(senior_post.uri)
+             for senior_post in senior_posts])
+    for senior_post in senior_posts:
+        senior_post_id = get_id_from_uri(senior_post.uri)
+        for item in items_by_post_id[senior_post_id]:
+            try:
+                post = JuniorPost()
+                post.uri = item['_about']
+                post.source_file, post.source_line = \
+                    parse_source(item['_about'])
+                source_files[post.source_file] += 1
+                post.reports_to = senior_post_id
+                post.row_index = \
+                    int(post.uri.split('#juniorPosts')[-1])
+                post.unit = get_value(item['inUnit'])
+                post.fte = item['fullTimeEquivalent']
+                if 'atGrade' in item:
+                    post.grade = get_value(
+                        item['atGrade'], dict_key='prefLabel',
+                        list_index=0)
+                    if 'salaryRange' in item['atGrade']['payband']:
+                        # Sometimes you see multiple salary ranges for a
+                        # payband. e.g. http://reference.data.gov.uk/2015-03-31/doc/department/mod/post/00001495/immediate-junior-staff.json?_page=1
+                        # juniorPosts30 due to the two XLSs being loaded
+                        # incorrectly for DSTL against one period - 09/2015
+                        # and 03/2015 for the 03/2015 period. Ignore one.
+                        post.salary_range = get_value(
+                            item['atGrade']['payband']['salaryRange'],
                             list_index=0)
-                        if 'salaryRange' in item['atGrade']['payband']:
-                            # Sometimes you see multiple salary ranges for a
-                            # payband. e.g. http://reference.data.gov.uk/2015-03-31/doc/department/mod/post/00001495/immediate-junior-staff.json?_page=1
-                            # juniorPosts30 due to the two XLSs being loaded
-                            # incorrectly for DSTL against one period - 09/2015
-                            # and 03/2015 for the 03/2015 period. Ignore one.
-                            post['salary_range'] = get_value(
-                                item['atGrade']['payband']['salaryRange'],
-                                list_index=0)
-                        else:
-                            post['salary_range'] = get_value(
-                                item['atGrade']['payband'], dict_key='_about',
-                                list_index=0)
-                    else:
-                        # sheet AirSalarySpreadsheetAsAt1Apr2016.xls junior row
-                        # 300 has has a grade which is a reference to another
-                        # cell, which validates, but gets lost on TSO import.
-                        post['grade'] = None
-                        post['salary_range'] = None
-                    if 'withJob' in item:
-                        post['job_title'] = get_value(item[
-                            'withJob'], dict_key='prefLabel', list_index=0)
                     else:
-                        post['job_title'] = item['label'][0]
-
-                    if 'withProfession' in item:
-                        profession_values = get_value(
-                            item['withProfession'], dict_key='prefLabel',
+                        post.salary_range = get_value(
+                            item['atGrade']['payband'], dict_key='_about',
                             list_index=0)
-                        profession = profession_values
-                    else:
-                        profession = None
-                    post['profession'] = profession
-                except Exception:
-                    traceback.print_exc()
-                    import pdb; pdb.set_trace()
-                junior_posts.append(post)
-            # is there another page?
-            per_page = response.json()['result']['itemsPerPage']
-            if len(items) < per_page:
-                break
-            page += 1
+                else:
+                    # sheet AirSalarySpreadsheetAsAt1Apr2016.xls junior row
+                    # 300 has has a grade which is a reference to another
+                    # cell, which validates, but gets lost on TSO import.
+                    post.grade = None
+                    post.salary_range = None
+                if 'withJob' in item:
+                    post.job_title = get_value(item[
+                        'withJob'], dict_key='prefLabel', list_index=0)
+                else:
+                    post.job_title = item['label'][0]
+
+                if 'withProfession' in item:
+                    profession_values = get_value(
+                        item['withProfession'], dict_key='prefLabel',
+                        list_index=0)
+                    profession = profession_values
+                else:
+                    profession = None
+                post.profession = profession
+            except Exception:
+                if in_worker_thread():
+                    raise
+                traceback.print_exc()
+                import pdb; pdb.set_trace()
+            junior_posts.append(post)
     return senior_posts, junior_posts, num_eliminated_senior_posts, source_files
 
 
+def bypass_eliminated_posts(eliminated_posts, posts_by_boss_uri):
+    '''Changes the posts that report to an eliminated post to report to its
+    boss instead - or to its boss's boss, if that is eliminated too, and so
+    on.
+
+    posts_by_boss_uri - {reports_to_uri: [post, ...]} of all the senior posts
+    '''
+    boss_uri_by_eliminated_uri = dict(
+        (post.uri, post.reports_to_uri) for post in eliminated_posts)
+    for eliminated_uri in boss_uri_by_eliminated_uri:
+        boss_uri = boss_uri_by_eliminated_uri[eliminated_uri]
+        chain = set((eliminated_uri,))
+        while boss_uri in boss_uri_by_eliminated_uri and \
+                boss_uri not in chain:
+            chain.add(boss_uri)
+            boss_uri = boss_uri_by_eliminated_uri[boss_uri]
+        for post in posts_by_boss_uri.get(eliminated_uri, []):
+            post.reports_to_uri = boss_uri
+
+
 def parse_source(source_uri):
     # http://organogram.data.gov.uk/data/cabinetoffice/2015-09-30/CO-Template-FINAL#person73
     if '#' not in source_uri:
@@ -901,7 +1245,39 @@ if __name__ == '__main__':
     parser.add_argument('--junior', action='store_true',
                         help='Include junior posts too (expensive op)')
     parser.add_argument('--include-salary-cost-of-reports', action='store_true', help='Include the salary in the senior sheet (expensive op)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Maximum number of requests to the triplestore '
+                             'at once, when getting the junior posts and '
+                             'salary cost of reports')
+    parser.add_argument('--pair-concurrency', type=int, default=4,
+                        help='triplestore-counts: number of (body, graph) '
+                             'pairs to get at once')
+    parser.add_argument('--restart', action='store_true',
+                        help='triplestore-counts: start again, rather than '
+                             'resume from the checkpoint of an interrupted '
+                             'run')
+    parser.add_argument('--refresh-parent-departments', action='store_true',
+                        help='triplestore-to-csv: resolve the parent '
+                             'departments again, rather than use those '
+                             'memoized by previous runs')
+    parser.add_argument('--sparql', action='store_true',
+                        help='Get the posts with bulk SPARQL queries, '
+                             'rather than crawling the linked data API')
+    parser.add_argument('--sparql-endpoint', default=NEW_SPARQL_ENDPOINT,
+                        help='SPARQL endpoint for --sparql '
+                             '(default: %(default)s)')
+    parser.add_argument('--snapshot',
+                        help='Get the posts from this local snapshot of the '
+                             'triplestore (see triplestore_snapshot.py), '
+                             'rather than the live one')
+    http_client.add_http_arguments(parser, cache=True)
     args = parser.parse_args()
+    if args.snapshot and args.include_salary_cost_of_reports:
+        parser.error('--include-salary-cost-of-reports is not available '
+                     'from a --snapshot')
+    http_client.configure_client_from_args(
+        args, min_pool_size=args.concurrency * args.pair_concurrency,
+        cache_namespace='compare_posts')
     if args.input == 'triplestore-to-csv':
         assert (args.body or args.graph or args.where_uploads_unreliable), 'Please supply a --body or --graph filter or --where-uploads-unreliable'
         triplestore_posts_to_csv(args.body, args.graph, args.where_uploads_unreliable)
@@ -913,3 +1289,4 @@ if __name__ == '__main__':
         compare()
     else:
         raise NotImplementedError
+    http_client.print_stats_from_args(args)
@@ -29,7 +29,7 @@ import argparse
 from pprint import pprint
 import sys
 
-import requests
+import http_client
 
 args = None
 
@@ -162,7 +162,8 @@ def _run_query(query, graph, legacy_endpoint):
     if not args.query_quiet:
         print sparql_endpoint
         print query
-    resp = requests.post(sparql_endpoint, data={'query': query})
+    resp = http_client.get_client().post_query(
+        sparql_endpoint, data={'query': query}, raise_for_status=False)
     if not resp.ok:
         if resp.text.startswith('Invalid knowledge base name'):
             raise InvalidGraph
@@ -216,6 +217,7 @@ if __name__ == '__main__':
         dest='query_quiet',
         action='store_true',
         help='Don\'t display the queries made')
+    http_client.add_http_arguments(parser)
     subparsers = parser.add_subparsers()
 
     # create simple subparsers for commands which don't already have one
@@ -228,6 +230,8 @@ if __name__ == '__main__':
             parser_properties = subparsers.add_parser(name)
             parser_properties.set_defaults(func=func)
     args = parser.parse_args()
+    http_client.configure_client_from_args(args)
 
     # call the function
     args.func()
+    http_client.print_stats_from_args(args)
@@ -0,0 +1,107 @@
+'''
+Fetches many JSON URLs concurrently, for crawling the triplestore's linked
+data API, where there is one URL per post.
+
+Requests go through a bounded pool of threads, which share an HttpClient (see
+http_client.py), so connections to each host are pooled and reused and failed
+requests are retried. Results are returned in the same order as the input, so
+the output doesn't depend on which request finishes first.
+
+Example:
+
+from crawler import Crawler
+crawler = Crawler(concurrency=8)
+items_per_post = crawler.map(
+    lambda post_id: crawler.get_paged_items(
+        lambda page: url_base.format(post_id=post_id, page=page)),
+    post_ids)
+'''
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from http_client import get_client
+
+DEFAULT_CONCURRENCY = 8
+
+
+class Crawler(object):
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, client=None):
+        '''
+        concurrency - maximum number of requests at once
+        client - HttpClient to use (default: the shared one). Its pool_size
+                 should be at least the concurrency.
+        '''
+        self.concurrency = concurrency
+        if client is None:
+            client = get_client()
+        self.client = client
+
+    def get(self, url, print_url=False):
+        '''GETs the URL, retrying failures. Returns the response, or raises
+        a requests exception if it fails after the retries.'''
+        if print_url:
+            print 'Getting: ', url
+        return self.client.get(url)
+
+    def get_json(self, url, print_url=False):
+        return self.get(url, print_url=print_url).json()
+
+    def get_paged_items(self, url_for_page, print_url=False):
+        '''Gets the items from all the pages of a linked data API list.
+
+        url_for_page - function that returns the URL for a page number
+        '''
+        items = []
+        page = 1
+        while True:
+            result = self.get_json(url_for_page(page),
+                                   print_url=print_url)['result']
+            items.extend(result['items'])
+            # is there another page?
+            if len(result['items']) < result['itemsPerPage']:
+                return items
+            page += 1
+
+    def map(self, function, values):
+        '''Calls function(value) for each of the values, concurrently.
+        Returns the results in the same order as the values. If any call
+        raises, the exception is raised once they have all finished.'''
+        values = list(values)
+        if self.concurrency <= 1 or len(values) <= 1:
+            return map(function, values)
+        pool = ThreadPool(min(self.concurrency, len(values)))
+        try:
+            return pool.map(function, values, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def map_unique(self, function, values):
+        '''Like map, but calls the function once for each distinct value.
+        Returns a dict of {value: result}.'''
+        unique_values = list(OrderedDict.fromkeys(values))
+        return dict(zip(unique_values, self.map(function, unique_values)))
+
+
+def imap_unordered(function, values, concurrency):
+    '''Calls function(value) for each of the values, up to concurrency at
+    once, yielding (value, result) as each call finishes. If a call raises,
+    the exception is raised and the calls not yet started are abandoned.'''
+    values = list(values)
+    if concurrency <= 1 or len(values) <= 1:
+        for value in values:
+            yield value, function(value)
+        return
+    pool = ThreadPool(min(concurrency, len(values)))
+    try:
+        for value_and_result in pool.imap_unordered(
+                lambda value: (value, function(value)), values):
+            yield value_and_result
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -10,9 +10,17 @@ import argparse
 import csv
 import os
 import traceback
+try:
+    import xlsxwriter
+except ImportError:
+    # only needed for sheets too long for XLS
+    xlsxwriter = None
 
 args = None
 
+# including the header row
+XLS_MAX_ROWS = 65536
+
 
 XLS_COL_HEADERS = {
     'senior': (
@@ -65,52 +73,29 @@ def csv2xls(senior_or_junior_csv_filepath):
     xls_filepath = filepath_for_xls_from_triplestore_from_csv_filepath(
         senior_or_junior_csv_filepath)
 
-    workbook = xlwt.Workbook()
+    # the CSVs are counted first, to see if they fit in an XLS
+    num_rows = dict((level, count_csv_rows(csv_filepath))
+                    for level, csv_filepath in csv_filepaths.items())
+    if max(num_rows.values()) + 1 > XLS_MAX_ROWS:
+        print 'Too many rows for XLS - writing XLSX: %r' % num_rows
+        xls_filepath = xls_filepath + 'x'
+        workbook = XlsxWorkbook(xls_filepath)
+    else:
+        workbook = XlsWorkbook(xls_filepath)
+
     row_counts = {}
     units = set()
     for level, csv_filepath in csv_filepaths.items():
-        # Read CSV
-        with open(csv_filepath, 'rb') as csv_read_file:
-            csv_reader = unicodecsv.reader(csv_read_file)
-            csv_headers = csv_reader.next()
-            # Append None to each row, as a placeholder for 'Total Pay'/'Valid'
-            csv_rows = [row + [None, None] for row in csv_reader]
-
-        # Adjust CSV
-        if level == 'senior':
-            if 'Grade' in csv_headers:
-                csv_headers[csv_headers.index('Grade')] = \
-                    'Grade (or equivalent)'
-        csv_headers.append(u'Total Pay (£)')
-        if level == 'junior':
-            csv_headers.append('Valid?')
-        # column mapping - for each of the XLS columns it gives the CSV column
-        cols_map = [csv_headers.index(xls_col)
-                    for xls_col in XLS_COL_HEADERS[level]]
-        out_rows = [XLS_COL_HEADERS[level]]
-        row_count = 0
-        for row in sorted(csv_rows, key=lambda r: number_if_possible(r[0])):
-            out_row = [row[csv_col_index] for csv_col_index in cols_map]
-            for col_index in XLS_COLS_THAT_SHOULD_BE_NUMBERS[level]:
-                out_row[col_index] = number_if_possible(out_row[col_index])
-            out_rows.append(out_row)
-            row_count += 1
-
         sheet = workbook.add_sheet('(final data) %s-staff' % level)
-        for r, row in enumerate(out_rows):
-            for c, value in enumerate(row):
-                sheet.write(r, c, value)
-        row_counts[level] = row_count
-
-        for row in csv_rows:
-            units.add(row[csv_headers.index('Unit')])
+        row_counts[level] = write_level_sheet(sheet, level, csv_filepath,
+                                              units)
 
     sheet = workbook.add_sheet('(reference) units')
     sheet.write(0, 0, 'Units')
     for r, unit in enumerate(units):
         sheet.write(r + 1, 0, unit)
 
-    workbook.save(xls_filepath)
+    workbook.save()
     print 'Written %s' % xls_filepath
     conversion = dict(
         senior_csv_filepath=csv_filepaths['junior'],
@@ -122,6 +107,90 @@ def csv2xls(senior_or_junior_csv_filepath):
     return conversion
 
 
+def write_level_sheet(sheet, level, csv_filepath, units):
+    '''Writes the senior or junior CSV to the sheet, sorted by the first
+    column. Adds the units it mentions to the units set.
+    Returns the number of posts (rows).
+    '''
+    with open(csv_filepath, 'rb') as csv_read_file:
+        csv_reader = unicodecsv.reader(csv_read_file)
+        csv_headers = csv_reader.next()
+        csv_rows = list(csv_reader)
+
+    # Adjust CSV
+    if level == 'senior':
+        if 'Grade' in csv_headers:
+            csv_headers[csv_headers.index('Grade')] = 'Grade (or equivalent)'
+    # 'Total Pay' and (junior) 'Valid?' are left blank, if not in the CSV
+    blank_cols = [u'Total Pay (£)']
+    if level == 'junior':
+        blank_cols.append('Valid?')
+    # column mapping - for each of the XLS columns it gives the CSV column
+    # (or None for a blank)
+    cols_map = []
+    for xls_col in XLS_COL_HEADERS[level]:
+        if xls_col in blank_cols and xls_col not in csv_headers:
+            cols_map.append(None)
+        else:
+            cols_map.append(csv_headers.index(xls_col))
+    number_cols = XLS_COLS_THAT_SHOULD_BE_NUMBERS[level]
+    unit_col = csv_headers.index('Unit')
+
+    for c, value in enumerate(XLS_COL_HEADERS[level]):
+        sheet.write(0, c, value)
+    csv_rows.sort(key=lambda row: number_if_possible(row[0]))
+    for r, row in enumerate(csv_rows):
+        for c, csv_col_index in enumerate(cols_map):
+            if csv_col_index is None:
+                value = None
+            else:
+                value = row[csv_col_index]
+            if c in number_cols:
+                value = number_if_possible(value)
+            sheet.write(r + 1, c, value)
+        units.add(row[unit_col])
+    return len(csv_rows)
+
+
+def count_csv_rows(csv_filepath):
+    '''Returns the number of rows in the CSV, not including the header.'''
+    with open(csv_filepath, 'rb') as csv_read_file:
+        return sum(1 for row in csv.reader(csv_read_file)) - 1
+
+
+class XlsWorkbook(object):
+    '''An XLS (xlwt) workbook, which is saved to the filepath.'''
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.workbook = xlwt.Workbook()
+
+    def add_sheet(self, name):
+        return self.workbook.add_sheet(name)
+
+    def save(self):
+        self.workbook.save(self.filepath)
+
+
+class XlsxWorkbook(object):
+    '''An XLSX workbook, for when there are too many rows for XLS. It is
+    written in xlsxwriter's constant memory mode, so each row is flushed to
+    disk when the next is started - the sheets must be written one at a time,
+    row by row.'''
+    def __init__(self, filepath):
+        if xlsxwriter is None:
+            raise ImportError('Writing XLSX needs xlsxwriter: '
+                              'pip install xlsxwriter')
+        self.filepath = filepath
+        self.workbook = xlsxwriter.Workbook(filepath,
+                                            {'constant_memory': True})
+
+    def add_sheet(self, name):
+        return self.workbook.add_worksheet(name)
+
+    def save(self):
+        self.workbook.close()
+
+
 def convert_csvs_where_uploads_unreliable():
     from compare_posts import filepath_for_csv_from_triplestore
     from tso_combined import can_we_use_the_upload_spreadsheet
@@ -5,29 +5,23 @@ import argparse
 import re
 import csv
 import unicodecsv
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import os.path
-import datetime
-import pickle
+import json
 import sys
 
-import requests_cache
-# pip install fuzzywuzzy
-# pip install python-levenshtein
-import fuzzywuzzy.process
-import fuzzywuzzy.fuzz
-# pip install progress
-from progress.bar import Bar
 import ckanapi
 
-one_day = 60 * 60 * 24
-one_month = one_day * 30
-requests_cache.install_cache('.dgu_departments.cache', expire_after=one_month)
+from candidate_index import CandidateIndex
+from normalize import canonize, canonize_column
+from org_store import OrgStore
 
 
 class DguOrgs(object):
     _instance = None
-    pickle_filename = '.dgu_departments_pickle.cache'
+    store_filename = '.dgu_departments.sqlite'
+    # refresh the orgs from DGU when they are older than this (seconds)
+    max_age = 24 * 60 * 60
 
     @classmethod
     def instance(cls):
@@ -35,56 +29,27 @@ class DguOrgs(object):
             cls._instance = cls()
         return cls._instance
 
-    def __init__(self):
-        # NB Not using all_fields as it doesn't include extras, like category
-        self._by_name = {}
-        self._by_title = {}
-        self._by_canonized_title = {}
-        self.ckanapi = ckanapi.RemoteCKAN('https://data.gov.uk',
-                                          get_only=True)
-        self.ckanapi_uncached = ckanapi.RemoteCKAN('https://data.gov.uk',
-                                          get_only=False)
-        # try cached pickle of the departments
-        if os.path.exists(self.pickle_filename) and \
-                (datetime.datetime.fromtimestamp(os.stat(self.pickle_filename).st_mtime) >
-                 (datetime.datetime.now() - datetime.timedelta(days=1))):
-            print 'Reading DGU departments from pickle cache'
-            with open(self.pickle_filename) as f:
-                orgs = pickle.load(f)
+    def __init__(self, ckan=None):
+        if ckan is None:
+            ckan = ckanapi.RemoteCKAN('https://data.gov.uk', get_only=False)
+        self.ckanapi = ckan
+        self.store = OrgStore(self.store_filename, canonize)
+        age = self.store.age()
+        if age is None or age > self.max_age:
+            # only the new and changed orgs are fetched
+            self.store.refresh(self.ckanapi)
         else:
-            org_names = self.ckanapi_uncached.action.organization_list()
-            orgs = []
-            for org_name in Bar('Reading DGU organizations').iter(org_names):
-                orgs.append(self.ckanapi.action.organization_show(id=org_name))
-            self.save(orgs)
-        for org in orgs:
-            self._record_org(org)
-
-    def _record_org(self, org):
-        # convert the extras into a dict
-        org['extras'] = dict((extra['key'], extra['value'])
-                             for extra in org['extras'])
-        self._by_name[org['name']] = org
-        self._by_title[org['title']] = org
-        self._by_canonized_title[canonize(org['title'])] = org
+            print 'Reading DGU departments from %s' % self.store_filename
+        self._by_name = self.store.by('name')
+        self._by_title = self.store.by('title')
+        self._by_canonized_title = self.store.by('canonized_title')
 
     def notify_of_new_org(self, org_name):
         '''Call this to let this know when a new org has been created on dgu'''
-        with open(self.pickle_filename) as f:
-            orgs = pickle.load(f)
-        # Do post to avoid the cache
-        ckanapi_ = ckanapi.RemoteCKAN('https://data.gov.uk',
-                                      get_only=False)
-        org = ckanapi_.action.organization_show(id=org_name)
-        orgs.append(org)
-        self.save(orgs)
-        self._record_org(org)
+        org = self.ckanapi.action.organization_show(id=org_name)
+        self.store.put(org)
         return org['title']
 
-    def save(self, orgs):
-        with open(self.pickle_filename, 'wb') as f:
-            pickle.dump(orgs, f)
-
     @classmethod
     def by_name(cls):
         return cls.instance()._by_name
@@ -97,32 +62,84 @@ class DguOrgs(object):
     def by_canonized_title(cls):
         return cls.instance()._by_canonized_title
 
-dept_char_filter_regex = re.compile('[^a-z0-9 ]')
-stop_words = set(('and', 'to', 'of', 'for', 'the'))
+
+REVIEW_QUEUE_FILENAME = 'dgu_department_review_queue.csv'
 
 
-def canonize(title):
-    '''Returns a slightly simplified version of a public body name, for ironing
-    out trivial differences when matching.'''
-    title = title.lower().strip()
-    if not title.startswith('http'):
-        title = dept_char_filter_regex.sub('', title)
-        title = ' '.join(w for w in title.split() if w not in stop_words)
-    return title
+class ReviewQueue(object):
+    '''Names that couldn't be reconciled unattended, saved for someone to
+    review. They fill in the "match" column with the number of one of the
+    suggestions, a DGU title or a https://data.gov.uk/publisher/ URL (or
+    "none" to leave it unmatched) and then the decisions are replayed into
+    the Aliases.
+    '''
+    headers = ['names', 'suggestions', 'match']
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = OrderedDict()  # {names json: row}
+        if os.path.exists(filename):
+            with open(filename, 'rb') as csv_read_file:
+                for row in csv.DictReader(csv_read_file):
+                    self.rows[row['names']] = row
+
+    def __contains__(self, names):
+        return json.dumps(list(names)) in self.rows
+
+    def add(self, names, suggestions):
+        names_json = json.dumps(list(names))
+        if names_json in self.rows:
+            return
+        self.rows[names_json] = {
+            'names': names_json,
+            'suggestions': json.dumps(suggestions),
+            'match': ''}
+        self.save()
+
+    def remove(self, names):
+        del self.rows[json.dumps(list(names))]
+
+    def reviewed(self):
+        '''Returns the names that have been given a match, as a list of
+        (names, match, suggestions).'''
+        reviewed = []
+        for row in self.rows.values():
+            match = row['match'].strip()
+            if match and match.lower() != 'none':
+                reviewed.append((tuple(json.loads(row['names'])), match,
+                                 json.loads(row['suggestions'])))
+        return reviewed
+
+    def save(self):
+        with open(self.filename, 'wb') as csv_file:
+            csv_writer = csv.DictWriter(csv_file, fieldnames=self.headers)
+            csv_writer.writeheader()
+            for row in self.rows.values():
+                csv_writer.writerow(row)
 
 
 class Aliases(object):
     _instance = None
     filename = 'dgu_department_aliases.csv'
+    score_threshold = 50
+    num_suggestions = 10
+    # in batch mode, the best suggestion is accepted if it scores at least
+    # this, and otherwise the names go in the review_queue
+    accept_score = None
+    review_queue = None
 
     def __init__(self):
         self.aliases = {}
         self.canonized_aliases = {}
+        # for suggesting matches for unknown names
+        self._dgu_title_index = CandidateIndex()
+        self._alias_index = None
         with open(self.filename, 'rb') as csv_read_file:
-            csv_reader = csv.DictReader(csv_read_file)
-            for row in csv_reader:
-                self.aliases[row['alias']] = row['name']
-                self.canonized_aliases[canonize(row['alias'])] = row['name']
+            rows = list(csv.DictReader(csv_read_file))
+        c_aliases = canonize_column(row['alias'] for row in rows)
+        for row, c_alias in zip(rows, c_aliases):
+            self.aliases[row['alias']] = row['name']
+            self.canonized_aliases[c_alias] = row['name']
 
     @classmethod
     def instance(cls):
@@ -147,6 +164,8 @@ class Aliases(object):
             return
         self.aliases[alias] = name
         self.canonized_aliases[c_alias] = name
+        if self._alias_index is not None:
+            self._alias_index.add(c_alias)
 
     def save(self):
         with open(self.filename, 'wb') as csv_file:
@@ -180,43 +199,141 @@ class Aliases(object):
                 self.add(name, match)
         return match
 
+    def suggest(self, *names):
+        '''Returns the DGU titles that best match any of the names, as a list
+        of (title, score), best first.
+        '''
+        by_canonized_title = DguOrgs.by_canonized_title()
+        if len(self._dgu_title_index) != len(by_canonized_title):
+            # new orgs may have been added to DGU
+            for c_title in by_canonized_title:
+                self._dgu_title_index.add(c_title)
+        if self._alias_index is None:
+            self._alias_index = CandidateIndex(self.canonized_aliases)
+        suggestions = {}
+        canonized_names = set(
+            canonize(name.split('/')[-1] if name.startswith('http') else name)
+            for name in names)
+        for name in canonized_names:
+            for index, get_title in (
+                    (self._dgu_title_index,
+                     lambda c_title: by_canonized_title[c_title]['title']),
+                    (self._alias_index, self.canonized_aliases.get)):
+                for title, score in self._extract_titles(index, name,
+                                                         get_title):
+                    if score > suggestions.get(title, 0):
+                        suggestions[title] = score
+        return sorted(suggestions.items(),
+                      key=lambda s: (-s[1], s[0]))[:self.num_suggestions]
+
+    def _extract_titles(self, index, name, get_title):
+        '''Returns the best titles for the name, as a list of (title, score),
+        best first, given an index of canonized titles or aliases and the
+        function to get the title for one of those.'''
+        limit = self.num_suggestions
+        while True:
+            results = index.extract(name, limit=limit,
+                                    score_cutoff=self.score_threshold)
+            titles = []  # [(title, score)]
+            seen_titles = set()
+            for c_title, score in results:
+                title = get_title(c_title)
+                if title not in seen_titles:
+                    seen_titles.add(title)
+                    titles.append((title, score))
+            # if several of the strings are for the same title, there may be
+            # others with a lower score that are needed to make up the numbers
+            if len(results) < limit or (
+                    len(titles) >= self.num_suggestions and
+                    titles[self.num_suggestions - 1][1] > results[-1][1]):
+                return titles
+            limit *= 2
+
+    def start_batch(self, accept_score, review_queue_filename):
+        '''Stop asking the user to reconcile names - accept the best match if
+        it scores at least accept_score and otherwise queue the names for
+        review. The decisions already made in the review queue are added.
+        '''
+        self.accept_score = accept_score
+        self.review_queue = ReviewQueue(review_queue_filename)
+        self.replay_reviews()
+
+    def replay_reviews(self):
+        '''Adds aliases for the names that have been reviewed in the
+        review queue, and takes them off it.'''
+        num_added = 0
+        for names, response, suggestions in self.review_queue.reviewed():
+            try:
+                match = self.resolve_match(response, suggestions)
+            except ValueError, e:
+                print 'Review of %r: %s' % (names, e)
+                continue
+            self.add_aliases(names, match, save=False)
+            self.review_queue.remove(names)
+            num_added += 1
+        if num_added:
+            self.save()
+            self.review_queue.save()
+        print 'Replayed %s reviews from %s' % (num_added,
+                                                self.review_queue.filename)
+
+    def resolve_match(self, response, suggestions):
+        '''Given a response to the suggestions - the number of one of them, a
+        data.gov.uk publisher URL or a DGU title - returns the matching title.
+        Raises ValueError if there is no such DGU org.
+        '''
+        try:
+            return suggestions[int(response) - 1][0]
+        except ValueError:
+            pass
+        except IndexError:
+            raise ValueError('No suggestion %s' % response)
+        if response.startswith('https://data.gov.uk/publisher'):
+            org_name = response.split('/')[-1]
+            match = DguOrgs.instance().notify_of_new_org(org_name)
+            if not match:
+                raise ValueError('Publisher %r not found in DGU' % org_name)
+            return match
+        if response not in DguOrgs.by_title():
+            raise ValueError('Not found in DGU')
+        return response
+
+    def add_aliases(self, names, match, save=True):
+        for name in names:
+            print 'Adding alias: "%s" "%s"' % (name, match)
+            self.add(name, match)
+        if save:
+            self.save()
+
+    def reconcile_unattended(self, names, top_suggestions):
+        '''Accepts the best suggestion if it scores well enough, and isn't
+        tied, otherwise queues the names for review.
+        Returns the matching title, or None if it is queued.
+        '''
+        if top_suggestions and top_suggestions[0][1] >= self.accept_score \
+                and (len(top_suggestions) == 1 or
+                     top_suggestions[1][1] < top_suggestions[0][1]):
+            match, score = top_suggestions[0]
+            print 'Reconciled %r to "%s" (score %s)' % (names, match, score)
+            self.add_aliases(names, match)
+            return match
+        if names not in self.review_queue:
+            print 'Queued for review: %r' % (names,)
+            self.review_queue.add(names, top_suggestions)
+        return None
+
     def reconcile(self, *names):
-        '''Ask the user (its assumed that the names aren't in DGU or aliases).
+        '''Ask the user (its assumed that the names aren't in DGU or aliases),
+        or in batch mode, reconcile_unattended.
         It adds aliases for all the names supplied.
         Returns the matching title, or None if the user bailed.
         '''
+        top_suggestions = self.suggest(*names)
+        if self.accept_score is not None:
+            return self.reconcile_unattended(names, top_suggestions)
         print '\n>>>>>>>>>>>>>'
         print 'Reconcile: %s' % repr(names)
         print '>>>>>>>>>>>>>'
-        suggestions = {}
-        if not hasattr(self, 'canonized_dgu_titles'):
-            # aliases change
-            dgu_titles = DguOrgs.by_title().keys()
-            self.canonized_dgu_titles = (canonize(t) for t in dgu_titles)
-        canonized_alias_titles = self.canonized_aliases.keys()
-        score_threshold = 50
-        scorer = fuzzywuzzy.fuzz.WRatio
-        for name in names:
-            if name.startswith('http'):
-                name = name.split('/')[-1]
-            name = canonize(name)
-            # similar to fuzzywuzzy.process.extract
-            for c_title in self.canonized_dgu_titles:
-                score = scorer(name, c_title)
-                if score < score_threshold:
-                    continue
-                title = DguOrgs.by_canonized_title()[c_title]['title']
-                suggestions[title] = score
-            for c_title in canonized_alias_titles:
-                score = scorer(name, c_title)
-                if score < score_threshold:
-                    continue
-                title = self.get_from_canonized(c_title)
-                if title in suggestions and suggestions[title] >= score:
-                    # that suggestion is already there with a higher score
-                    continue
-                suggestions[title] = score
-        top_suggestions = sorted(suggestions.items(), key=lambda s: -s[1])[:10]
         for i, suggestion_tuple in enumerate(top_suggestions):
             print '%s: %s' % (i+1, suggestion_tuple[0])
         print 'None: ignore for now'
@@ -224,31 +341,15 @@ class Aliases(object):
         print '(custom): Or type another'
         while True:
             response = raw_input('> ').strip()
-            try:
-                match = top_suggestions[int(response) - 1][0]
-                break
-            except ValueError:
-                pass
             if response.lower() == 'none' or response == '':
-                match = None
                 return None
-            if response.startswith('https://data.gov.uk/publisher'):
-                org_name = response.split('/')[-1]
-                match = DguOrgs.instance().notify_of_new_org(org_name)
-                if not match:
-                    print 'Publisher %r not found in DGU' % org_name
-                    continue
+            try:
+                match = self.resolve_match(response, top_suggestions)
                 break
-            if response not in DguOrgs.by_title():
-                print 'Not found in DGU'
-                continue
-            match = response
-            break
+            except ValueError, e:
+                print e
         # save the reconciliation against the names
-        for name in names:
-            print 'Adding alias: "%s" "%s"' % (name, match)
-            self.add(name, match)
-        self.save()
+        self.add_aliases(names, match)
         return match
 
 
@@ -411,25 +512,26 @@ def tidy_uploads():
     out_filename = 'uploads_report_tidied.csv'
     with open(in_filename, 'rb') as csv_read_file:
         csv_reader = unicodecsv.DictReader(csv_read_file, encoding='utf8')
-        rows = []
-        for row in csv_reader:
-            if row['org_name'] == 'Ministry of Defence':
-                mod_subpublisher(row)
-
-            title = canonize(row['org_name'])
-
-            match = DguOrgs.by_canonized_title().get(title)
+        in_rows = list(csv_reader)
+    for row in in_rows:
+        if row['org_name'] == 'Ministry of Defence':
+            mod_subpublisher(row)
+    # each distinct org_name is canonized once
+    titles = canonize_column(row['org_name'] for row in in_rows)
+    rows = []
+    for row, title in zip(in_rows, titles):
+        match = DguOrgs.by_canonized_title().get(title)
+        if not match:
+            match = \
+                Aliases.instance().get_or_reconcile(row['org_name'])
             if not match:
-                match = \
-                    Aliases.instance().get_or_reconcile(row['org_name'])
-                if not match:
-                    print 'Not matched'
-                    #rows.append(row)  # save it anyway?
-                    continue
-            if isinstance(match, basestring):
-                match = DguOrgs.by_title()[match]
-            row['org_name'] = match['title']
-            rows.append(row)
+                print 'Not matched'
+                #rows.append(row)  # save it anyway?
+                continue
+        if isinstance(match, basestring):
+            match = DguOrgs.by_title()[match]
+        row['org_name'] = match['title']
+        rows.append(row)
     with open(out_filename, 'wb') as csv_write_file:
         csv_writer = unicodecsv.DictWriter(
             csv_write_file,
@@ -443,11 +545,25 @@ def tidy_uploads():
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('input', choices=['triplestore', 'uploads'])
+    parser.add_argument('input',
+                        choices=['triplestore', 'uploads', 'replay-reviews'])
+    parser.add_argument('--batch', action='store_true',
+                        help='Don\'t ask to reconcile unknown names - accept '
+                             'good matches and queue the rest for review. '
+                             'Reviewed ones are replayed first.')
+    parser.add_argument('--accept-score', type=int, default=90,
+                        help='In batch mode, the fuzzy match score (0-100) '
+                             'needed to accept a match (default: %(default)s)')
+    parser.add_argument('--review-queue', default=REVIEW_QUEUE_FILENAME,
+                        help='Where batch mode puts names to review '
+                             '(default: %(default)s)')
     args = parser.parse_args()
+    if args.batch or args.input == 'replay-reviews':
+        # replays the reviewed names first
+        Aliases.instance().start_batch(args.accept_score, args.review_queue)
     if args.input == 'triplestore':
         tidy_triplestore()
     elif args.input == 'uploads':
         tidy_uploads()
-    else:
+    elif args.input != 'replay-reviews':
         raise NotImplementedError
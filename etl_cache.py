@@ -0,0 +1,149 @@
+'''
+Cache of the results of converting/validating organogram XLS files, so that
+unchanged files don't have to be parsed and validated again.
+
+Results are keyed by a hash of the XLS file's contents, plus any parameters
+(e.g. the verify level) and the version of the code, so a change to either
+the file or the ETL code means it is converted afresh.
+
+Example:
+
+from etl_cache import EtlCache
+cache = EtlCache('.etl_to_csv.cache', code_version='1')
+key = cache.key('data/xls/organogram.xls', 'load, display and be valid')
+result = cache.get(key)
+if result is None:
+    result = convert(...)
+    cache.set(key, result)
+'''
+
+import os
+import hashlib
+import cPickle as pickle
+import zlib
+import tempfile
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '.etl_to_csv.cache'
+DEFAULT_MAX_SIZE_MB = 500
+CACHE_FILE_EXTENSION = '.pickle.z'
+
+
+class EtlCache(object):
+    '''A directory of results, each stored as a compressed pickle. When it
+    exceeds max_size_mb, the least recently used results are evicted.
+
+    The size of the cache is only measured (by walking the directory) on the
+    first write and when the running total of what has been written since
+    goes over max_size_mb. Another process writing to the same directory adds
+    to the size without this one knowing, so the cache can go over by what
+    the others have written, until the next time it is measured - call
+    evict() when they have finished to bring it back within its size.
+    '''
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_size_mb=DEFAULT_MAX_SIZE_MB, code_version=''):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.code_version = code_version
+        # total size of the results, or None until it is measured
+        self._size = None
+
+    def key(self, filepath, *params):
+        '''Returns the key for a file's contents and the given parameters.'''
+        hash_ = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), ''):
+                hash_.update(chunk)
+        hash_.update(repr((params, self.code_version)))
+        return hash_.hexdigest()
+
+    def _filepath(self, key):
+        # subdirectories avoid having too many files in one directory
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_FILE_EXTENSION)
+
+    def get(self, key):
+        '''Returns the cached result, or None if it is not cached.'''
+        filepath = self._filepath(key)
+        try:
+            with open(filepath, 'rb') as f:
+                result = pickle.loads(zlib.decompress(f.read()))
+        except IOError:
+            return None
+        except Exception:
+            log.exception('Discarding unreadable cache file %s', filepath)
+            self._delete(filepath)
+            return None
+        # record that it was used recently, for the eviction
+        try:
+            os.utime(filepath, None)
+        except OSError:
+            pass
+        return result
+
+    def set(self, key, result):
+        '''Stores the result. Failure to write to the cache is logged rather
+        than raised, since the cache is only an optimization.'''
+        filepath = self._filepath(key)
+        try:
+            if not os.path.isdir(os.path.dirname(filepath)):
+                os.makedirs(os.path.dirname(filepath))
+            data = zlib.compress(
+                pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+            # write then rename, so that another process never reads half a
+            # file
+            fd, tmp_filepath = tempfile.mkstemp(
+                dir=os.path.dirname(filepath), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            replaced_size = os.path.getsize(filepath) \
+                if os.path.exists(filepath) else 0
+            os.rename(tmp_filepath, filepath)
+        except (IOError, OSError, pickle.PicklingError):
+            log.exception('Could not write to the cache %s', filepath)
+            return
+        if self._size is not None:
+            self._size += len(data) - replaced_size
+        if self._size is None or self._size > self.max_size_bytes:
+            self.evict()
+
+    def _cache_files(self):
+        '''Returns a list of (last_used, size, filepath) for each result'''
+        cache_files = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith(CACHE_FILE_EXTENSION):
+                    continue
+                filepath = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    # deleted by another process
+                    continue
+                cache_files.append((stat.st_mtime, stat.st_size, filepath))
+        return cache_files
+
+    def evict(self):
+        '''Deletes the least recently used results until the cache is within
+        its maximum size.'''
+        cache_files = self._cache_files()
+        size = sum(size for last_used, size, filepath in cache_files)
+        for last_used, size_, filepath in sorted(cache_files):
+            if size <= self.max_size_bytes:
+                break
+            self._delete(filepath)
+            size -= size_
+        self._size = size
+
+    def clear(self):
+        '''Deletes all the results'''
+        for last_used, size, filepath in self._cache_files():
+            self._delete(filepath)
+        self._size = 0
+
+    def _delete(self, filepath):
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+HTTP server that validates and converts Organograms XLS files to CSV, so that
+Drupal doesn't pay the cost of starting python and importing pandas for every
+upload (as it does running etl_to_csv.py).
+
+Conversions are done by a pool of worker processes, which are started (and
+have imported pandas) before the first request.
+
+Upload an XLS with a POST to /convert, either as the raw request body or as a
+multipart form field called "xls". Parameters (in the query string or form):
+
+  filename      - original filename of the XLS (default: organogram.xls)
+  verify_level  - 'load', 'load and display' or 'load, display and be valid'
+                  (default)
+  date          - alternative to verify_level - the date of the data
+                  (YYYY-MM-DD), from which the verify level is picked
+  stats         - if set (e.g. stats=1), the response includes "stats": the
+                  time, rows, errors and peak memory of each stage
+
+e.g.
+
+  curl --data-binary @organogram.xls \
+      'http://localhost:8081/convert?filename=organogram.xls'
+
+Returns JSON:
+
+  {"failure_stage": null,  (or "load", "validation", "validating tree")
+   "errors": [...],
+   "warnings": [...],
+   "verify_level": "load, display and be valid",
+   "index": {"name": "Cabinet Office", "value": "organogram"},
+   "senior_csv": "...",
+   "junior_csv": "..."}
+
+GET /status returns {"status": "ok"} - handy for monitoring.
+'''
+
+import argparse
+import BaseHTTPServer
+import SocketServer
+import cgi
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import traceback
+import urlparse
+
+import etl_to_csv
+from etl_to_csv import (
+    load_xls_and_stop_on_errors, get_verify_level, write_csvs,
+    add_cache_arguments, get_cache_from_args)
+from etl_stats import StageStats
+
+log = logging.getLogger(__name__)
+
+VERIFY_LEVELS = ('load', 'load and display', 'load, display and be valid')
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
+
+def convert_xls(xls_filepath, verify_level, cache=None, stats=False):
+    '''Converts an XLS, returning the outcome as a dict that can be dumped as
+    JSON. Runs in a worker process.'''
+    result = dict(verify_level=verify_level, failure_stage=None, errors=[],
+                  warnings=[], index=None, senior_csv=None, junior_csv=None)
+    if stats:
+        # a worker only does one conversion at a time, so the module's
+        # stage_stats is just for this conversion
+        etl_to_csv.stage_stats = StageStats()
+    try:
+        failure_stage, senior_df, junior_df, errors, warnings = \
+            load_xls_and_stop_on_errors(xls_filepath, verify_level,
+                                        print_errors=False, cache=cache)
+        result.update(failure_stage=failure_stage, errors=errors,
+                      warnings=warnings)
+        if failure_stage is None:
+            csv_folder = tempfile.mkdtemp(prefix='etl_server_csv')
+            try:
+                senior_filename, junior_filename, result['index'] = \
+                    write_csvs(xls_filepath, csv_folder, senior_df, junior_df)
+                for key, filename in (('senior_csv', senior_filename),
+                                      ('junior_csv', junior_filename)):
+                    with open(filename, 'rb') as f:
+                        result[key] = f.read().decode('utf8')
+            finally:
+                shutil.rmtree(csv_folder)
+    except Exception:
+        log.exception('Exception converting %s', xls_filepath)
+        result.update(failure_stage='exception',
+                      errors=[traceback.format_exc()])
+    finally:
+        if stats:
+            result['stats'] = etl_to_csv.stage_stats.as_dicts()
+            etl_to_csv.stage_stats = None
+    return result
+
+
+class EtlRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urlparse.urlparse(self.path).path == '/status':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != '/convert':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            content_length = int(self.headers.getheader('content-length'))
+        except (TypeError, ValueError):
+            self.send_json(411, {'error': 'Content-Length is required'})
+            return
+        if content_length > MAX_UPLOAD_SIZE:
+            self.send_json(413, {'error': 'XLS is too large'})
+            return
+        params = dict(urlparse.parse_qsl(url.query))
+        content_type, content_type_params = \
+            cgi.parse_header(self.headers.getheader('content-type') or '')
+        if content_type == 'multipart/form-data':
+            form = cgi.FieldStorage(
+                fp=self.rfile, headers=self.headers,
+                environ={'REQUEST_METHOD': 'POST',
+                         'CONTENT_TYPE': self.headers['content-type']})
+            if 'xls' not in form or not form['xls'].file:
+                self.send_json(400, {'error': 'Form field "xls" is required'})
+                return
+            for key in ('filename', 'verify_level', 'date', 'stats'):
+                if key in form:
+                    params[key] = form.getfirst(key)
+            if 'filename' not in params and form['xls'].filename:
+                params['filename'] = form['xls'].filename
+            xls_content = form['xls'].value
+        else:
+            xls_content = self.rfile.read(content_length)
+
+        filename = safe_filename(params.get('filename') or 'organogram.xls')
+        upload_folder = tempfile.mkdtemp(prefix='etl_server_xls')
+        try:
+            xls_filepath = os.path.join(upload_folder, filename)
+            with open(xls_filepath, 'wb') as f:
+                f.write(xls_content)
+            if params.get('date'):
+                try:
+                    verify_level = get_verify_level(params['date'],
+                                                    xls_filepath)
+                except AssertionError, e:
+                    self.send_json(400, {'error': str(e)})
+                    return
+            else:
+                verify_level = params.get('verify_level') or \
+                    'load, display and be valid'
+                if verify_level not in VERIFY_LEVELS:
+                    self.send_json(400, {'error': 'verify_level must be one '
+                                         'of: %s' % ', '.join(VERIFY_LEVELS)})
+                    return
+            result = self.server.pool.apply(
+                convert_xls, (xls_filepath, verify_level, self.server.cache,
+                              bool(params.get('stats'))))
+        finally:
+            shutil.rmtree(upload_folder)
+        self.send_json(200, result)
+
+    def send_json(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def safe_filename(filename):
+    # just the basename, without characters that would upset the filesystem
+    filename = re.split(r'[\\/]', filename)[-1]
+    return re.sub(r'[^\w\-. ]', '_', filename).lstrip('.') or 'organogram.xls'
+
+
+class EtlServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Handles each request in a thread, handing the conversion itself to a
+    pool of worker processes.'''
+    daemon_threads = True
+
+    def __init__(self, server_address, workers=2, cache=None):
+        # start the workers before listening, so they don't inherit the socket
+        self.pool = multiprocessing.Pool(processes=workers)
+        self.cache = cache
+        BaseHTTPServer.HTTPServer.__init__(self, server_address,
+                                           EtlRequestHandler)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of processes converting XLS files')
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = EtlServer((args.host, args.port), workers=args.workers,
+                       cache=get_cache_from_args(args))
+    print 'Serving on http://%s:%s/' % (args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,167 @@
+'''
+Instrumentation of the stages of converting/validating an organogram XLS
+(etl_to_csv.py) - for each stage it records the time taken, rows processed,
+errors emitted and the peak memory of the process.
+
+It is opt-in. Unless etl_to_csv.stage_stats is set, the stages are not
+measured.
+
+Example:
+
+import etl_to_csv
+from etl_stats import StageStats
+etl_to_csv.stage_stats = StageStats()
+etl_to_csv.load_xls_and_get_errors('data/xls/organogram.xls')
+print etl_to_csv.stage_stats.report()
+'''
+
+import sys
+import timeit
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+def peak_memory_mb():
+    '''Returns the peak memory (resident set size) of this process so far, or
+    None if it cannot be measured on this platform.'''
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes, except on Mac OS X where it is bytes
+    if sys.platform == 'darwin':
+        max_rss /= 1024.0
+    return max_rss / 1024.0
+
+
+class Stage(object):
+    '''Measures one stage, as a context manager. Set 'rows' to the number of
+    rows the stage processes.'''
+    def __init__(self, stats, name, error_lists):
+        self.stats = stats
+        self.name = name
+        self.error_lists = error_lists
+        self.depth = None
+        self.rows = None
+        self.seconds = None
+        self.errors = None
+        self.peak_memory_mb = None
+        self.peak_memory_increase_mb = None
+
+    def _count_errors(self):
+        return sum(len(errors) for errors in self.error_lists)
+
+    def __enter__(self):
+        self.depth = self.stats._depth
+        self.stats._depth += 1
+        self.stats.stages.append(self)
+        self._errors_before = self._count_errors()
+        self._peak_memory_before = peak_memory_mb()
+        self._start_time = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = timeit.default_timer() - self._start_time
+        self.errors = self._count_errors() - self._errors_before
+        self.peak_memory_mb = peak_memory_mb()
+        if self.peak_memory_mb is not None:
+            # i.e. how much this stage raised the peak
+            self.peak_memory_increase_mb = \
+                self.peak_memory_mb - self._peak_memory_before
+        self.stats._depth -= 1
+        return False
+
+    def as_dict(self):
+        return OrderedDict((
+            ('stage', self.name),
+            ('depth', self.depth),
+            ('seconds', self.seconds),
+            ('rows', self.rows),
+            ('errors', self.errors),
+            ('peak_memory_mb', self.peak_memory_mb),
+            ('peak_memory_increase_mb', self.peak_memory_increase_mb),
+            ))
+
+
+class NullStage(object):
+    '''Stands in for a Stage when the instrumentation is disabled, so it costs
+    no more than the 'with' statement.'''
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_STAGE = NullStage()
+
+
+class StageStats(object):
+    '''Records the stages, in the order they started. Stages within stages
+    are recorded with a greater depth.'''
+    def __init__(self):
+        self.stages = []
+        self._depth = 0
+
+    def stage(self, name, *error_lists):
+        '''Returns a Stage to measure, as a context manager.
+
+        error_lists - the lists that the stage appends its errors to
+        '''
+        return Stage(self, name, error_lists)
+
+    def reset(self):
+        self.stages = []
+        self._depth = 0
+
+    def as_dicts(self):
+        '''Returns the stats of each stage, for dumping as JSON.'''
+        return [stage.as_dict() for stage in self.stages]
+
+    def report(self):
+        return format_report(self.as_dicts())
+
+
+def total_stages(stage_dicts_per_run):
+    '''Adds up the stats of the stages with the same name, over several runs
+    (e.g. of a batch of XLS files). The peak memory is the maximum.'''
+    totals = OrderedDict()
+    for stage_dicts in stage_dicts_per_run:
+        for stage in stage_dicts:
+            total = totals.setdefault(stage['stage'], OrderedDict((
+                ('stage', stage['stage']),
+                ('depth', stage['depth']),
+                ('seconds', None),
+                ('rows', None),
+                ('errors', None),
+                ('peak_memory_mb', None),
+                ('runs', 0),
+                )))
+            for key in ('seconds', 'rows', 'errors'):
+                if stage[key] is not None:
+                    total[key] = (total[key] or 0) + stage[key]
+            total['peak_memory_mb'] = max(total['peak_memory_mb'],
+                                          stage['peak_memory_mb'])
+            total['runs'] += 1
+    return totals.values()
+
+
+def format_report(stage_dicts):
+    '''Returns the stage stats as a table, for printing.'''
+    def format_value(format_, value):
+        return format_ % value if value is not None else ''
+    lines = ['%-50s %9s %8s %7s %10s' % (
+        'Stage', 'Time (s)', 'Rows', 'Errors', 'Peak (MB)')]
+    for stage in stage_dicts:
+        lines.append('%-50s %9s %8s %7s %10s' % (
+            ('  ' * stage['depth'] + stage['stage'])[:50],
+            format_value('%.3f', stage['seconds']),
+            format_value('%s', stage['rows']),
+            format_value('%s', stage['errors']),
+            format_value('%.1f', stage['peak_memory_mb'])))
+    return '\n'.join(lines)
@@ -16,6 +16,7 @@ import numpy
 import sys
 import os.path
 import json
+import xlrd
 from xlrd import XLRDError
 import csv
 import re
@@ -23,33 +24,75 @@ import argparse
 import string
 import logging
 import itertools
+import glob
+import multiprocessing
+import traceback
+import hashlib
+from collections import defaultdict
+
+from etl_cache import EtlCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_MB
+from etl_stats import StageStats, NULL_STAGE, total_stages, format_report
 
 log = __import__('logging').getLogger(__name__)
 
 args = None
+# set to an etl_stats.StageStats to record stats on each stage of the ETL
+stage_stats = None
+
+
+def instrument(stage_name, *error_lists):
+    '''Returns a context manager that records the time, rows, errors and
+    memory of the stage, if stage_stats is enabled.'''
+    if stage_stats is None:
+        return NULL_STAGE
+    return stage_stats.stage(stage_name, *error_lists)
 
 class ValidationFatalError(Exception):
     pass
 
 
+def open_workbook(xls_filename):
+    '''Opens and parses the XLS file once, so that the references, senior and
+    junior sheets can all be read from it without re-parsing the file.
+
+    Returns a pandas.ExcelFile, which the load_* functions accept in place of
+    the filename. If the file cannot be parsed, the filename is returned, so
+    that the errors are reported by the load_* functions, as usual.
+    '''
+    try:
+        with instrument('open workbook'):
+            return pandas.ExcelFile(xls_filename)
+    except XLRDError:
+        return xls_filename
+
+
 def load_excel_store_errors(filename, sheet_name, errors, validation_errors, input_columns, rename_columns, integer_columns, string_columns):
     """Carefully load an Excel file, taking care to log errors and produce clean output.
+    'filename' can also be a pandas.ExcelFile (see open_workbook).
     You'll always receive a dataframe with the expected columns, though it might contain 0 rows if
     there are errors. Strings will be stored in the 'errors' array.
     If 'validation_errors' are inserted, it means some values are discarded, but you would not be prevented from displaying the rest of the data.
     """
+    with instrument('load sheet "%s"' % sheet_name,
+                    errors, validation_errors) as stage:
+        df = _load_excel_store_errors(filename, sheet_name, errors, validation_errors, input_columns, rename_columns, integer_columns, string_columns)
+        stage.rows = len(df)
+    return df
+
+def _load_excel_store_errors(filename, sheet_name, errors, validation_errors, input_columns, rename_columns, integer_columns, string_columns):
     # Output columns can be different. Update according to the rename_columns dict:
     output_columns = [rename_columns.get(x,x) for x in input_columns]
     try:
         # need to convert strings at this stage or leading zeros get lost
         string_converters = dict((col, str) for col in string_columns)
-        df = pandas.read_excel(filename,
-                               sheet_name,
-                               convert_float=True,
-                               parse_cols=len(input_columns)-1,
-                               converters=string_converters,
-                               keep_default_na=False,
-                               na_values=[''])
+        with instrument('parse sheet "%s"' % sheet_name):
+            df = pandas.read_excel(filename,
+                                   sheet_name,
+                                   convert_float=True,
+                                   parse_cols=len(input_columns)-1,
+                                   converters=string_converters,
+                                   keep_default_na=False,
+                                   na_values=[''])
     except XLRDError, e:
         errors.append(str(e))
         return pandas.DataFrame(columns=output_columns)
@@ -117,12 +160,13 @@ def load_excel_store_errors(filename, sheet_name, errors, validation_errors, inp
     return df
 
 def blank_out_columns(df, blank_columns):
-    # Blank out the given columns, given by name
+    # Blank out the given columns, given by name. (Assigning the column and
+    # then the column names avoids drop/insert/rename, which each copy the
+    # whole frame)
     for column_name in blank_columns:
-        col_index = df.columns.tolist().index(column_name)
-        df.drop(df.columns[col_index], axis=1, inplace=True)
-        df.insert(col_index, column_name, '')
-        df.rename(columns={column_name: ''}, inplace=True)
+        df[column_name] = ''
+    df.columns = ['' if column_name in blank_columns else column_name
+                  for column_name in df.columns]
     return df
 
 def load_senior(excel_filename, errors, validation_errors, references):
@@ -213,7 +257,8 @@ def diff_lists(a, b):
 
 
 def get_references(xls_filename, errors, validation_errors, warnings):
-    references = load_references(xls_filename, errors, validation_errors)
+    with instrument('load references', errors, validation_errors):
+        references = load_references(xls_filename, errors, validation_errors)
     standard_refs = standard_references()
     if 'listSeniorGrades' in references:
         diff = diff_lists(standard_refs['listSeniorGrades'],
@@ -228,6 +273,9 @@ def get_references(xls_filename, errors, validation_errors, warnings):
         if diff:
             warnings.append('Mismatch of the professions: %s' % diff)
     references.update(standard_refs)
+    # index them for the in-sheet validation lookups
+    for name, list_ in references.items():
+        references[name] = ExcelMatchList(list_)
     return references
 
 def standard_references():
@@ -277,18 +325,6 @@ def load_references(xls_filename, errors, validation_errors):
     return references
 
 
-class MaxDepthError(Exception):
-    pass
-
-
-class PostReportsToUnknownPostError(Exception):
-    pass
-
-
-class PostReportLoopError(Exception):
-    pass
-
-
 JOB_SHARE_COLUMNS_THAT_CAN_BE_DIFFERENT = set((
     'Name', u'Actual Pay Ceiling (£)', u'Actual Pay Floor (£)',
     'Total Pay', 'Contact Phone', 'Contact E-mail', 'Notes', 'FTE'))
@@ -302,38 +338,45 @@ def verify_graph(senior, junior, errors):
     May raise ValidationFatalError if it is so bad that the organogram cannot
     be displayed (e.g. no "top post").
     '''
+    with instrument('verify graph', errors) as stage:
+        stage.rows = len(senior) + len(junior)
+        _verify_graph(senior, junior, errors)
+
+def _verify_graph(senior, junior, errors):
     # ignore eliminated posts (i.e. don't exist any more)
     senior_ = senior[senior['Name'].astype(unicode) != "Eliminated"]
 
-    # merge posts which are job shares
-    # "duplicated will be the grade, job title, job/team function,
-    # reports to senior post and salary cost of reports."
-    # "post is duplicate save from name, pay columns, contact phone/email and
-    #  notes"
-    job_share_columns_that_need_to_be_the_same = \
-        set(senior_.columns.values) - JOB_SHARE_COLUMNS_THAT_CAN_BE_DIFFERENT
-    senior_ = senior_.drop_duplicates(
-        keep='first', subset=job_share_columns_that_need_to_be_the_same)
-    # detect any remaining duplicate refs
-    duplicated_refs = senior_[
-        senior_.duplicated(subset=['Post Unique Reference'])
-        ]['Post Unique Reference']
-    for ref in duplicated_refs:
-        if ref in ('XX', 'xx', 0, '0'):
-            # it's ok to have several top posts (xx) or
-            # posts paid but on leave (0)
-            continue
-        # rows with that ref, just with the columns that need to be the same
-        rows = senior_[senior_['Post Unique Reference']==ref].loc[:,job_share_columns_that_need_to_be_the_same]
-        # consider pairs of those rows until we find a problem
-        for row_indexes in itertools.combinations(rows.T, 2):
-            row_pair = rows.loc[list(row_indexes)]
-            columns_with_different_values = \
-                row_pair.loc[:,row_pair.iloc[0]!=row_pair.iloc[1]].columns
-            error_cols = [column_name(senior.columns.get_loc(col_name))
-                         for col_name in columns_with_different_values]
-            error_rows = [row_name(index) for index, row in row_pair.iterrows()]
-            errors.append('Sheet %s - cells %s%s and %s%s should have the same value. "Post Unique Reference" value "%s" appears in multiple rows, indicating a job share. It is required for job share rows to have identical values in particular columns and that is not the case in this sheet. Rows %s and %s should not have different values for %s.' % (SENIOR_SHEET_NAME, error_cols[0], error_rows[0], error_cols[0], error_rows[1], ref, error_rows[0], error_rows[1], ', '.join(['"%s"' % c for c in columns_with_different_values])))
+    with instrument('job shares', errors) as stage:
+        stage.rows = len(senior_)
+        # merge posts which are job shares
+        # "duplicated will be the grade, job title, job/team function,
+        # reports to senior post and salary cost of reports."
+        # "post is duplicate save from name, pay columns, contact phone/email and
+        #  notes"
+        job_share_columns_that_need_to_be_the_same = \
+            set(senior_.columns.values) - JOB_SHARE_COLUMNS_THAT_CAN_BE_DIFFERENT
+        senior_ = senior_.drop_duplicates(
+            keep='first', subset=job_share_columns_that_need_to_be_the_same)
+        # detect any remaining duplicate refs
+        duplicated_refs = senior_[
+            senior_.duplicated(subset=['Post Unique Reference'])
+            ]['Post Unique Reference']
+        for ref in duplicated_refs:
+            if ref in ('XX', 'xx', 0, '0'):
+                # it's ok to have several top posts (xx) or
+                # posts paid but on leave (0)
+                continue
+            # rows with that ref, just with the columns that need to be the same
+            rows = senior_[senior_['Post Unique Reference']==ref].loc[:,job_share_columns_that_need_to_be_the_same]
+            # consider pairs of those rows until we find a problem
+            for row_indexes in itertools.combinations(rows.T, 2):
+                row_pair = rows.loc[list(row_indexes)]
+                columns_with_different_values = \
+                    row_pair.loc[:,row_pair.iloc[0]!=row_pair.iloc[1]].columns
+                error_cols = [column_name(senior.columns.get_loc(col_name))
+                             for col_name in columns_with_different_values]
+                error_rows = [row_name(index) for index, row in row_pair.iterrows()]
+                errors.append('Sheet %s - cells %s%s and %s%s should have the same value. "Post Unique Reference" value "%s" appears in multiple rows, indicating a job share. It is required for job share rows to have identical values in particular columns and that is not the case in this sheet. Rows %s and %s should not have different values for %s.' % (SENIOR_SHEET_NAME, error_cols[0], error_rows[0], error_cols[0], error_rows[1], ref, error_rows[0], error_rows[1], ', '.join(['"%s"' % c for c in columns_with_different_values])))
 
     # ensure at least one person is marked as top (XX)
     top_persons = senior_[senior_['Reports to Senior Post'].isin(('XX', 'xx'))]
@@ -364,66 +407,24 @@ def verify_graph(senior, junior, errors):
                 'ref:"%s"' %
                 (SENIOR_SHEET_NAME, cell_name(index, column_index('k')), ref))
             refs_that_report_to_themselves.add(ref)
-    top_level_boss_by_ref = {}
-
-    def get_top_level_boss_recursive(ref, posts_recursed=None):
-        if posts_recursed is None:
-            posts_recursed = []
-        posts_recursed.append(ref)
-        if ref in top_person_refs:
-            return ref
-        if ref in posts_recursed[:-1]:
-            raise PostReportLoopError(' '.join(posts_recursed))
-        if len(posts_recursed) > 100:
-            raise MaxDepthError(' '.join(posts_recursed))
-        if ref in top_level_boss_by_ref:
-            return top_level_boss_by_ref[ref]
-        try:
-            boss_ref = reports_to[ref]
-        except KeyError:
-            known_refs = list(set(reports_to.keys()))
-            # convert known_refs to int if poss, so it sorts better
-            for i, ref_ in enumerate(known_refs):
-                try:
-                    known_refs[i] = int(ref_)
-                except:
-                    pass
-            raise PostReportsToUnknownPostError(
-                'Post reports to unknown post ref:"%s". '
-                'Known post refs:"%s"' %
-                (ref, sorted(known_refs)))
-        try:
-            top_level_boss_by_ref[ref] = get_top_level_boss_recursive(
-                boss_ref, posts_recursed)
-        except PostReportsToUnknownPostError, e:
-            raise PostReportsToUnknownPostError('Error with senior post "%s": %s' % (ref, e))
-
-        return top_level_boss_by_ref[ref]
+    top_level_bosses = get_top_level_bosses(reports_to, set(top_person_refs))
     for index, post in senior_.iterrows():
         ref = post['Post Unique Reference']
-        try:
-            top_level_boss = get_top_level_boss_recursive(ref)
-        except MaxDepthError, posts_recursed:
-            errors.append('Could not follow the reporting structure from '
-                          'Senior post %s "%s" up to the top in 100 steps - '
-                          'is there a loop? Posts: %s'
-                          % (index, ref, posts_recursed))
-        except PostReportsToUnknownPostError, e:
-            errors.append(str(e))
-        except PostReportLoopError, posts_recursed:
-            if str(posts_recursed).split(' ')[-1] in \
-                    refs_that_report_to_themselves:
+        outcome, detail = top_level_bosses[ref]
+        if outcome == 'unknown post':
+            errors.append(str(detail))
+        elif outcome == 'loop':
+            if detail.split(' ')[-1] in refs_that_report_to_themselves:
                 # error has already reported - no point flogging it
                 pass
             else:
                 errors.append('Reporting structure from Senior post %s "%s" '
                               'ended up in a loop: %s'
-                              % (index, ref, posts_recursed))
-        else:
-            if top_level_boss not in top_person_refs:
-                errors.append('Reporting from Senior post %s "%s" up to the '
-                              'top results in "%s" rather than "XX"' %
-                              (index, ref, top_level_boss))
+                              % (index, ref, detail))
+        elif detail not in top_person_refs:
+            errors.append('Reporting from Senior post %s "%s" up to the '
+                          'top results in "%s" rather than "XX"' %
+                          (index, ref, detail))
 
     # do all juniors report to a correct senior ref?
     junior_report_to_refs = set(junior['Reporting Senior Post'])
@@ -445,6 +446,72 @@ def verify_graph(senior, junior, errors):
             # Sheet "(final data) junior-staff" cell D9: Post reporting to Eliminated senior post "OLD"
             errors.append('Sheet "(final data) junior-staff" cell {cell}: {problem}'.format(**params))
 
+def get_top_level_bosses(reports_to, top_person_refs):
+    '''Follows the reporting chain up from every post, to find its top level
+    boss. Each post is only visited once - the outcome is remembered for every
+    post along the chain.
+
+    Returns a dict of post ref: (outcome, detail) where outcome is one of:
+    * 'top' - detail is the ref of the top level boss
+    * 'unknown post' - the chain reaches a post ref that is not in
+      reports_to. detail is the error message.
+    * 'loop' - the chain goes round in a loop. detail is the refs followed,
+      space separated, ending with the first ref that is repeated.
+    '''
+    outcomes = {}
+    known_refs = []
+
+    def unknown_post_message(ref):
+        if not known_refs:
+            # convert known_refs to int if poss, so it sorts better
+            for ref_ in set(reports_to.keys()):
+                try:
+                    ref_ = int(ref_)
+                except:
+                    pass
+                known_refs.append(ref_)
+        return 'Post reports to unknown post ref:"%s". ' \
+            'Known post refs:"%s"' % (ref, sorted(known_refs))
+
+    for start_ref in reports_to:
+        # walk up the chain until we get to an outcome
+        chain = []
+        position_in_chain = {}
+        ref = start_ref
+        while True:
+            if ref in top_person_refs:
+                outcome = ('top', ref)
+                break
+            if ref in position_in_chain:
+                # every post in the loop has its own list of posts to report
+                loop = chain[position_in_chain[ref]:]
+                for i, loop_ref in enumerate(loop):
+                    outcomes[loop_ref] = (
+                        'loop', ' '.join(loop[i:] + loop[:i + 1]))
+                chain = chain[:position_in_chain[ref]]
+                outcome = outcomes[ref]
+                break
+            if ref in outcomes:
+                outcome = outcomes[ref]
+                break
+            if ref not in reports_to:
+                outcome = ('unknown post', unknown_post_message(ref))
+                break
+            position_in_chain[ref] = len(chain)
+            chain.append(ref)
+            ref = reports_to[ref]
+        # the posts in the chain share the outcome
+        for ref in reversed(chain):
+            if outcome[0] == 'unknown post':
+                outcome = ('unknown post', 'Error with senior post "%s": %s'
+                           % (ref, outcome[1]))
+            elif outcome[0] == 'loop':
+                outcome = ('loop', '%s %s' % (ref, outcome[1]))
+            outcomes[ref] = outcome
+        # (a top level post is its own top level boss)
+        outcomes.setdefault(start_ref, outcome)
+    return outcomes
+
 def row_name(row_index):
     '''
     0 returns '2' (first value, after the header row)
@@ -471,16 +538,30 @@ def cell_name(row_index, column_index):
     return '%s%d' % (column_name(column_index), row_name(row_index))
 
 def in_sheet_validation(df, validation_errors, sheet_name, junior_or_senior, references):
+    with instrument('in-sheet validation "%s"' % sheet_name,
+                    validation_errors) as stage:
+        stage.rows = len(df)
+        _in_sheet_validation(df, validation_errors, sheet_name, junior_or_senior, references)
+
+def _in_sheet_validation(df, validation_errors, sheet_name, junior_or_senior, references):
     row_errors = []
     has_valid_column = in_sheet_validation_row_colours(df, row_errors, sheet_name)
 
     cell_errors = []
     if junior_or_senior == 'senior':
-        for index, row in df.iterrows():
-            try:
-                in_sheet_validation_senior_columns(row, df, cell_errors, sheet_name, references)
-            except Exception:
-                log.exception('Exception during senior in-sheet validation, row %s' % row.name)
+        try:
+            in_sheet_validation_senior_df(df, cell_errors, sheet_name, references)
+        except Exception:
+            # The row-by-row version logs and skips the rest of a row that
+            # raises, so fall back to it to get exactly the same errors
+            log.exception('Exception during senior in-sheet validation of '
+                          'the whole sheet - validating row by row instead')
+            cell_errors = []
+            for index, row in df.iterrows():
+                try:
+                    in_sheet_validation_senior_columns(row, df, cell_errors, sheet_name, references)
+                except Exception:
+                    log.exception('Exception during senior in-sheet validation, row %s' % row.name)
     else:
         for index, row in df.iterrows():
             try:
@@ -816,6 +897,198 @@ def in_sheet_validation_senior_columns(row, df, validation_errors, sheet_name, r
                 if not_match(k, seniorPostUniqueReference):
                     validation_errors.append(u'%s: The "Reports to Senior Post" value must match one of the values in "Post Unique Reference" (column A) or be "XX" (which is a top level post - reports to no-one in this sheet).' % cell_ref)
 
+NAMES_OF_POSTS_WITHOUT_A_HOLDER = ('Vacant', 'VACANT', 'vacant', 'Eliminated', 'ELIMINATED', 'eliminated')
+POST_REF_SYMBOLS_REGEX = re.compile(r'[¬!\"£$%^&()+=\{\}\[\]:;@\'#<>,.\\/]')
+
+def in_sheet_validation_senior_df(df, validation_errors, sheet_name, references):
+    '''Equivalent to calling in_sheet_validation_senior_columns for every row
+    of the senior sheet, but each column rule is evaluated as a boolean mask
+    over the whole sheet, and error strings are only produced for the cells
+    that fail. Errors are appended in the same order as the row-by-row version
+    (by row, then by column).
+
+    Raises an exception for values that the row-by-row version would also
+    fail on (e.g. a numeric "Total Pay" of infinity), in which case no errors
+    are appended.
+    '''
+    if not len(df):
+        return
+    # df.values holds exactly the same objects that df.iterrows() yields
+    values = df.values.astype(object)
+    a, b, c, d, e, g, h, i, j, k, p = \
+        [values[:, column_index(letter)] for letter in 'ABCDEGHIJKP']
+    is_blank = lambda column: _mask(column, Excel.is_blank)
+    not_blank_a = ~is_blank(a)
+    a_is_0 = _equals(a, '0') | _equals(a, 0)
+    a_is_int_0 = _equals(a, 0)  # as the spreadsheet does for some columns
+    name_is_vacant_or_eliminated = numpy.zeros(len(df), dtype=bool)
+    for name in NAMES_OF_POSTS_WITHOUT_A_HOLDER:
+        name_is_vacant_or_eliminated |= _equals(b, name)
+
+    # (row position, column index, message, message args)
+    found = []
+    def add(mask, column_letter, message, message_args=()):
+        for row_position in numpy.flatnonzero(mask):
+            found.append((row_position, column_index(column_letter),
+                          message, message_args))
+
+    # senior column A - see in_sheet_validation_senior_columns for all the
+    # Excel formulae
+    other_cells = values[:, [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 15, 16]]  # ignore 'O'
+    is_blank_row = ~(other_cells.astype(bool) &
+                     ~pandas.isnull(other_cells)).any(axis=1)
+    a_text = numpy.array([a_ or '' for a_ in a], dtype=object)
+    check = ~is_blank_row
+    a_has_xx = _mask(a_text, lambda a_: 'XX' in a_, where=check)
+    add(a_has_xx, 'A', '%s: You cannot have "XX" in the "Post Unique Reference" column.')
+    check &= ~a_has_xx
+    a_has_space = _mask(a_text, lambda a_: ' ' in a_, where=check)
+    add(a_has_space, 'A', '%s: You cannot have spaces in the "Post Unique Reference" column.')
+    check &= ~a_has_space
+    add(_mask(a_text, POST_REF_SYMBOLS_REGEX.search, where=check),
+        'A', '%s: You cannot have punctuation/symbols in the "Post Unique Reference" column.')
+
+    # senior column B
+    b_is_nd = _equals(b, 'N/D')
+    b_is_na = _equals(b, 'N/A')
+    add(not_blank_a & a_is_0 & ~b_is_nd, 'B', '%s: Because the "Post Unique Reference" is "0" (individual is paid but not in post) the name must be "N/D".')
+    check = not_blank_a & ~a_is_0
+    p_is_greater_than_zero_or_a_string = \
+        _mask(p, _is_greater_than_zero_or_a_string, where=check)
+    name_not_disclosed = check & p_is_greater_than_zero_or_a_string & \
+        (b_is_nd | b_is_na)
+    add(name_not_disclosed & ~b_is_nd, 'B', u'%s: The "Name" cannot be "N/A" (unless "Total Pay (£)" is 0).')
+    add(name_not_disclosed & b_is_nd &
+        ~(_equals(p, 'N/D') | _equals(p, 'N/A')),
+        'B', u'%s: The "Name" cannot be "N/D" unless the "Total Pay (\xa3)" is 0 or N/A or N/D. i.e. Someone whose pay must be disclosed must also have their name disclosed (unless they are unpaid).')
+    add(check & ~name_not_disclosed & is_blank(b), 'B', u'%s: The "Name" cannot be blank.')
+
+    # senior column C
+    c_is_blank = is_blank(c)
+    add(not_blank_a & c_is_blank, 'C', u'%s: The "Grade (or equivalent)" cannot be blank.')
+    grades = Excel.match_list(references['listSeniorGrades'])
+    add(_mask(c, lambda c_: not grades.match(c_),
+              where=not_blank_a & ~c_is_blank),
+        'C', u'%s: The "Grade (or equivalent)" must be from the standard list: %s.',
+        (', '.join(['"%s"' % grade for grade in grades]),))
+
+    # senior column D
+    d_is_blank = is_blank(d)
+    add(not_blank_a & d_is_blank, 'D', u'%s: The "Job Title" cannot be blank.')
+    check = not_blank_a & ~d_is_blank & _is_text(d) & ~_equals(d, 'N/D')
+    d_is_not_in_post = _equals(d, 'Not in post')
+    add(check & a_is_0 & ~d_is_not_in_post, 'D', u'%s: Because the "Post Unique Reference" is "0" (individual is paid but not in post), the "Job Title" must be "Not in post".')
+    add(check & ~a_is_0 & d_is_not_in_post, 'D', u'%s: The "Job Title" can only be "Not in post" if the "Post Unique Reference" is "0" (individual is paid but not in post).')
+
+    # senior column E
+    e_is_blank = is_blank(e)
+    add(not_blank_a & e_is_blank, 'E', u'%s: The "Job/Team Function" cannot be blank.')
+    check = not_blank_a & ~e_is_blank & _is_text(e) & ~_equals(e, 'N/D')
+    e_is_na = _equals(e, 'N/A')
+    add(check & a_is_int_0 & ~e_is_na, 'E', u'%s: Because the "Post Unique Reference" is "0" (individual is paid but not in post), the "Job/Team Function" must be "N/A".')
+    add(check & ~a_is_int_0 & e_is_na, 'E', u'%s: The "Job/Team Function" can only be "N/A" if the "Post Unique Reference" is "0" (individual is paid but not in post).')
+
+    # senior column F is no longer checked
+
+    # senior column G
+    add(not_blank_a & (is_blank(g) | _equals(g, 'N/D')), 'G', u'%s: The "Organisation" must be disclosed - it cannot be blank or "N/D".')
+
+    # senior column H
+    h_not_disclosed = is_blank(h) | _equals(h, 'N/D')
+    add(not_blank_a & h_not_disclosed, 'H', u'%s: The "Unit" must be disclosed - it cannot be blank or "N/D".')
+    check = not_blank_a & ~h_not_disclosed
+    h_is_na = _equals(h, 'N/A')
+    add(check & a_is_int_0 & ~h_is_na, 'H', u'%s: Because the "Post Unique Reference" is "0" (individual is paid but not in post), the "Unit" must be "N/A".')
+    add(check & ~a_is_int_0 & h_is_na, 'H', u'%s: The "Unit" can only be "N/A" if the "Post Unique Reference" is "0" (individual is paid but not in post).')
+    check &= ~a_is_int_0 & ~h_is_na
+    if check.any():
+        # (only look up the units when needed, like the row-by-row version)
+        units = Excel.match_list(references['units'])
+        add(_mask(h, lambda h_: not units.match(h_), where=check),
+            'H', u'%s: The "Unit" must be from the standard list: %s.',
+            (', '.join(['"%s"' % grade for grade in units]),))
+
+    # senior column I
+    i_is_blank = is_blank(i)
+    i_is_nd = _equals(i, 'N/D')
+    j_is_nd = _equals(j, 'N/D')
+    add(not_blank_a & i_is_blank, 'I', u'%s: The "Contact Phone" must be supplied - it cannot be blank.')
+    check = not_blank_a & ~i_is_blank
+    i_is_contact = \
+        _mask(i, lambda i_: Excel.is_number(i_) or isinstance(i_, basestring)) \
+        & (~i_is_nd | ~j_is_nd)
+    i_is_na = _equals(i, 'N/A')
+    post_has_no_holder = a_is_0 | name_is_vacant_or_eliminated
+    add(check & i_is_contact & a_is_0 & ~i_is_na, 'I', u'%s: Because the "Post Unique Reference" is "0" (individual is paid but not in post), the "Contact Phone" must be "N/A".')
+    add(check & i_is_contact & ~a_is_0 & name_is_vacant_or_eliminated & ~i_is_na, 'I', u'%s: Because the "Name" is "Vacant" or "Eliminated", the "Contact Phone" must be "N/A".')
+    add(check & i_is_contact & ~post_has_no_holder & i_is_na, 'I', u'%s: The "Contact Phone" can only be "N/A" if the "Post Unique Reference" is "0" (individual is paid but not in post) or the "Name" is "Vacant".')
+    add(check & ~i_is_contact, 'I', u'%s: You must provide at least one form of contact. You cannot have both "Contact Phone" and "Contact E-mail" as "N/D".')
+
+    # senior column J
+    j_is_blank = is_blank(j)
+    j_is_na = _equals(j, 'N/A')
+    check = ~(~not_blank_a & j_is_blank) & ~(post_has_no_holder & j_is_na)
+    j_blank_error = check & j_is_blank & not_blank_a
+    add(j_blank_error, 'J', u'%s: The "Contact E-mail" must be supplied - it cannot be blank.')
+    check &= ~j_blank_error
+    j_na_error = check & j_is_na & ~_equals(a, '0')
+    add(j_na_error, 'J', u'%s: The "Contact E-mail" can only be "N/A" if the "Post Unique Reference" is "0" (individual is paid but not in post).')
+    check &= ~j_na_error
+    j_nd_error = check & i_is_nd & j_is_nd
+    add(j_nd_error, 'J', u'%s: You must provide at least one form of contact. You cannot have both "Contact Phone" and "Contact E-mail" as "N/D".')
+    check &= ~j_nd_error
+    j_is_email = _mask(j, lambda j_: isinstance(j_, basestring) and
+                       '@' in j_ and '.' in j_)
+    add(check & ~(j_is_nd | j_is_email), 'J', u'%s: The "Contact E-mail" must be a valid email address (containing "@" and "." characters) unless the "Name" is "Vacant" or "Eliminated", or the "Post Unique Reference" is "0" (the individual is paid but not in post). It cannot be blank.')
+
+    # senior column K
+    k_is_blank = is_blank(k)
+    add(not_blank_a & k_is_blank, 'K', u'%s: The "Reports to Senior Post" value must be supplied - it cannot be blank.')
+    check = not_blank_a & ~k_is_blank & ~_equals(k, 'XX')
+    if check.any():
+        seniorPostUniqueReference = ExcelMatchList(df.iloc[:, 0])
+        add(_mask(k, lambda k_: not seniorPostUniqueReference.match(k_),
+                  where=check),
+            'K', u'%s: The "Reports to Senior Post" value must match one of the values in "Post Unique Reference" (column A) or be "XX" (which is a top level post - reports to no-one in this sheet).')
+
+    found.sort(key=lambda error: error[:2])
+    index = df.index
+    for row_position, column_index_, message, message_args in found:
+        cell_ref = 'Sheet "%s" cell %s' % \
+            (sheet_name, cell_name(index[row_position], column_index_))
+        validation_errors.append(message % ((cell_ref,) + message_args))
+
+def _mask(values, function, where=None):
+    '''Returns a boolean array of function(value) for each of the values.
+    If "where" is given, the function is only called where it is True, and the
+    result is False elsewhere.
+    '''
+    if where is None:
+        results = (bool(function(value)) for value in values)
+    else:
+        results = (bool(function(value)) if where_ else False
+                   for value, where_ in itertools.izip(values, where))
+    return numpy.fromiter(results, dtype=bool, count=len(values))
+
+def _equals(values, value):
+    '''Element-wise == of an object array with a value'''
+    result = values == value
+    if not isinstance(result, numpy.ndarray):
+        # numpy gave up on the element-wise comparison
+        raise TypeError('Could not compare values with %r' % value)
+    return result
+
+def _is_text(values):
+    return _mask(values, lambda value: isinstance(value, basestring))
+
+def _is_greater_than_zero_or_a_string(value):
+    try:
+        return int(value) > 0
+    except ValueError:
+        # i.e. value is a string
+        # =AND('N/D'>0, TRUE)  is TRUE
+        return True
+
 def in_sheet_validation_junior_columns(row, df, validation_errors, sheet_name, references):
     # plenty of columns TODO
 
@@ -880,16 +1153,57 @@ class Excel(object):
 
     @classmethod
     def not_match(cls, value, list_):
-        # Excel's MATCH is case insensitive and numbers are the same whether int or strings
-        # NB it also allows wildcards ?* and escape char ~ so it would be worth checking
-        # there are none of those
-        if value == '*' and list_.any():
-            return False
+        # i.e. ISNA(MATCH(value, list_, 0))
+        return not cls.match_list(list_).match(value)
+
+    @classmethod
+    def match_list(cls, list_):
+        '''Returns the list as an ExcelMatchList, for repeated lookups'''
+        if isinstance(list_, ExcelMatchList):
+            return list_
+        return ExcelMatchList(list_)
+
+
+class ExcelMatchList(list):
+    '''A list of reference values (e.g. grades or units), indexed so that
+    Excel's MATCH(value, list, 0) can be done on it in constant time.
+
+    Excel's MATCH is case insensitive and numbers are the same whether int or
+    strings. It also allows wildcards ? and * and the escape char ~ - values
+    with those in are looked up with a (slower) scan of the list.
+    '''
+    def __init__(self, items):
+        super(ExcelMatchList, self).__init__(items)
+        self._lower_items = [unicode(item).lower() for item in self]
+        self._lower_item_set = set(self._lower_items)
+
+    def match(self, value):
         value_ = unicode(value).lower()
-        for item in list_:
-            if value_ == unicode(item).lower():
-                return False
-        return True
+        if isinstance(value, basestring) and \
+                EXCEL_WILDCARD_CHARS_REGEX.search(value_):
+            regex = excel_wildcards_to_regex(value_)
+            return any(regex.match(item) for item in self._lower_items)
+        return value_ in self._lower_item_set
+
+EXCEL_WILDCARD_CHARS_REGEX = re.compile(r'[?*~]')
+
+def excel_wildcards_to_regex(value):
+    '''
+    u'a?c*' returns a regex matching u'abc', u'abcdef' etc
+    '''
+    regex = []
+    chars = iter(value)
+    for char in chars:
+        if char == '~':
+            # escapes the next char, e.g. '~*' is a literal '*'
+            regex.append(re.escape(next(chars, '~')))
+        elif char == '?':
+            regex.append('.')
+        elif char == '*':
+            regex.append('.*')
+        else:
+            regex.append(re.escape(char))
+    return re.compile(''.join(regex) + r'\Z', re.DOTALL | re.UNICODE)
 
 def in_sheet_validation_row_colours(df, validation_errors, sheet_name):
     '''
@@ -974,18 +1288,27 @@ def get_verify_level(graph, xls_filepath):
         return 'load, display and be valid'
 
 
-def load_xls_and_get_errors(xls_filename):
+def load_xls_and_get_errors(xls_filename, cache=None):
     '''
     Used by tso_combined.py
     Does all checks and returns all errors.
     Returns: (senior_df, junior_df, errors, warnings, will_display)
+
+    cache - optional EtlCache, to get/store the result
     '''
+    return get_cached_result(
+        cache, xls_filename, ('load_xls_and_get_errors',),
+        lambda: _load_xls_and_get_errors(xls_filename))
+
+
+def _load_xls_and_get_errors(xls_filename):
     load_errors = []
     validation_errors = []
     warnings = []
-    references = get_references(xls_filename, load_errors, validation_errors, warnings)
-    senior_df = load_senior(xls_filename, load_errors, validation_errors, references)
-    junior_df = load_junior(xls_filename, load_errors, validation_errors, references)
+    workbook = open_workbook(xls_filename)
+    references = get_references(workbook, load_errors, validation_errors, warnings)
+    senior_df = load_senior(workbook, load_errors, validation_errors, references)
+    junior_df = load_junior(workbook, load_errors, validation_errors, references)
 
     if load_errors:
         return None, None, load_errors + validation_errors, warnings, False
@@ -1007,33 +1330,48 @@ def print_error(error_msg):
     print 'ERROR:', error_msg.encode('utf8')  # encoding for Drupal exec()
 
 
-def load_xls_and_stop_on_errors(xls_filename, verify_level, print_errors=True):
+def load_xls_and_stop_on_errors(xls_filename, verify_level, print_errors=True,
+                                cache=None):
     '''
     Loads the XLS, verifies it to an appropriate level and returns the data.
 
     If errors are not acceptable, it prints them and returns None.
     Returns: failure_stage, senior_df, junior_df, errors, warnings
+
+    cache - optional EtlCache, to get/store the result
+    '''
+    failure_stage, senior_df, junior_df, errors, warnings, \
+        errors_heading, errors_to_print = get_cached_result(
+            cache, xls_filename, ('load_xls_and_stop_on_errors', verify_level),
+            lambda: _load_xls_and_stop_on_errors(xls_filename, verify_level))
+    if errors_heading:
+        print errors_heading
+    if print_errors:
+        for error in errors_to_print:
+            print_error(error)
+    return failure_stage, senior_df, junior_df, errors, warnings
+
+
+def _load_xls_and_stop_on_errors(xls_filename, verify_level):
+    '''
+    Returns: failure_stage, senior_df, junior_df, errors, warnings,
+             errors_heading, errors_to_print
     '''
     load_errors = []
     validation_errors = []
     warnings = []
-    references = get_references(xls_filename, load_errors, validation_errors, warnings)
-    senior_df = load_senior(xls_filename, load_errors, validation_errors, references)
-    junior_df = load_junior(xls_filename, load_errors, validation_errors, references)
+    workbook = open_workbook(xls_filename)
+    references = get_references(workbook, load_errors, validation_errors, warnings)
+    senior_df = load_senior(workbook, load_errors, validation_errors, references)
+    junior_df = load_junior(workbook, load_errors, validation_errors, references)
 
     if load_errors:
-        print 'Critical error(s):'
-        if print_errors:
-            for error in load_errors:
-                print_error(error)
         # errors mean no rows can be got from the file, so can't do anything
-        return 'load', senior_df, junior_df, load_errors, warnings
+        return 'load', senior_df, junior_df, load_errors, warnings, \
+            'Critical error(s):', load_errors
     if validation_errors and verify_level == 'load, display and be valid':
-        print 'Validation error(s) during load:'
-        if print_errors:
-            for error in validation_errors:
-                print_error(error)
-        return 'validation', senior_df, junior_df, validation_errors, warnings
+        return 'validation', senior_df, junior_df, validation_errors, \
+            warnings, 'Validation error(s) during load:', validation_errors
 
     validate_errors = []
     if verify_level != 'load':
@@ -1041,17 +1379,76 @@ def load_xls_and_stop_on_errors(xls_filename, verify_level, print_errors=True):
             verify_graph(senior_df, junior_df, validate_errors)
         except ValidationFatalError, e:
             # display error - organogram is not displayable
-            if print_errors:
-                print_error(unicode(e))
-            return 'validating tree', senior_df, junior_df, validate_errors, warnings
+            return 'validating tree', senior_df, junior_df, validate_errors, \
+                warnings, None, [unicode(e)]
 
         if verify_level == 'load, display and be valid' and validate_errors:
-           validate_errors = dedupe_list(validate_errors)
-           if print_errors:
-                for error in validate_errors:
-                    print_error(error)
-           return 'validating tree', senior_df, junior_df, validate_errors, warnings
-    return None, senior_df, junior_df, validate_errors, warnings
+            validate_errors = dedupe_list(validate_errors)
+            return 'validating tree', senior_df, junior_df, validate_errors, \
+                warnings, None, validate_errors
+    return None, senior_df, junior_df, validate_errors, warnings, None, []
+
+
+def get_cached_result(cache, xls_filename, params, function):
+    '''Returns function(), getting it from the cache if possible (unless
+    cache is None), where the result depends only on the contents of the XLS
+    file and the params.'''
+    if cache is None:
+        return function()
+    with instrument('cache lookup'):
+        key = cache.key(xls_filename, *params)
+        result = cache.get(key)
+    if result is None:
+        result = function()
+        cache.set(key, result)
+    return result
+
+
+# the modules whose code the cached results depend on: this one, which does
+# the conversion, and etl_cache, which stores them
+CODE_VERSION_MODULES = ('etl_to_csv.py', 'etl_cache.py')
+
+
+def get_code_version():
+    '''Identifies the version of the code (CODE_VERSION_MODULES) and of the
+    libraries that read and check the XLS, so that results cached by other
+    versions are not used. (Changes to any other library are not noticed -
+    use --clear-cache after upgrading one that matters.)'''
+    code_hash = hashlib.sha1()
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for module_filename in CODE_VERSION_MODULES:
+        with open(os.path.join(code_dir, module_filename), 'rb') as f:
+            code_hash.update(f.read())
+    return '%s pandas-%s numpy-%s xlrd-%s' % (
+        code_hash.hexdigest(), pandas.__version__, numpy.__version__,
+        xlrd.__VERSION__)
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory to cache the results of converting '
+                             'each XLS in (default: %(default)s)')
+    parser.add_argument('--cache-max-size', type=int,
+                        default=DEFAULT_MAX_SIZE_MB,
+                        help='Maximum size of the cache in MB - the least '
+                             'recently used results are deleted beyond it '
+                             '(default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not get or store results in the cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Delete everything in the cache first')
+
+
+def get_cache_from_args(args):
+    '''Returns the EtlCache specified by the add_cache_arguments, or None'''
+    cache = EtlCache(args.cache_dir, max_size_mb=args.cache_max_size,
+                     code_version=get_code_version())
+    if args.clear_cache:
+        print "Clearing cache:", args.cache_dir
+        cache.clear()
+    if args.no_cache:
+        return None
+    return cache
 
 
 def dedupe_list(things):
@@ -1060,24 +1457,38 @@ def dedupe_list(things):
     return [x for x in things if not (x in seen or seen_add(x))]
 
 
-def main(input_xls_filepath, output_folder):
-    print "Loading", input_xls_filepath
-
+def get_verify_level_from_args(input_xls_filepath):
     if args.date:
-        verify_level = get_verify_level(args.date, input_xls_filepath)
+        return get_verify_level(args.date, input_xls_filepath)
     elif args.date_from_filename:
         date_ = get_date_from_filename(input_xls_filepath)
-        verify_level = get_verify_level(date_, input_xls_filepath)
+        return get_verify_level(date_, input_xls_filepath)
     else:
-        verify_level = 'load, display and be valid'
+        return 'load, display and be valid'
+
+
+def main(input_xls_filepath, output_folder, cache=None):
+    print "Loading", input_xls_filepath
+
+    verify_level = get_verify_level_from_args(input_xls_filepath)
     failure_stage, senior_df, junior_df, errors, warnings = \
         load_xls_and_stop_on_errors(input_xls_filepath, verify_level,
-                                    print_errors=True)
+                                    print_errors=True, cache=cache)
     if failure_stage != None:
         # fatal error has been printed
         return
 
-    # Calculate Organogram name
+    senior_filename, junior_filename, index_item = \
+        write_csvs(input_xls_filepath, output_folder, senior_df, junior_df)
+
+    # Write index file - used by Drupal
+    write_index([index_item], output_folder)  # a list because of legacy
+    print "Done."
+    # return values are only for the tests
+    return senior_filename, junior_filename, senior_df, junior_df
+
+
+def get_organogram_name(senior_df):
     _org = senior_df['Organisation']
     _org = _org[_org.notnull()].unique()
     name = " & ".join(_org)
@@ -1085,32 +1496,179 @@ def main(input_xls_filepath, output_folder):
         _unit = senior_df['Unit']
         _unit = _unit[_unit.notnull()].unique()
         name += " - " + (" & ".join(_unit))
-    # Write output files
+    return name
+
+
+def write_csvs(input_xls_filepath, output_folder, senior_df, junior_df):
+    '''Writes the senior and junior CSVs for an XLS.
+    Returns: (senior_filename, junior_filename, index_item)
+    '''
+    name = get_organogram_name(senior_df)
     basename, extension = os.path.splitext(os.path.basename(input_xls_filepath))
     senior_filename = os.path.join(output_folder, basename + '-senior.csv')
     junior_filename = os.path.join(output_folder, basename + '-junior.csv')
     print "Writing", senior_filename, junior_filename
 
     save_csvs(senior_filename, junior_filename, senior_df, junior_df)
+    return senior_filename, junior_filename, {'name': name, 'value': basename}
 
-    # Write index file - used by Drupal
-    index = [{'name': name, 'value': basename}]  # a list because of legacy
+
+def write_index(index, output_folder):
     index = sorted(index, key=lambda x: x['name'])
     index_filename = os.path.join(output_folder, 'index.json')
     print "Writing index file:", index_filename
     with open(index_filename, 'w') as f:
         json.dump(index, f)
+
+
+def main_batch(input_xls_filepaths, output_folder, workers=1,
+               summary_filename=None, cache=None):
+    '''Converts many XLS files, spread over a pool of worker processes.
+    Writes the CSVs for each XLS, a combined index.json and optionally a JSON
+    summary of how far each XLS got.
+    '''
+    jobs = [(input_xls_filepath, output_folder,
+             get_verify_level_from_args(input_xls_filepath), cache)
+            for input_xls_filepath in input_xls_filepaths]
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+        results = pool.imap(convert_xls_for_batch, jobs, chunksize=1)
+    else:
+        pool = None
+        results = itertools.imap(convert_xls_for_batch, jobs)
+
+    summary = []
+    try:
+        for i, result in enumerate(results):
+            print '%s/%s %s: %s' % (i + 1, len(jobs), result['xls_filepath'],
+                                    result['failure_stage'] or 'ok')
+            summary.append(result)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if cache is not None:
+        # the workers only count what they wrote themselves
+        cache.evict()
+
+    write_index([result['index'] for result in summary if result['index']],
+                output_folder)
+
+    if stage_stats is not None:
+        print 'Stage stats (totals for all the files):'
+        print format_report(total_stages(
+            result['stats'] for result in summary if 'stats' in result))
+
+    failure_stage_counts = defaultdict(int)
+    for result in summary:
+        failure_stage_counts[result['failure_stage'] or 'ok'] += 1
+    print 'Results: %s' % ', '.join(
+        '%s=%s' % stage_count
+        for stage_count in sorted(failure_stage_counts.items()))
+    if summary_filename:
+        print "Writing summary:", summary_filename
+        with open(summary_filename, 'w') as f:
+            json.dump(dict(failure_stage_counts=failure_stage_counts,
+                           files=summary), f, indent=2)
     print "Done."
-    # return values are only for the tests
-    return senior_filename, junior_filename, senior_df, junior_df
+    return summary
+
+
+def convert_xls_for_batch(job):
+    '''Converts one XLS, as part of main_batch. Runs in a worker process, so
+    returns the outcome as a plain dict rather than raising.'''
+    input_xls_filepath, output_folder, verify_level, cache = job
+    result = dict(xls_filepath=input_xls_filepath, verify_level=verify_level,
+                  failure_stage=None, errors=[], warnings=[], index=None)
+    if stage_stats is not None:
+        stage_stats.reset()
+    try:
+        failure_stage, senior_df, junior_df, errors, warnings = \
+            load_xls_and_stop_on_errors(input_xls_filepath, verify_level,
+                                        print_errors=False, cache=cache)
+        result.update(failure_stage=failure_stage, errors=errors,
+                      warnings=warnings)
+        if failure_stage is None:
+            senior_filename, junior_filename, result['index'] = \
+                write_csvs(input_xls_filepath, output_folder,
+                           senior_df, junior_df)
+    except Exception:
+        result.update(failure_stage='exception',
+                      errors=[traceback.format_exc()])
+    if stage_stats is not None:
+        result['stats'] = stage_stats.as_dicts()
+    return result
+
+
+def get_xls_filepaths(inputs):
+    '''Expands the input arguments, which may be XLS files, directories of
+    them or glob patterns.'''
+    xls_filepaths = []
+    for input_ in inputs:
+        if os.path.isdir(input_):
+            xls_filepaths.extend(sorted(
+                glob.glob(os.path.join(input_, '*.xls')) +
+                glob.glob(os.path.join(input_, '*.xlsx'))))
+        elif not os.path.exists(input_) and glob.has_magic(input_):
+            xls_filepaths.extend(sorted(glob.glob(input_)))
+        else:
+            xls_filepaths.append(input_)
+    return xls_filepaths
+
+
+CSV_OPTIONS = dict(encoding="utf-8",
+                   quoting=csv.QUOTE_ALL,
+                   float_format='%.2f',
+                   index=False)
+
 
 def save_csvs(senior_filename, junior_filename, senior_df, junior_df):
-    csv_options = dict(encoding="utf-8",
-                       quoting=csv.QUOTE_ALL,
-                       float_format='%.2f',
-                       index=False)
-    senior_df.to_csv(senior_filename, **csv_options)
-    junior_df.to_csv(junior_filename, **csv_options)
+    with instrument('save csvs') as stage:
+        stage.rows = len(senior_df) + len(junior_df)
+        save_csv(senior_filename, senior_df)
+        save_csv(junior_filename, junior_df)
+
+
+def save_csv(filename, df):
+    '''Writes the DataFrame as a CSV, the same as DataFrame.to_csv with
+    CSV_OPTIONS, but streaming the rows from the columns' values, rather than
+    to_csv converting each chunk of rows to an object array first.
+    '''
+    column_formatters = [csv_column_formatter(df[column_name])
+                         if not isinstance(df[column_name], pandas.DataFrame)
+                         else None
+                         for column_name in df.columns]
+    if None in column_formatters:
+        # e.g. datetime columns, or duplicate column names, which to_csv
+        # formats in its own way
+        df.to_csv(filename, **CSV_OPTIONS)
+        return
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow([csv_cell(column_name) for column_name in df.columns])
+        columns = [itertools.imap(formatter, df[column_name].values)
+                   for column_name, formatter
+                   in zip(df.columns, column_formatters)]
+        writer.writerows(itertools.izip(*columns))
+
+
+def csv_column_formatter(series):
+    '''Returns a function that formats a value of the series as it is
+    written in a CSV by to_csv, or None if the dtype is not handled.'''
+    if series.dtype.kind == 'f':
+        float_format = CSV_OPTIONS['float_format']
+        return lambda value: '' if value != value else float_format % value
+    elif series.dtype.kind == 'O':
+        return lambda value: '' if pandas.isnull(value) else csv_cell(value)
+    elif series.dtype.kind in 'iub':
+        return csv_cell
+    return None
+
+
+def csv_cell(value):
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    return value.encode('utf-8')
 
 
 def usage():
@@ -1128,16 +1686,51 @@ if __name__ == '__main__':
                         help='The strength of verify level picked according '
                              'to the date of the data, extracted from the '
                              'filename (for manual tests only!)')
-    parser.add_argument('input_xls_filepath')
+    parser.add_argument('input_xls_filepaths', nargs='+',
+                        metavar='input_xls_filepath',
+                        help='XLS file(s), directories of XLS files or glob '
+                             'patterns. More than one XLS is converted in '
+                             'batch mode.')
     parser.add_argument('output_folder')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to convert XLS files with, '
+                             'in batch mode')
+    parser.add_argument('--summary',
+                        help='Filename to write a JSON summary of the '
+                             'failure stage, errors and warnings of each XLS, '
+                             'in batch mode')
+    add_cache_arguments(parser)
+    parser.add_argument('--stats', action='store_true',
+                        help='Record the time, rows, errors and peak memory '
+                             'of each stage, and print them. In batch mode '
+                             'they are also written to the --summary')
     parser.add_argument('--verbose', '-v', action='store_true')
     args = parser.parse_args()
     if not os.path.isdir(args.output_folder):
         parser.error("Error: Not a directory: %s" % args.output_folder)
-    if not os.path.exists(args.input_xls_filepath):
-        parser.error("Error: File not found: %s" % args.input_xls_filepath)
+    input_xls_filepaths = get_xls_filepaths(args.input_xls_filepaths)
+    for input_xls_filepath in input_xls_filepaths:
+        if not os.path.exists(input_xls_filepath):
+            parser.error("Error: File not found: %s" % input_xls_filepath)
+    if not input_xls_filepaths:
+        parser.error("Error: No XLS files found: %s" %
+                     ' '.join(args.input_xls_filepaths))
+    if args.workers < 1:
+        parser.error("Error: --workers must be at least 1")
     if args.verbose:
         logging.basicConfig()
     else:
         logging.basicConfig(level=logging.CRITICAL)
-    main(args.input_xls_filepath, args.output_folder)
+    cache = get_cache_from_args(args)
+    if args.stats:
+        stage_stats = StageStats()
+    if args.input_xls_filepaths == input_xls_filepaths and \
+            len(input_xls_filepaths) == 1:
+        main(input_xls_filepaths[0], args.output_folder, cache=cache)
+        if stage_stats is not None:
+            print 'Stage stats:'
+            print stage_stats.report()
+    else:
+        main_batch(input_xls_filepaths, args.output_folder,
+                   workers=args.workers, summary_filename=args.summary,
+                   cache=cache)
@@ -0,0 +1,290 @@
+'''
+Shared HTTP client for the tools that make lots of requests to the
+triplestore, its linked data API and the TSO organogram site
+(compare_posts.py, triplestore_query.py, compare_triplestores.py,
+uploads_download.py).
+
+All the requests of a run go through one requests Session, so:
+
+* connections are kept alive and pooled per host (the pool size is tunable)
+* every request has a timeout - except that a SPARQL query (post_query) can
+  take minutes, so it only has one for connecting
+* responses are gzip compressed, where the server supports it
+* there is one retry policy - connection errors, timeouts and 5xx/429
+  responses are retried with exponential backoff (but a query that timed out
+  isn't sent again)
+* optionally, a rate limit on the requests of all the threads together
+* the number of requests and their latency are recorded, to report at the end
+  of the run
+
+Optionally, GET responses are cached in a response_cache.ResponseCache.
+
+Example:
+
+from http_client import get_client
+response = get_client().get(url)
+...
+print get_client().stats.report()
+'''
+
+import math
+import threading
+import time
+import timeit
+from collections import defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import response_cache
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 60
+# seconds to wait for the results of a SPARQL query - None is no limit
+DEFAULT_QUERY_TIMEOUT = None
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+RETRY_STATUS_CODES = set((429, 500, 502, 503, 504))
+
+
+class RequestStats(object):
+    '''Counts the requests by outcome and records the latency of those that
+    went over the network (i.e. not cache hits). Thread-safe.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latencies = []
+            self.counts = defaultdict(int)
+
+    def record(self, seconds, outcome, from_cache=False):
+        '''outcome - the status code, or 'error' for a connection error or
+                     timeout
+        '''
+        with self._lock:
+            self.counts['requests'] += 1
+            if from_cache:
+                self.counts['cached'] += 1
+                return
+            self.counts[outcome] += 1
+            self.latencies.append(seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.counts['retries'] += 1
+
+    def percentile(self, percent):
+        '''Returns the latency (seconds) at the given percentile (nearest
+        rank), or None if there have been no requests.'''
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        rank = int(math.ceil(percent * len(latencies) / 100.0)) - 1
+        return latencies[min(max(rank, 0), len(latencies) - 1)]
+
+    def report(self):
+        '''Returns a summary of the requests, for printing.'''
+        counts = self.counts.copy()
+        total = counts.pop('requests', 0)
+        details = ', '.join('%s: %s' % (outcome, counts[outcome])
+                            for outcome in sorted(counts, key=str))
+        lines = ['HTTP requests: %s%s' % (
+            total, ' (%s)' % details if details else '')]
+        if self.latencies:
+            lines.append('Latency: p50 %.3fs  p90 %.3fs  p99 %.3fs  '
+                         'max %.3fs' % tuple(self.percentile(percent)
+                                             for percent in (50, 90, 99, 100)))
+        return '\n'.join(lines)
+
+
+class RateLimiter(object):
+    '''Spaces out the requests, from all threads, to no more than the given
+    number per second.'''
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_time = 0
+
+    def wait(self):
+        with self._lock:
+            now = timeit.default_timer()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self.interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+class HttpClient(object):
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 rate_limit=None, session=None, cache=None,
+                 query_timeout=DEFAULT_QUERY_TIMEOUT):
+        '''
+        pool_size - number of connections to keep open to each host. Should
+                    be at least the number of threads making requests.
+        timeout - seconds to wait for the server to respond
+        query_timeout - seconds to wait for the results of a SPARQL query
+                        (see post_query). None is no limit.
+        retries - number of times to retry a failed request
+        backoff - seconds to wait before the first retry, doubling for each
+                  subsequent retry
+        rate_limit - maximum requests per second (default: no limit)
+        session - requests Session to use (default: a new one)
+        cache - response_cache.ResponseCache for the GET responses (default:
+                not cached)
+        '''
+        self.pool_size = pool_size
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.timeout = timeout
+        self.query_timeout = query_timeout
+        self.retries = retries
+        self.backoff = backoff
+        if session is None:
+            session = requests.Session()
+        self.cache = cache
+        if cache is not None:
+            adapter = response_cache.CachingAdapter(
+                cache, pool_connections=pool_size, pool_maxsize=pool_size)
+        else:
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.session = session
+        self.stats = RequestStats()
+
+    def request(self, method, url, raise_for_status=True,
+                retry_read_timeout=True, **kwargs):
+        '''Makes the request, retrying failures. Returns the response, or
+        raises a requests exception if it fails after the retries.
+
+        raise_for_status - if False, a 4xx/5xx response is returned, rather
+                           than raised as an HTTPError, for the caller to
+                           deal with
+        retry_read_timeout - if False, a timeout waiting for the response is
+                             raised rather than retried
+        kwargs - passed to requests e.g. data, params, auth
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+            start_time = timeit.default_timer()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout), e:
+                self.stats.record(timeit.default_timer() - start_time,
+                                  'error')
+                if attempt == self.retries or (
+                        not retry_read_timeout and
+                        isinstance(e, requests.ReadTimeout)):
+                    raise
+                print 'Failed request: %s %s' % (url, e)
+            else:
+                self.stats.record(timeit.default_timer() - start_time,
+                                  response.status_code,
+                                  getattr(response, 'from_cache', False))
+                if response.status_code not in RETRY_STATUS_CODES or \
+                        attempt == self.retries:
+                    if raise_for_status:
+                        response.raise_for_status()
+                    return response
+                print 'Failed request: %s %s' % (url, response.reason)
+            self.stats.record_retry()
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def post_query(self, url, **kwargs):
+        '''POSTs a SPARQL query. A query of the whole store can take
+        minutes, so only connecting has the usual timeout, and waiting for
+        the results has query_timeout. If that runs out, the query is not sent
+        again, since it would only make the endpoint repeat the work.'''
+        kwargs.setdefault('timeout', (self.timeout, self.query_timeout))
+        return self.request('POST', url, retry_read_timeout=False, **kwargs)
+
+
+_client = None
+
+
+def get_client():
+    '''Returns the HttpClient shared by the whole run, creating it with the
+    default settings if configure_client() has not been called.'''
+    global _client
+    if _client is None:
+        _client = HttpClient()
+    return _client
+
+
+def configure_client(**kwargs):
+    '''(Re)creates the shared HttpClient with the given settings (see
+    HttpClient). Returns it.'''
+    global _client
+    _client = HttpClient(**kwargs)
+    return _client
+
+
+def add_http_arguments(parser, cache=False):
+    '''cache - also add the arguments for the response cache'''
+    parser.add_argument('--http-pool-size', type=int,
+                        default=DEFAULT_POOL_SIZE,
+                        help='Number of HTTP connections to keep open to '
+                             'each host (default: %(default)s)')
+    parser.add_argument('--http-timeout', type=float,
+                        default=DEFAULT_TIMEOUT,
+                        help='Seconds to wait for an HTTP response '
+                             '(default: %(default)s)')
+    parser.add_argument('--query-timeout', type=float,
+                        default=DEFAULT_QUERY_TIMEOUT,
+                        help='Seconds to wait for the results of a SPARQL '
+                             'query (default: no limit)')
+    parser.add_argument('--http-retries', type=int,
+                        default=DEFAULT_RETRIES,
+                        help='Number of times to retry a failed HTTP request '
+                             '(default: %(default)s)')
+    parser.add_argument('--http-rate-limit', type=float,
+                        help='Maximum HTTP requests per second, over all '
+                             'the threads (default: no limit)')
+    parser.add_argument('--http-stats', action='store_true',
+                        help='Print the number of HTTP requests and their '
+                             'latency (and the cache hits) at the end')
+    if cache:
+        response_cache.add_cache_arguments(parser)
+
+
+def configure_client_from_args(args, min_pool_size=0, cache_namespace=None):
+    '''Configures the shared HttpClient from the arguments added by
+    add_http_arguments().
+
+    min_pool_size - e.g. the number of threads that will make requests
+    cache_namespace - cache the responses in this namespace of the
+                      ResponseCache, unless --no-cache. Needs the arguments
+                      added by add_http_arguments(parser, cache=True).
+    '''
+    cache = None
+    if cache_namespace:
+        cache = response_cache.cache_from_args(args, cache_namespace)
+    return configure_client(
+        pool_size=max(args.http_pool_size, min_pool_size),
+        timeout=args.http_timeout,
+        query_timeout=args.query_timeout,
+        retries=args.http_retries,
+        rate_limit=args.http_rate_limit,
+        cache=cache)
+
+
+def print_stats_from_args(args):
+    '''Prints the stats of the shared HttpClient, if --http-stats was given
+    and any requests were made.'''
+    if args.http_stats and _client is not None and \
+            _client.stats.counts['requests']:
+        print _client.stats.report()
+        if _client.cache is not None:
+            print _client.cache.stats.report(_client.cache.namespace)
@@ -0,0 +1,82 @@
+'''
+Normalizing of department names and values, for ironing out trivial
+differences when matching them.
+
+The same names turn up in every row of the reports, so the results are
+memoized, and canonize_column does a whole column of names, normalizing each
+distinct one only once.
+
+Example:
+
+from normalize import canonize, canonize_column
+canonize('Department for Culture, Media & Sport')
+# 'department culture media sport'
+canonize_column(row['org_name'] for row in rows)
+'''
+
+import re
+
+# number of results memoized by each function. They are dropped when it is
+# full, which is plenty for our reports of a few thousand names.
+MEMO_SIZE = 100000
+
+dept_char_filter_regex = re.compile('[^a-z0-9 ]')
+stop_words = set(('and', 'to', 'of', 'for', 'the'))
+value_stop_words_regex = re.compile('(and|the)')
+value_char_filter_regex = re.compile('[^a-z0-9]')
+whitespace_regex = re.compile('\s+')
+
+
+def memoize(function):
+    '''Decorator that memoizes a function of one (hashable) argument, keeping
+    up to MEMO_SIZE results.'''
+    memo = {}
+
+    def memoized(value):
+        try:
+            return memo[value]
+        except KeyError:
+            pass
+        if len(memo) >= MEMO_SIZE:
+            memo.clear()
+        result = memo[value] = function(value)
+        return result
+    memoized.memo = memo
+    memoized.__name__ = function.__name__
+    memoized.__doc__ = function.__doc__
+    return memoized
+
+
+@memoize
+def canonize(title):
+    '''Returns a slightly simplified version of a public body name, for ironing
+    out trivial differences when matching.'''
+    title = title.lower().strip()
+    if not title.startswith('http'):
+        title = dept_char_filter_regex.sub('', title)
+        title = ' '.join(w for w in title.split() if w not in stop_words)
+    return title
+
+
+@memoize
+def canonize_value(value):
+    '''Returns a simplified version of a value in a post, for spotting
+    duplicates.'''
+    value = value.strip(' \'\"\.').lower()  # remove enclosing junk
+    value = value_stop_words_regex.sub('', value)  # remove stop words
+    value = value_char_filter_regex.sub('', value)  # leave only chars
+    value = whitespace_regex.sub(' ', value)  # no double spaces
+    return value
+
+
+def canonize_column(values, canonize=canonize):
+    '''Canonizes all the values (e.g. a column of a CSV), doing each distinct
+    value once. Returns a list of the canonized values, in the same order.
+    '''
+    canonized = {}
+    results = []
+    for value in values:
+        if value not in canonized:
+            canonized[value] = canonize(value)
+        results.append(canonized[value])
+    return results
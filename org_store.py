@@ -0,0 +1,190 @@
+'''
+Store of the data.gov.uk organizations (departments and public bodies), kept
+up to date by only fetching the ones that have changed.
+
+The orgs are kept in SQLite, indexed by name, title and canonized title, so an
+org is only loaded when it is looked up. Refreshing gets the list of orgs
+with their revision_id and fetches (concurrently) only the orgs that are new
+or have a different revision since they were stored.
+
+Example:
+
+import ckanapi
+from org_store import OrgStore
+store = OrgStore('.dgu_departments.sqlite', canonize)
+if store.age() > 24 * 60 * 60:
+    store.refresh(ckanapi.RemoteCKAN('https://data.gov.uk'))
+store.by('title')['Cabinet Office']['name']
+# 'cabinet-office'
+'''
+
+import hashlib
+import json
+import sqlite3
+import time
+
+# pip install progress
+from progress.bar import Bar
+
+from crawler import imap_unordered
+
+DEFAULT_CONCURRENCY = 8
+COLUMNS = ('name', 'title', 'canonized_title')
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS orgs (
+    name TEXT PRIMARY KEY,
+    title TEXT,
+    canonized_title TEXT,
+    version TEXT,
+    org TEXT
+);
+CREATE INDEX IF NOT EXISTS orgs_title ON orgs (title);
+CREATE INDEX IF NOT EXISTS orgs_canonized_title ON orgs (canonized_title);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def org_version(org):
+    '''Returns something that changes when the org is edited. CKAN gives
+    the revision_id, but failing that, the org (summary) is hashed.'''
+    return org.get('revision_id') or org.get('metadata_modified') or \
+        hashlib.sha1(json.dumps(org, sort_keys=True)).hexdigest()
+
+
+class OrgStore(object):
+    def __init__(self, filename, canonize):
+        '''
+        filename - the SQLite file
+        canonize - function to canonize a title, for looking up by it
+        '''
+        self.filename = filename
+        self.canonize = canonize
+        self._connection = sqlite3.connect(filename)
+        self._connection.executescript(SCHEMA)
+        self._orgs = {}  # {name: org} of those loaded
+
+    def age(self):
+        '''Returns the number of seconds since the store was refreshed, or
+        None if it never has been.'''
+        row = self._connection.execute(
+            'SELECT value FROM meta WHERE key = ?', ('refreshed',)).fetchone()
+        if row is None:
+            return None
+        return time.time() - float(row[0])
+
+    def refresh(self, ckan, concurrency=DEFAULT_CONCURRENCY):
+        '''Updates the store from the CKAN (a ckanapi.RemoteCKAN), fetching
+        only the orgs that are new or changed. Returns the number of orgs
+        (fetched, deleted).'''
+        org_summaries = ckan.action.organization_list(all_fields=True)
+        versions = dict((org['name'], org_version(org))
+                        for org in org_summaries)
+        stored_versions = dict(self._connection.execute(
+            'SELECT name, version FROM orgs'))
+        changed_names = [name for name, version in versions.iteritems()
+                         if stored_versions.get(name) != version]
+        deleted_names = set(stored_versions) - set(versions)
+
+        def get_org(name):
+            return ckan.action.organization_show(id=name)
+        fetched = imap_unordered(get_org, sorted(changed_names),
+                                 concurrency)
+        if changed_names:
+            fetched = Bar('Reading changed DGU organizations',
+                          max=len(changed_names)).iter(fetched)
+        for name, org in fetched:
+            # saved as it goes, so if interrupted, it carries on from here
+            with self._connection:
+                self._put(org, versions[name])
+        with self._connection:
+            for name in deleted_names:
+                self._connection.execute('DELETE FROM orgs WHERE name = ?',
+                                         (name,))
+                self._orgs.pop(name, None)
+            self._connection.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                ('refreshed', repr(time.time())))
+        print 'DGU organizations: %s fetched, %s deleted, %s unchanged' % (
+            len(changed_names), len(deleted_names),
+            len(versions) - len(changed_names))
+        return len(changed_names), len(deleted_names)
+
+    def put(self, org):
+        '''Adds or updates an org, as returned by organization_show.'''
+        with self._connection:
+            self._put(org, org_version(org))
+
+    def _put(self, org, version):
+        org = dict(org)
+        if isinstance(org.get('extras'), list):
+            # convert the extras into a dict
+            org['extras'] = dict((extra['key'], extra['value'])
+                                 for extra in org['extras'])
+        self._connection.execute(
+            'INSERT OR REPLACE INTO orgs '
+            '(name, title, canonized_title, version, org) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (org['name'], org['title'], self.canonize(org['title']), version,
+             json.dumps(org)))
+        self._orgs[org['name']] = org
+
+    def get(self, column, value):
+        '''Returns the org with the value of the column (one of COLUMNS), or
+        None.'''
+        assert column in COLUMNS
+        if column == 'name' and value in self._orgs:
+            return self._orgs[value]
+        row = self._connection.execute(
+            'SELECT name, org FROM orgs WHERE %s = ? LIMIT 1' % column,
+            (value,)).fetchone()
+        if row is None:
+            return None
+        name, org = row
+        if name not in self._orgs:
+            self._orgs[name] = json.loads(org)
+        return self._orgs[name]
+
+    def values(self, column):
+        '''Returns the distinct values of the column for all the orgs.'''
+        assert column in COLUMNS
+        return [row[0] for row in self._connection.execute(
+            'SELECT DISTINCT %s FROM orgs' % column)]
+
+    def by(self, column):
+        return OrgIndex(self, column)
+
+    def close(self):
+        self._connection.close()
+
+
+class OrgIndex(object):
+    '''Read-only dict of the orgs in an OrgStore, keyed by one of its
+    COLUMNS, that loads orgs as they are looked up.'''
+    def __init__(self, store, column):
+        self.store = store
+        self.column = column
+
+    def get(self, key, default=None):
+        org = self.store.get(self.column, key)
+        return default if org is None else org
+
+    def __getitem__(self, key):
+        org = self.store.get(self.column, key)
+        if org is None:
+            raise KeyError(key)
+        return org
+
+    def __contains__(self, key):
+        return self.store.get(self.column, key) is not None
+
+    def keys(self):
+        return self.store.values(self.column)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+'''
+Cache of HTTP responses, for the tools that make lots of requests to the
+triplestore's linked data API, data.gov.uk and the TSO organogram site. It
+replaces the requests_cache SQLite files, which grew to several GB and had to
+be moved out of the way by hand between runs.
+
+The cache is a directory with a subdirectory per namespace (one per tool,
+e.g. 'compare_posts') and within that a SQLite shard per graph (e.g.
+2012-09-30.sqlite) - or per host, for URLs that aren't about a graph. So:
+
+* each shard stays small enough that a lookup (by a hash of the URL) is
+  quick, however many responses there are in total
+* a graph's responses can be cleared on their own, e.g. when it is reloaded
+* bodies are stored zlib compressed
+* each namespace has its own TTL (e.g. data.gov.uk is refreshed monthly, but
+  the triplestore graphs don't change)
+* when a namespace exceeds its maximum size, the least recently used
+  responses are evicted
+* hits, misses etc. are counted, to report at the end of the run
+
+Only successful GET responses are cached. Use it via http_client.HttpClient
+(cache=ResponseCache(...)) or, for libraries that take a requests Session
+(e.g. ckanapi), cached_session().
+
+Example:
+
+from response_cache import cached_session
+session = cached_session('scrape')
+response = session.get(url)
+
+Maintenance:
+
+    ./response_cache.py info
+    ./response_cache.py compact
+    ./response_cache.py clear --namespace compare_posts --shard 2012-09-30
+'''
+
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import urlparse
+import zlib
+from collections import defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+DEFAULT_CACHE_DIR = '.http_cache'
+DEFAULT_MAX_SIZE_MB = 2000
+# seconds before a response expires, by namespace. None means never.
+NAMESPACE_TTLS = {
+    'compare_posts': None,
+    'scrape': None,
+    }
+SHARD_EXTENSION = '.sqlite'
+# the graph in a linked data API or organogram URL e.g.
+# http://reference.data.gov.uk/2012-09-30/doc/department/co/post.json
+GRAPH_RE = re.compile(r'/(\d{4}-\d{2}-\d{2})(?:/|$)')
+# headers that describe the transfer, rather than the (decoded) body stored
+TRANSFER_HEADERS = set(('content-encoding', 'content-length',
+                        'transfer-encoding', 'connection'))
+# when evicting, get down to this fraction of the maximum size, so that it
+# isn't needed again on the very next response stored
+EVICT_TO = 0.9
+# responses evicted from each shard per query
+EVICT_BATCH_SIZE = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    status INTEGER,
+    reason TEXT,
+    headers TEXT,
+    body BLOB,
+    size INTEGER,
+    created REAL,
+    accessed REAL);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+'''
+
+
+def shard_name(url):
+    '''Returns the name of the shard for the URL - the graph, if it has one,
+    otherwise the host.'''
+    url = urlparse.urlparse(url)
+    match = GRAPH_RE.search(url.path)
+    if match:
+        return match.group(1)
+    return re.sub(r'[^\w.-]', '_', url.netloc) or 'default'
+
+
+def response_key(method, url, body=None):
+    hash_ = hashlib.sha1('%s %s' % (method, url))
+    if body:
+        hash_.update(body if isinstance(body, str) else repr(body))
+    return hash_.hexdigest()
+
+
+class CacheStats(object):
+    '''Counts the lookups by outcome (hit, miss, expired) and the responses
+    stored and evicted. Thread-safe.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = defaultdict(int)
+
+    def record(self, outcome, count=1):
+        with self._lock:
+            self.counts[outcome] += count
+
+    def report(self, namespace):
+        '''Returns a summary, for printing.'''
+        counts = self.counts
+        lookups = counts['hit'] + counts['miss'] + counts['expired']
+        return 'Response cache %s: %s lookups, %s hits (%.0f%%), ' \
+            '%s misses, %s expired, %s stored, %s evicted' % (
+                namespace, lookups, counts['hit'],
+                100.0 * counts['hit'] / lookups if lookups else 0,
+                counts['miss'], counts['expired'], counts['stored'],
+                counts['evicted'])
+
+
+class ResponseCache(object):
+    '''The responses of one namespace, sharded by graph. Thread-safe - each
+    shard has one connection, shared by all the threads under the shard's own
+    lock, so threads using different shards don't wait for each other.
+
+    Locks are taken in this order: _evict_lock, then a shard's lock, then
+    _lock, which only guards the namespace's bookkeeping (_connections,
+    _sizes and _shard_locks).'''
+    # seconds between updates to a response's last access time. Saves a
+    # write for most hits, at the cost of a less precise LRU.
+    access_resolution = 60 * 60
+
+    def __init__(self, namespace, cache_dir=DEFAULT_CACHE_DIR,
+                 max_size_mb=DEFAULT_MAX_SIZE_MB, ttl='default'):
+        '''
+        namespace - e.g. the name of the tool
+        max_size_mb - size of the namespace's (compressed) responses, above
+                      which the least recently used are evicted
+        ttl - seconds before a response expires, or None for never. Default:
+              NAMESPACE_TTLS for the namespace.
+        '''
+        self.namespace = namespace
+        self.dir = os.path.join(cache_dir, namespace)
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.ttl = NAMESPACE_TTLS.get(namespace) if ttl == 'default' else ttl
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._shard_locks = {}
+        self._connections = {}
+        # {shard: total size of its responses}, for all the shards once
+        # _total_size() has been called
+        self._sizes = {}
+        self._all_shards_sized = False
+
+    def _shard_lock(self, shard):
+        with self._lock:
+            lock = self._shard_locks.get(shard)
+            if lock is None:
+                lock = self._shard_locks[shard] = threading.Lock()
+            return lock
+
+    def _connection(self, shard):
+        '''Returns the shard's connection, opening it if need be. Call it
+        holding the shard's lock.'''
+        connection = self._connections.get(shard)
+        if connection is None:
+            with self._lock:
+                if not os.path.isdir(self.dir):
+                    os.makedirs(self.dir)
+            connection = sqlite3.connect(
+                os.path.join(self.dir, shard + SHARD_EXTENSION),
+                timeout=60, check_same_thread=False)
+            connection.text_factory = str
+            # it is only a cache, so durability can be traded for speed
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.executescript(SCHEMA)
+            with self._lock:
+                self._connections[shard] = connection
+            self._resize(shard, connection)
+        return connection
+
+    def _resize(self, shard, connection):
+        '''Recounts the size of the shard's responses. Call it holding the
+        shard's lock.'''
+        size = connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        with self._lock:
+            self._sizes[shard] = size
+
+    def _open_shards(self):
+        with self._lock:
+            return sorted(self._connections)
+
+    def shards(self):
+        '''Returns the names of the shards on disk.'''
+        if not os.path.isdir(self.dir):
+            return []
+        return sorted(filename[:-len(SHARD_EXTENSION)]
+                      for filename in os.listdir(self.dir)
+                      if filename.endswith(SHARD_EXTENSION))
+
+    def _is_expired(self, created, now):
+        return self.ttl is not None and created < now - self.ttl
+
+    def get(self, method, url, body=None):
+        '''Returns the cached response as a dict (status, reason, headers,
+        content) or None if it is not cached or has expired.'''
+        key = response_key(method, url, body)
+        shard = shard_name(url)
+        now = time.time()
+        with self._shard_lock(shard):
+            connection = self._connection(shard)
+            row = connection.execute(
+                'SELECT status, reason, headers, body, created, accessed '
+                'FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats.record('miss')
+                return None
+            status, reason, headers, body, created, accessed = row
+            if self._is_expired(created, now):
+                self.stats.record('expired')
+                return None
+            if now - accessed > self.access_resolution:
+                connection.execute(
+                    'UPDATE responses SET accessed = ? WHERE key = ?',
+                    (now, key))
+                connection.commit()
+        self.stats.record('hit')
+        return dict(status=status, reason=reason,
+                    headers=json.loads(headers),
+                    content=zlib.decompress(body))
+
+    def set(self, method, url, status, reason, headers, content, body=None):
+        '''Stores the response.
+
+        headers - dict
+        content - the (decoded) body of the response
+        body - the body of the request, if any
+        '''
+        key = response_key(method, url, body)
+        shard = shard_name(url)
+        headers = json.dumps(dict((name, value)
+                                  for name, value in headers.items()
+                                  if name.lower() not in TRANSFER_HEADERS))
+        compressed = zlib.compress(content)
+        size = len(compressed) + len(headers)
+        now = time.time()
+        with self._shard_lock(shard):
+            connection = self._connection(shard)
+            old_row = connection.execute(
+                'SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?,?)',
+                (key, status, reason, headers, sqlite3.Binary(compressed),
+                 size, now, now))
+            connection.commit()
+            with self._lock:
+                self._sizes[shard] += size - (old_row[0] if old_row else 0)
+        self.stats.record('stored')
+        if self._total_size() > self.max_size_bytes:
+            self.evict()
+
+    def _total_size(self):
+        if not self._all_shards_sized:
+            for shard in self.shards():
+                with self._shard_lock(shard):
+                    self._connection(shard)
+            self._all_shards_sized = True
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def evict(self, max_size_bytes=None):
+        '''Deletes the least recently used responses, over all the shards,
+        until the namespace is below the maximum size. Returns the number
+        evicted.'''
+        if max_size_bytes is None:
+            max_size_bytes = self.max_size_bytes
+        target_size = int(max_size_bytes * EVICT_TO)
+        num_evicted = 0
+        with self._evict_lock:
+            size = self._total_size()
+            while size > target_size:
+                # merge the oldest of each shard
+                oldest_by_shard = []
+                for shard in self._open_shards():
+                    with self._shard_lock(shard):
+                        oldest_by_shard.append(
+                            [(accessed, shard, key, size_)
+                             for accessed, key, size_
+                             in self._connection(shard).execute(
+                                 'SELECT accessed, key, size FROM responses '
+                                 'ORDER BY accessed LIMIT ?',
+                                 (EVICT_BATCH_SIZE,))])
+                keys_by_shard = defaultdict(list)
+                for accessed, shard, key, size_ in \
+                        heapq.merge(*oldest_by_shard):
+                    if size <= target_size:
+                        break
+                    keys_by_shard[shard].append(key)
+                    size -= size_
+                if not keys_by_shard:
+                    break
+                for shard, keys in keys_by_shard.items():
+                    self._delete(shard, keys)
+                    num_evicted += len(keys)
+                # other threads may have stored responses meanwhile
+                size = self._total_size()
+        self.stats.record('evicted', num_evicted)
+        return num_evicted
+
+    def _delete(self, shard, keys):
+        with self._shard_lock(shard):
+            connection = self._connection(shard)
+            connection.executemany('DELETE FROM responses WHERE key = ?',
+                                   [(key,) for key in keys])
+            connection.commit()
+            self._resize(shard, connection)
+
+    def compact(self):
+        '''Deletes the expired responses, evicts down to the maximum size and
+        then reclaims the space in the shard files. Returns the number of
+        responses deleted.'''
+        num_deleted = 0
+        self._total_size()
+        if self.ttl is not None:
+            expiry = time.time() - self.ttl
+            for shard in self._open_shards():
+                with self._shard_lock(shard):
+                    connection = self._connection(shard)
+                    num_deleted += connection.execute(
+                        'DELETE FROM responses WHERE created < ?',
+                        (expiry,)).rowcount
+                    connection.commit()
+                    self._resize(shard, connection)
+        num_deleted += self.evict()
+        for shard in self._open_shards():
+            with self._shard_lock(shard):
+                self._connection(shard).execute('VACUUM')
+        return num_deleted
+
+    def _close_shard(self, shard):
+        '''Call it holding the shard's lock.'''
+        with self._lock:
+            connection = self._connections.pop(shard, None)
+            self._sizes.pop(shard, None)
+        if connection is not None:
+            connection.close()
+
+    def clear(self, shard=None):
+        '''Deletes the responses of the shard, or of the whole namespace.'''
+        shards = [shard] if shard else self.shards()
+        for shard in shards:
+            with self._shard_lock(shard):
+                self._close_shard(shard)
+                for suffix in ('', '-wal', '-shm'):
+                    path = os.path.join(self.dir,
+                                        shard + SHARD_EXTENSION + suffix)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def info(self):
+        '''Returns [(shard, number of responses, size in bytes), ...]'''
+        self._total_size()
+        info = []
+        for shard in self._open_shards():
+            with self._shard_lock(shard):
+                count = self._connection(shard).execute(
+                    'SELECT COUNT(*) FROM responses').fetchone()[0]
+                with self._lock:
+                    info.append((shard, count, self._sizes[shard]))
+        return info
+
+    def close(self):
+        for shard in self._open_shards():
+            with self._shard_lock(shard):
+                self._close_shard(shard)
+        self._all_shards_sized = False
+
+
+class CachingAdapter(HTTPAdapter):
+    '''A requests transport adapter that serves GET requests from the
+    ResponseCache and stores the successful responses in it. A response from
+    the cache has from_cache = True.'''
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        super(CachingAdapter, self).__init__(**kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != 'GET':
+            return super(CachingAdapter, self).send(request, stream=stream,
+                                                    **kwargs)
+        cached = self.cache.get(request.method, request.url, request.body)
+        if cached is not None:
+            return self.build_cached_response(request, cached)
+        response = super(CachingAdapter, self).send(request, stream=stream,
+                                                    **kwargs)
+        response.from_cache = False
+        # a streamed body is left for the caller to read
+        if response.status_code == 200 and not stream:
+            self.cache.set(request.method, request.url,
+                           response.status_code, response.reason,
+                           response.headers, response.content, request.body)
+        return response
+
+    def build_cached_response(self, request, cached):
+        response = requests.Response()
+        response.status_code = cached['status']
+        response.reason = cached['reason']
+        response.headers = CaseInsensitiveDict(cached['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = cached['content']
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return response
+
+
+def cached_session(namespace, **kwargs):
+    '''Returns a requests Session whose GET responses are cached in the
+    namespace. kwargs are passed to ResponseCache.'''
+    session = requests.Session()
+    adapter = CachingAdapter(ResponseCache(namespace, **kwargs))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't use the cache of HTTP responses")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory of the cache of HTTP responses '
+                             '(default: %(default)s)')
+    parser.add_argument('--cache-max-size', type=float,
+                        default=DEFAULT_MAX_SIZE_MB,
+                        help='MB of HTTP responses to keep in the cache '
+                             '(default: %(default)s)')
+
+
+def cache_from_args(args, namespace):
+    '''Returns the ResponseCache given by the arguments added by
+    add_cache_arguments(), or None for --no-cache.'''
+    if args.no_cache:
+        return None
+    return ResponseCache(namespace, cache_dir=args.cache_dir,
+                         max_size_mb=args.cache_max_size)
+
+
+def open_namespaces():
+    '''Returns the ResponseCache of each namespace in the --cache-dir, or just
+    the --namespace.'''
+    if args.namespace:
+        names = [args.namespace]
+    elif os.path.isdir(args.cache_dir):
+        names = sorted(name for name in os.listdir(args.cache_dir)
+                       if os.path.isdir(os.path.join(args.cache_dir, name)))
+    else:
+        names = []
+    return [ResponseCache(name, cache_dir=args.cache_dir,
+                          max_size_mb=args.cache_max_size)
+            for name in names]
+
+
+def info_cmd():
+    for cache in open_namespaces():
+        for shard, count, size in cache.info():
+            print '%s %s: %s responses, %.1f MB' % (
+                cache.namespace, shard, count, size / 1024.0 / 1024)
+        cache.close()
+
+
+def compact_cmd():
+    for cache in open_namespaces():
+        print '%s: deleted %s responses' % (cache.namespace, cache.compact())
+        cache.close()
+
+
+def clear_cmd():
+    for cache in open_namespaces():
+        cache.clear(args.shard)
+        cache.close()
+
+
+args = None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='(default: %(default)s)')
+    parser.add_argument('--cache-max-size', type=float,
+                        default=DEFAULT_MAX_SIZE_MB,
+                        help='MB of responses to keep in each namespace, '
+                             'for compact (default: %(default)s)')
+    parser.add_argument('--namespace',
+                        help='e.g. compare_posts (default: all of them)')
+    subparsers = parser.add_subparsers()
+    subparser = subparsers.add_parser(
+        'info', help='Count the responses in each shard')
+    subparser.set_defaults(func=info_cmd)
+    subparser = subparsers.add_parser(
+        'compact', help='Delete expired responses, evict down to the '
+        '--cache-max-size and reclaim the disk space')
+    subparser.set_defaults(func=compact_cmd)
+    subparser = subparsers.add_parser(
+        'clear', help='Delete the responses')
+    subparser.add_argument('--shard',
+                           help='Only the responses of this shard e.g. '
+                                '2012-09-30 (default: all)')
+    subparser.set_defaults(func=clear_cmd)
+    args = parser.parse_args()
+    args.func()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+'''
+HTTP server for the tests of the HTTP client, crawler and response cache,
+which runs in a thread of the test process.
+'''
+import BaseHTTPServer
+import SocketServer
+import json
+import random
+import threading
+import time
+import urlparse
+from collections import defaultdict
+
+import requests
+
+from http_client import HttpClient
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Serves a linked data API-like list for /post/<id>.json?_page=<n> with
+    3 items per page, 7 items in total. /flaky/<n> fails with a 503 n times
+    before succeeding. POST echoes the form data back as JSON, after n
+    seconds for /slow/<n>.'''
+    requests_by_path = defaultdict(int)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        self.requests_by_path[url.path] += 1
+        if url.path.startswith('/flaky/'):
+            if self.requests_by_path[url.path] <= int(url.path.split('/')[-1]):
+                self.send_response(503)
+                self.end_headers()
+                return
+            data = {'ok': True}
+        else:
+            post_id = url.path.split('/')[-1].replace('.json', '')
+            page = int(urlparse.parse_qs(url.query)['_page'][0])
+            # respond in a random order to check the results are ordered
+            time.sleep(random.random() * 0.01)
+            data = {'result': {
+                'itemsPerPage': 3,
+                'items': ['%s-%s' % (post_id, i)
+                          for i in range((page - 1) * 3, min(page * 3, 7))]}}
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.requests_by_path[self.path] += 1
+        if self.path.startswith('/slow/'):
+            time.sleep(float(self.path.split('/')[-1]))
+        length = int(self.headers.getheader('Content-Length'))
+        data = urlparse.parse_qs(self.rfile.read(length))
+        body = json.dumps(data)
+        self.send_response(400 if 'bad' in data else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # e.g. the client timed out and closed the connection - the tests
+        # check what the client got
+        pass
+
+
+class StubServerTest(object):
+    @classmethod
+    def setup_class(cls):
+        cls.server = StubServer(('localhost', 0), StubHandler)
+        cls.url = 'http://localhost:%s' % cls.server.server_address[1]
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setup(self):
+        StubHandler.requests_by_path.clear()
+        self.client = HttpClient(pool_size=4, backoff=0,
+                                 session=requests.Session())
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os.path
+import tempfile
+import shutil
+from nose.tools import assert_equal
+
+from etl_to_csv import load_xls_and_get_errors
+from benchmark_etl import generate_organogram, time_stages, STAGES
+
+
+class TestGenerateOrganogram():
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def test_valid(self):
+        for shape in ('balanced', 'wide', 'deep'):
+            xls_filepath = os.path.join(self.dir, '%s.xls' % shape)
+            generate_organogram(xls_filepath, 300, shape)
+            senior, junior, errors, warnings, will_display = \
+                load_xls_and_get_errors(xls_filepath)
+            assert_equal(errors, [])
+            assert_equal(will_display, True)
+            assert_equal(len(junior), 240)
+
+    def test_invalid(self):
+        xls_filepath = os.path.join(self.dir, 'invalid.xls')
+        generate_organogram(xls_filepath, 300, invalid=True)
+        senior, junior, errors, warnings, will_display = \
+            load_xls_and_get_errors(xls_filepath)
+        assert errors
+
+    def test_time_stages(self):
+        xls_filepath = os.path.join(self.dir, 'organogram.xls')
+        generate_organogram(xls_filepath, 100)
+        timings, error_counts, senior_rows, junior_rows = \
+            time_stages(xls_filepath, self.dir)
+        assert_equal(list(timings.keys()), list(STAGES))
+        assert_equal(dict(error_counts),
+                     {'load': 0, 'validation': 0, 'verify graph': 0})
+        assert_equal(junior_rows, 80)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from nose.tools import assert_equal
+import fuzzywuzzy.fuzz
+
+from candidate_index import CandidateIndex
+
+TITLES = ['cabinet office', 'home office', 'hm treasury', 'ministry justice',
+          'ministry defence', 'youth justice board', 'sia', 'ofsted', 'ahrc',
+          'arts humanities research council', 'nhs litigation authority',
+          'nhs la', 'monitor', 'uk sport', 'sport england', 'visit england',
+          'arden csu', 'department culture media sport', 'environment agency',
+          'vehicle certification agency', 'driver vehicle licensing agency',
+          'http://reference.data.gov.uk/id/public-body/consumer-focus',
+          'consumer focus', 'foreign commonwealth office']
+
+
+def extract_by_scoring_all(name, limit, score_cutoff):
+    results = [(title, fuzzywuzzy.fuzz.WRatio(name, title))
+               for title in TITLES]
+    results = [result for result in results if result[1] >= score_cutoff]
+    return sorted(results, key=lambda r: (-r[1], r[0]))[:limit]
+
+
+class TestCandidateIndex(object):
+    def test_same_as_scoring_all(self):
+        index = CandidateIndex(TITLES)
+        for name in ('cabinet ofice', 'justice', 'nhs blood transplant',
+                     'h m passport office',
+                     'departmentforculturemediaandsport',
+                     'arts humanities research council', 'dvsa', 'sport',
+                     'vehiclecertificationagency', 'consumer focus', 'co'):
+            for limit in (3, 10):
+                assert_equal(index.extract(name, limit, score_cutoff=50),
+                             extract_by_scoring_all(name, limit, 50))
+
+    def test_add(self):
+        index = CandidateIndex(['cabinet office'])
+        index.add('home office')
+        index.add('home office')
+        assert_equal(len(index), 2)
+        assert_equal([string for string, score in
+                      index.extract('home ofice', score_cutoff=50)],
+                     ['home office', 'cabinet office'])
+
+    def test_no_name(self):
+        assert_equal(CandidateIndex(TITLES).extract('-'), [])
+
+    def test_extract_many(self):
+        index = CandidateIndex(TITLES)
+        results = index.extract_many(['hm treasury', 'hm treasury', 'ofsted'],
+                                     limit=1)
+        assert_equal(results, {'hm treasury': [('hm treasury', 100)],
+                               'ofsted': [('ofsted', 100)]})
+
@@ -1,13 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from StringIO import StringIO
+import os
+import shutil
+import tempfile
 import unicodecsv
 
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_raises
 import mock
 
 import compare_posts
-from compare_posts import get_triplestore_posts, save_posts_csv
+from compare_posts import (get_triplestore_posts, save_posts_csv,
+                           SeniorPost, JuniorPost)
 
 
 assert_equal.im_class.maxDiff = None
@@ -16,6 +20,7 @@ compare_posts.filepath_for_csv_from_triplestore = \
     mock.MagicMock(return_value=CSV_FILEPATH)
 ACAS_URI = 'http://reference.data.gov.uk/id/public-body/advisory-conciliation-and-arbitration-service'
 ACAS_TITLE = 'Advisory, Conciliation and Arbitration Service'
+CHECKPOINT = 'triplestore_post_counts.csv.checkpoint'
 
 class TestTriplestorePostsToCsv(object):
     def test_header_senior(self):
@@ -85,6 +90,144 @@ def csv_string_as_dicts(csv_string, post_ref=None):
                 return item
         raise ValueError('Couldn\'t find row with post_ref: %r' % post_ref)
 
+class TestTriplestorePostCounts(object):
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        with open('triplestore_departments_tidied.csv', 'wb') as f:
+            f.write('title,name,uris,graphs\n'
+                    'Body A,a,http://x/a http://x/a,2011-09-30 2012-03-31\n'
+                    'Body B,b,http://x/b,2011-09-30\n')
+        compare_posts.args = MockArgs()
+        compare_posts.args.pair_concurrency = 3
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def write_checkpoint(self, **options):
+        checkpoint_options = dict(body_title=None, graph=None, junior=False,
+                                  sparql=False, snapshot=None)
+        checkpoint_options.update(options)
+        with open(CHECKPOINT, 'wb') as f:
+            compare_posts.write_checkpoint_options(f, checkpoint_options)
+            compare_posts.append_checkpoint(
+                f, ['http://x/a', '2012-03-31'],
+                dict(body_title='Body A', graph='2012-03-31', senior_posts=7,
+                     junior_posts=None, source_files='{}',
+                     num_source_files=0))
+
+    def count_posts(self, body_title=None, graph=None):
+        def get_posts(body_uri, graph):
+            return [{}] * len(body_uri), None, 1, {'f.xls': 1}
+        with mock.patch.object(compare_posts, 'get_triplestore_posts',
+                               side_effect=get_posts) as get_posts_mock:
+            compare_posts.triplestore_post_counts(body_title, graph)
+        return sorted(call[0] for call in get_posts_mock.call_args_list)
+
+    def test_resumes_from_checkpoint(self):
+        self.write_checkpoint()
+        with open(CHECKPOINT, 'ab') as f:
+            # interrupted part way through writing a line
+            f.write('[["http://x/b", "2011-')
+
+        assert_equal(self.count_posts(),
+                     [('http://x/a', '2011-09-30'),
+                      ('http://x/b', '2011-09-30')])
+        with open('triplestore_post_counts.csv', 'rb') as f:
+            rows = list(unicodecsv.DictReader(f))
+        assert_equal([(row['body_title'], row['graph'], row['senior_posts'])
+                      for row in rows],
+                     [('Body A', '2011-09-30', '9'),
+                      ('Body A', '2012-03-31', '7'),
+                      ('Body B', '2011-09-30', '9')])
+        assert not os.path.exists(CHECKPOINT)
+
+    def test_does_not_resume_with_different_options(self):
+        self.write_checkpoint(junior=True)
+        assert_equal(self.count_posts(),
+                     [('http://x/a', '2011-09-30'),
+                      ('http://x/a', '2012-03-31'),
+                      ('http://x/b', '2011-09-30')])
+
+    def test_filtered_run_removes_its_checkpoint(self):
+        self.write_checkpoint()
+        assert_equal(self.count_posts(body_title='Body B'),
+                     [('http://x/b', '2011-09-30')])
+        assert not os.path.exists(CHECKPOINT)
+
+    def test_does_not_resume_from_filtered_run(self):
+        self.write_checkpoint(body_title='Body A')
+        assert_equal(len(self.count_posts()), 3)
+
+    def test_error_in_worker_thread_is_raised(self):
+        def get_posts(body_uri, graph):
+            if body_uri == 'http://x/b':
+                # i.e. without stopping in pdb
+                compare_posts.get_value(['Director', 'Deputy Director'])
+            return [{}], None, 0, {}
+        with mock.patch.object(compare_posts, 'get_triplestore_posts',
+                               side_effect=get_posts):
+            assert_raises(ValueError, compare_posts.triplestore_post_counts,
+                          None, None)
+        # and it will be retried next time
+        assert ('http://x/b', '2011-09-30') not in \
+            compare_posts.load_checkpoint(CHECKPOINT)
+
+
+class TestThroughputBar(object):
+    def test_pairs_per_minute(self):
+        bar = compare_posts.ThroughputBar(max=10)
+        with mock.patch.object(compare_posts.time, 'time',
+                               return_value=bar.start_ts + 2):
+            bar.index = 2
+            assert_equal(bar.pairs_per_minute, 60.0)
+
+
+class TestBypassEliminatedPosts(object):
+    def test_chain_of_eliminated_posts(self):
+        # 1 <- 2 (eliminated) <- 3 (eliminated) <- 4, 5
+        senior_posts = [SeniorPost(uri='1', reports_to_uri=None),
+                        SeniorPost(uri='4', reports_to_uri='3'),
+                        SeniorPost(uri='5', reports_to_uri='3')]
+        eliminated_posts = [SeniorPost(uri='3', reports_to_uri='2'),
+                            SeniorPost(uri='2', reports_to_uri='1')]
+        posts_by_boss_uri = {}
+        for post in senior_posts + eliminated_posts:
+            posts_by_boss_uri.setdefault(post.reports_to_uri, []).append(post)
+        compare_posts.bypass_eliminated_posts(eliminated_posts,
+                                              posts_by_boss_uri)
+        assert_equal([(post.uri, post.reports_to_uri)
+                      for post in senior_posts + eliminated_posts],
+                     [('1', None), ('4', '1'), ('5', '1'), ('3', '1'),
+                      ('2', '1')])
+
+
+class TestPostRecords(object):
+    def test_fields(self):
+        post = SeniorPost(uri='http://x/post/1', name='Bob')
+        assert_equal((post.uri, post['name'], post.grade),
+                     ('http://x/post/1', 'Bob', None))
+        post['grade'] = 'SCS1'
+        assert_equal(post.grade, 'SCS1')
+        assert not hasattr(post, '__dict__')
+
+    def test_save_junior_posts_csv(self):
+        posts = [JuniorPost(uri='#juniorPosts%s' % i, reports_to='1',
+                            row_index=i, unit='Delivery', fte=1.0,
+                            grade='EO', salary_range=u'\xa31 - \xa32',
+                            job_title='Adviser %s' % i, profession='Law',
+                            source_file='/a.xls', source_line=str(i))
+                 for i in (3, 2)]
+        rows = get_posts_csv('ACAS', '2012-09-30', 'junior', posts)
+        assert_equal(rows[1:], [
+            u'"parent dept","ACAS","Delivery","1","EO","1","2","Adviser 2",'
+            u'"1.0","Law","/a.xls","2"',
+            u'"parent dept","ACAS","Delivery","1","EO","1","2","Adviser 3",'
+            u'"1.0","Law","/a.xls","3"'])
+
+
 class MockArgs(object):
     junior = False
     include_salary_cost_of_reports = False
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from nose.tools import assert_equal, assert_raises
+
+import requests
+
+from crawler import Crawler, imap_unordered
+from stub_server import StubServerTest, StubHandler
+
+
+class TestCrawler(StubServerTest):
+    def setup(self):
+        super(TestCrawler, self).setup()
+        self.crawler = Crawler(concurrency=4, client=self.client)
+
+    def test_get_paged_items(self):
+        items = self.crawler.get_paged_items(
+            lambda page: '%s/post/a.json?_page=%s' % (self.url, page))
+        assert_equal(items, ['a-%s' % i for i in range(7)])
+
+    def test_map_is_ordered(self):
+        post_ids = ['p%s' % i for i in range(20)]
+        results = self.crawler.map(
+            lambda post_id: self.crawler.get_paged_items(
+                lambda page: '%s/post/%s.json?_page=%s' %
+                (self.url, post_id, page)),
+            post_ids)
+        assert_equal(results, [['%s-%s' % (post_id, i) for i in range(7)]
+                               for post_id in post_ids])
+
+    def test_map_unique(self):
+        results = self.crawler.map_unique(
+            lambda post_id: self.crawler.get_json(
+                '%s/post/%s.json?_page=1' % (self.url, post_id)),
+            ['b', 'a', 'b'])
+        assert_equal(sorted(results.keys()), ['a', 'b'])
+        assert_equal(StubHandler.requests_by_path['/post/b.json'], 1)
+
+    def test_retry(self):
+        assert_equal(self.crawler.get_json(self.url + '/flaky/2'),
+                     {'ok': True})
+        assert_equal(StubHandler.requests_by_path['/flaky/2'], 3)
+
+    def test_retries_exhausted(self):
+        assert_raises(requests.HTTPError,
+                      self.crawler.get, self.url + '/flaky/10')
+        assert_equal(StubHandler.requests_by_path['/flaky/10'], 4)
+
+
+class TestImapUnordered(object):
+    def test_all_values(self):
+        results = imap_unordered(lambda value: value * 2, range(20), 4)
+        assert_equal(sorted(results), [(value, value * 2)
+                                       for value in range(20)])
+
+    def test_exception(self):
+        def function(value):
+            if value == 3:
+                raise ValueError()
+            return value
+        assert_raises(ValueError, list, imap_unordered(function, range(8), 4))
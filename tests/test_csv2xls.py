@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os.path
+import shutil
+import tempfile
+from unittest import SkipTest
+import zipfile
+
+from nose.tools import assert_equal
+import mock
+import xlrd
+
+import csv2xls
+
+SENIOR_CSV = u'''"Post Unique Reference","Name","Grade","Job Title","Job/Team Function","Parent Department","Organisation","Unit","Contact Phone","Contact E-mail","Reports to Senior Post","Salary Cost of Reports (£)","FTE","Actual Pay Floor (£)","Actual Pay Ceiling (£)","","Professional/Occupational Group","Notes","Valid?","URI"
+"10","Bob","SCS1","Director","Delivery","BIS","ACAS","Delivery","N/D","a@acas.org.uk","2","191944","1.00","N/A","","","Operational Delivery","","1","http://x/post/10"
+"2","N/D","SCS2","Chief Executive","Run it","BIS","ACAS","Board","N/D","b@acas.org.uk","XX","0","1","75000","79999","","Policy","","1","http://x/post/2"
+'''
+JUNIOR_CSV = u'''"Parent Department","Organisation","Unit","Reporting Senior Post","Grade","Payscale Minimum (£)","Payscale Maximum (£)","Generic Job Title","Number of Posts in FTE","Professional/Occupational Group"
+"BIS","ACAS","Delivery","10","EO","20000","25000","Adviser","3.5","Operational Delivery"
+'''
+
+
+class TestCsv2xls(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        for level, content in (('senior', SENIOR_CSV),
+                               ('junior', JUNIOR_CSV)):
+            with open(self.csv_filepath(level), 'wb') as f:
+                f.write(content.encode('utf8'))
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def csv_filepath(self, level):
+        return os.path.join(self.dir, 'acas-2012-09-30-%s.csv' % level)
+
+    def test_xls(self):
+        conversion = csv2xls.csv2xls(self.csv_filepath('senior'))
+        assert_equal((conversion['senior_posts_count'],
+                      conversion['junior_posts_count']), (2, 1))
+        assert conversion['xls_filepath'].endswith('organogram.xls')
+        book = xlrd.open_workbook(conversion['xls_filepath'])
+        senior = book.sheet_by_name('(final data) senior-staff')
+        assert_equal(senior.row_values(0),
+                     list(csv2xls.XLS_COL_HEADERS['senior']))
+        # sorted by post reference, as numbers
+        assert_equal(senior.col_values(0)[1:], [u'2', u'10'])
+        assert_equal(senior.row_values(1)[11:16],
+                     [0.0, 1.0, 75000.0, 79999.0, u''])
+        junior = book.sheet_by_name('(final data) junior-staff')
+        assert_equal(junior.row_values(1),
+                     [u'BIS', u'ACAS', u'Delivery', u'10', u'EO', 20000.0,
+                      25000.0, u'Adviser', 3.5, u'Operational Delivery', u''])
+        units = book.sheet_by_name('(reference) units')
+        assert_equal(sorted(units.col_values(0)),
+                     [u'Board', u'Delivery', u'Units'])
+
+    def test_xlsx_when_too_many_rows(self):
+        if csv2xls.xlsxwriter is None:
+            raise SkipTest('xlsxwriter is not installed')
+        with mock.patch.object(csv2xls, 'XLS_MAX_ROWS', 2):
+            conversion = csv2xls.csv2xls(self.csv_filepath('junior'))
+        assert conversion['xls_filepath'].endswith('organogram.xlsx')
+        with zipfile.ZipFile(conversion['xls_filepath']) as xlsx:
+            sheets = [xlsx.read(name).decode('utf8')
+                      for name in sorted(xlsx.namelist())
+                      if name.startswith('xl/worksheets/sheet')]
+        assert_equal(len(sheets), 3)
+        assert 'Chief Executive' in ''.join(sheets)
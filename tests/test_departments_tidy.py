@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+import mock
+
+import departments_tidy
+from departments_tidy import Aliases, ReviewQueue, canonize
+
+
+def titles(suggestions):
+    return [title for title, score in suggestions]
+
+
+class AliasesTest(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        filename = os.path.join(self.dir, 'aliases.csv')
+        with open(filename, 'wb') as f:
+            f.write('alias,name\n'
+                    'CO,Cabinet Office\n'
+                    'The Cabinet Office,Cabinet Office\n'
+                    'MoJ,Ministry of Justice\n')
+        orgs = [{'title': title}
+                for title in ('Cabinet Office', 'Home Office',
+                              'Ministry of Justice', 'HM Treasury')]
+        orgs_by_canonized_title = dict(
+            (departments_tidy.canonize(org['title']), org) for org in orgs)
+        self.patches = [
+            mock.patch.object(Aliases, 'filename', filename),
+            mock.patch.object(Aliases, '_instance', None),
+            mock.patch.object(
+                departments_tidy.DguOrgs, 'by_canonized_title',
+                return_value=orgs_by_canonized_title),
+            mock.patch.object(
+                departments_tidy.DguOrgs, 'by_title',
+                return_value=dict((org['title'], org) for org in orgs)),
+            ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown(self):
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.dir)
+
+
+class TestAliasesSuggest(AliasesTest):
+    def test_suggest(self):
+        aliases = Aliases.instance()
+        assert_equal(titles(aliases.suggest('The Cabinet Ofice')),
+                     ['Cabinet Office', 'Home Office'])
+        # the titles are not used up after the first suggestion
+        assert_equal(titles(aliases.suggest('Home Ofice')),
+                     ['Home Office', 'Cabinet Office'])
+
+    def test_suggest_uses_new_aliases(self):
+        aliases = Aliases.instance()
+        aliases.suggest('Treasury')
+        aliases.add('Her Majestys Treasury', 'HM Treasury')
+        assert_equal(aliases.suggest('Her Majestys Treasury')[0],
+                     ('HM Treasury', 100))
+
+    def test_suggest_uri(self):
+        aliases = Aliases.instance()
+        assert_equal(aliases.suggest(
+            'http://reference.data.gov.uk/id/department/moj')[0],
+            ('Ministry of Justice', 100))
+
+
+def saved_alias(name):
+    return Aliases().canonized_aliases.get(canonize(name))
+
+
+class TestBatchReconcile(AliasesTest):
+    def setup(self):
+        AliasesTest.setup(self)
+        self.queue_filename = os.path.join(self.dir, 'review_queue.csv')
+
+    def read_queue(self):
+        with open(self.queue_filename, 'rb') as f:
+            return list(csv.DictReader(f))
+
+    def test_accepts_good_match(self):
+        aliases = Aliases.instance()
+        aliases.start_batch(90, self.queue_filename)
+        assert_equal(aliases.get_or_reconcile('Cabinet Ofice'),
+                     'Cabinet Office')
+        assert_equal(saved_alias('Cabinet Ofice'), 'Cabinet Office')
+        assert not os.path.exists(self.queue_filename)
+
+    def test_queues_poor_match(self):
+        aliases = Aliases.instance()
+        aliases.start_batch(90, self.queue_filename)
+        for i in range(2):
+            assert_equal(aliases.get_or_reconcile('Home Offce Border Force'),
+                         None)
+        rows = self.read_queue()
+        assert_equal([(json.loads(row['names']), row['match'])
+                      for row in rows],
+                     [([u'Home Offce Border Force'], '')])
+        assert_equal(json.loads(rows[0]['suggestions'])[0][0], 'Home Office')
+        assert_equal(saved_alias('Home Offce Border Force'), None)
+
+    def test_replays_reviews(self):
+        queue = ReviewQueue(self.queue_filename)
+        queue.add(('Home Offce Border Force',), [['Home Office', 80]])
+        queue.add(('http://x/hmt', 'Treasure'), [['Home Office', 60]])
+        queue.add(('Visit Britain',), [['Home Office', 55]])
+        queue.rows['["Home Offce Border Force"]']['match'] = '1'
+        queue.rows['["http://x/hmt", "Treasure"]']['match'] = 'HM Treasury'
+        queue.rows['["Visit Britain"]']['match'] = 'none'
+        queue.save()
+
+        aliases = Aliases.instance()
+        aliases.start_batch(90, self.queue_filename)
+        assert_equal(aliases.get_or_reconcile('Home Offce Border Force'),
+                     'Home Office')
+        assert_equal([saved_alias(name) for name in
+                      ('http://x/hmt', 'Treasure', 'Visit Britain')],
+                     ['HM Treasury', 'HM Treasury', None])
+        # those still to do, or decided as no match, stay in the queue
+        assert_equal([(json.loads(row['names']), row['match'])
+                      for row in self.read_queue()],
+                     [([u'Visit Britain'], 'none')])
+
+    def test_bad_review_stays_in_queue(self):
+        queue = ReviewQueue(self.queue_filename)
+        queue.add(('Home Offce Border Force',), [['Home Office', 80]])
+        queue.rows['["Home Offce Border Force"]']['match'] = 'Home Ofice'
+        queue.save()
+
+        Aliases.instance().start_batch(90, self.queue_filename)
+        assert_equal([row['match'] for row in self.read_queue()],
+                     ['Home Ofice'])
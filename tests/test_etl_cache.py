@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os.path
+import tempfile
+import shutil
+
+from nose.tools import assert_equal, assert_not_equal
+import mock
+
+from etl_cache import EtlCache
+
+
+class TestEtlCache():
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.xls_filepath = self._write_file('organogram.xls', 'xls content')
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def _write_file(self, filename, content):
+        filepath = os.path.join(self.dir, filename)
+        with open(filepath, 'wb') as f:
+            f.write(content)
+        return filepath
+
+    def test_miss(self):
+        cache = EtlCache(self.cache_dir)
+        assert_equal(cache.get(cache.key(self.xls_filepath)), None)
+
+    def test_set_and_get(self):
+        cache = EtlCache(self.cache_dir)
+        key = cache.key(self.xls_filepath, 'load')
+        cache.set(key, ('validation', ['error'], [u'warning \xa3']))
+        assert_equal(cache.get(key), ('validation', ['error'], [u'warning \xa3']))
+
+    def test_key_depends_on_content(self):
+        cache = EtlCache(self.cache_dir)
+        other_filepath = self._write_file('other.xls', 'other content')
+        assert_not_equal(cache.key(self.xls_filepath),
+                         cache.key(other_filepath))
+        same_filepath = self._write_file('same.xls', 'xls content')
+        assert_equal(cache.key(self.xls_filepath), cache.key(same_filepath))
+
+    def test_key_depends_on_params_and_code_version(self):
+        cache = EtlCache(self.cache_dir, code_version='1')
+        assert_not_equal(cache.key(self.xls_filepath, 'load'),
+                         cache.key(self.xls_filepath, 'load and display'))
+        cache2 = EtlCache(self.cache_dir, code_version='2')
+        assert_not_equal(cache.key(self.xls_filepath, 'load'),
+                         cache2.key(self.xls_filepath, 'load'))
+
+    def test_eviction_of_least_recently_used(self):
+        cache = EtlCache(self.cache_dir, max_size_mb=1)
+        value = os.urandom(300 * 1024)  # incompressible
+        for i in range(3):
+            cache.set('key%s' % i, value)
+            # set the last used time explicitly, as mtime resolution can be
+            # a second
+            os.utime(cache._filepath('key%s' % i), (i, i))
+        cache.get('key0')  # used recently, so not evicted
+        cache.set('key3', value)
+        assert cache.get('key1') is None
+        assert cache.get('key0') == value
+        assert cache.get('key2') == value
+        assert cache.get('key3') == value
+
+    def test_only_measures_size_when_it_might_be_over(self):
+        cache = EtlCache(self.cache_dir, max_size_mb=1)
+        value = os.urandom(300 * 1024)  # incompressible
+        with mock.patch.object(cache, '_cache_files',
+                               wraps=cache._cache_files) as cache_files:
+            for i in range(3):
+                cache.set('key%s' % i, value)
+            cache.set('key0', value)  # replacing it doesn't add to the size
+            assert_equal(cache_files.call_count, 1)
+            cache.set('key3', value)
+            assert_equal(cache_files.call_count, 2)
+        assert_equal(len(cache._cache_files()), 3)
+
+    def test_clear(self):
+        cache = EtlCache(self.cache_dir)
+        cache.set('key', 'value')
+        cache.clear()
+        assert_equal(cache.get('key'), None)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os.path
+import threading
+import json
+from nose.tools import assert_equal, assert_in
+
+import requests
+
+from etl_server import EtlServer, safe_filename
+
+TEST_XLS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                               '../data/test-xls'))
+
+
+class TestEtlServer():
+    @classmethod
+    def setup_class(cls):
+        cls.server = EtlServer(('localhost', 0), workers=1)
+        cls.url = 'http://localhost:%s' % cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def post_xls(self, filename, **params):
+        with open(os.path.join(TEST_XLS_DIR, filename), 'rb') as f:
+            params['filename'] = filename
+            response = requests.post(self.url + '/convert', params=params,
+                                     data=f.read())
+        assert_equal(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_status(self):
+        response = requests.get(self.url + '/status')
+        assert_equal(response.json(), {'status': 'ok'})
+
+    def test_valid(self):
+        result = self.post_xls('sample-valid.xls', date='2016-09-30')
+        assert_equal(result['failure_stage'], None)
+        assert_equal(result['verify_level'], 'load, display and be valid')
+        assert_equal(result['index'], {'name': 'Culture Agency',
+                                       'value': 'sample-valid'})
+        assert_equal(
+            result['junior_csv'].splitlines()[1],
+            u'"Department for Culture, Media and Sport","Culture Agency","Culture Agency Unit","CEO","Band A","13564","17594","CAU Assistant","1.00","Operational Delivery"')
+
+    def test_invalid(self):
+        result = self.post_xls('sample-invalid-senior.xls')
+        assert_equal(result['failure_stage'], 'validation')
+        assert_equal(result['errors'], ['Sheet "(final data) senior-staff" cell S4: Invalid row, as indicated by the red colour in cell S4.'])
+        assert_equal(result['senior_csv'], None)
+
+    def test_multipart_upload(self):
+        with open(os.path.join(TEST_XLS_DIR, 'sample-valid.xls'), 'rb') as f:
+            response = requests.post(
+                self.url + '/convert',
+                data={'verify_level': 'load'},
+                files={'xls': ('sample-valid.xls', f)})
+        result = response.json()
+        assert_equal(result['failure_stage'], None)
+        assert_equal(result['verify_level'], 'load')
+        assert_in('"Post Unique Reference"', result['senior_csv'])
+
+    def test_bad_verify_level(self):
+        response = requests.post(self.url + '/convert',
+                                 params={'verify_level': 'everything'},
+                                 data='not an xls')
+        assert_equal(response.status_code, 400)
+
+
+def test_safe_filename():
+    assert_equal(safe_filename('../../etc/passwd'), 'passwd')
+    assert_equal(safe_filename('C:\\Users\\org 2016-09-30.xls'),
+                 'org 2016-09-30.xls')
+    assert_equal(safe_filename('..'), 'organogram.xls')
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from nose.tools import assert_equal
+
+import pandas as pd
+
+import etl_to_csv
+from etl_stats import StageStats, NULL_STAGE, total_stages, format_report
+
+
+class TestStageStats():
+    def test_stages(self):
+        stats = StageStats()
+        errors = []
+        with stats.stage('load', errors) as stage:
+            stage.rows = 10
+            errors.append('error 1')
+            with stats.stage('parse', errors):
+                errors.append('error 2')
+        with stats.stage('save'):
+            pass
+        stages = stats.as_dicts()
+        assert_equal([(s['stage'], s['depth'], s['rows'], s['errors'])
+                      for s in stages],
+                     [('load', 0, 10, 2), ('parse', 1, None, 1),
+                      ('save', 0, None, 0)])
+        assert stages[0]['seconds'] >= stages[1]['seconds']
+
+    def test_stage_that_raises(self):
+        stats = StageStats()
+        try:
+            with stats.stage('load'):
+                raise ValueError()
+        except ValueError:
+            pass
+        with stats.stage('save'):
+            pass
+        assert_equal([s['depth'] for s in stats.as_dicts()], [0, 0])
+        assert stats.as_dicts()[0]['seconds'] is not None
+
+    def test_total_stages(self):
+        runs = [[dict(stage='load', depth=0, seconds=1.0, rows=10, errors=1,
+                      peak_memory_mb=50.0)],
+                [dict(stage='load', depth=0, seconds=2.0, rows=5, errors=0,
+                      peak_memory_mb=80.0)]]
+        totals = total_stages(runs)
+        assert_equal([(t['stage'], t['seconds'], t['rows'], t['errors'],
+                       t['peak_memory_mb'], t['runs']) for t in totals],
+                     [('load', 3.0, 15, 1, 80.0, 2)])
+        assert_equal(format_report(totals).splitlines()[1].split(),
+                     ['load', '3.000', '15', '1', '80.0'])
+
+
+class TestInstrument():
+    def teardown(self):
+        etl_to_csv.stage_stats = None
+
+    def test_disabled(self):
+        assert_equal(etl_to_csv.instrument('verify graph'), NULL_STAGE)
+
+    def test_verify_graph(self):
+        etl_to_csv.stage_stats = StageStats()
+        senior = pd.DataFrame([['CEO', 'Bob', 'XX'], ['DIR', 'Sue', 'CEO']],
+                              columns=['Post Unique Reference', 'Name',
+                                       'Reports to Senior Post'])
+        junior = pd.DataFrame([['UNKNOWN']],
+                              columns=['Reporting Senior Post'])
+        errors = []
+        etl_to_csv.verify_graph(senior, junior, errors)
+        assert_equal([(s['stage'], s['depth'], s['rows'], s['errors'])
+                      for s in etl_to_csv.stage_stats.as_dicts()],
+                     [('verify graph', 0, 3, 1), ('job shares', 1, 2, 0)])
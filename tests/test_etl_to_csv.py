@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os.path
+import json
+import tempfile
+import shutil
 from nose.tools import assert_equal, assert_raises, assert_in, assert_not_in
 import string
 from pprint import pprint
+import mock
 
 import pandas as pd
 from numpy import nan
@@ -11,7 +15,10 @@ from numpy import nan
 import etl_to_csv
 from etl_to_csv import (
     main, load_xls_and_get_errors, in_sheet_validation_senior_columns,
-    load_references, load_senior,
+    in_sheet_validation_senior_df, load_references, load_senior,
+    ExcelMatchList, get_top_level_bosses, get_xls_filepaths, main_batch,
+    save_csv,
+    blank_out_columns, CSV_OPTIONS,
     )
 
 assert_equal.im_class.maxDiff = None
@@ -378,6 +385,183 @@ def in_sheet_validate_senior_row(row):
     in_sheet_validation_senior_columns(df.loc[2], df, errors, 'sheet', references)
     return errors
 
+class TestInSheetValidationSeniorDf():
+    # The whole-sheet validation must give exactly the same errors, in the
+    # same order, as validating row by row
+    def test_same_as_row_by_row(self):
+        rows = [senior_row(), senior_row_not_in_post(), senior_row_vacant(),
+                [None] * 19]
+        for row_updates in ([('A', 'RP$FD')], [('A', 'AXXB')], [('B', 'N/A'), ('P', 1)],
+                            [('B', 'N/D'), ('P', 'fff')], [('C', 'King')],
+                            [('D', 'Not in post')], [('E', 'N/A')],
+                            [('G', 'N/D')], [('H', '')], [('I', 'N/D'), ('J', 'N/D')],
+                            [('J', 'N/A')], [('K', 'unknown')], [('K', 'ceo')]):
+            row = senior_row()
+            for col, value in row_updates:
+                row[string.ascii_uppercase.index(col)] = value
+            rows.append(row)
+        df = pd.DataFrame(rows, columns=SENIOR_COLUMN_HEADINGS)
+        in_sheet_validate_senior_row([])  # loads the references
+        row_by_row_errors = []
+        for index, row in df.iterrows():
+            in_sheet_validation_senior_columns(row, df, row_by_row_errors, 'sheet', references)
+        errors = []
+        in_sheet_validation_senior_df(df, errors, 'sheet', references)
+        assert_equal(errors, row_by_row_errors)
+        assert_equal(len(errors), 13)
+
+class TestExcelMatchList():
+    def test_case_insensitive(self):
+        assert ExcelMatchList([u'SCS1', u'SCS2']).match('scs1')
+
+    def test_int_and_string_are_the_same(self):
+        assert ExcelMatchList([u'1', 2]).match(1)
+        assert ExcelMatchList([u'1', 2]).match('2')
+
+    def test_not_matched(self):
+        assert not ExcelMatchList([u'SCS1', u'SCS2']).match('SCS')
+
+    def test_wildcards(self):
+        list_ = ExcelMatchList([u'SCS1A', u'OF-9'])
+        assert list_.match('*')
+        assert list_.match('scs?a')
+        assert list_.match('OF*')
+        assert not list_.match('OF?')
+
+    def test_escaped_wildcard(self):
+        assert ExcelMatchList([u'a*b']).match('a~*b')
+        assert not ExcelMatchList([u'axb']).match('a~*b')
+
+class TestGetTopLevelBosses():
+    def test_chain(self):
+        bosses = get_top_level_bosses({'A': 'XX', 'B': 'A', 'C': 'B'},
+                                      set(['A']))
+        assert_equal(bosses, {'A': ('top', 'A'), 'B': ('top', 'A'),
+                              'C': ('top', 'A')})
+
+    def test_deep_chain(self):
+        # deeper than the old limit of 100 steps
+        reports_to = dict(('P%d' % i, 'P%d' % (i - 1)) for i in range(1, 500))
+        reports_to['P0'] = 'XX'
+        bosses = get_top_level_bosses(reports_to, set(['P0']))
+        assert_equal(bosses['P499'], ('top', 'P0'))
+
+    def test_loop(self):
+        bosses = get_top_level_bosses(
+            {'A': 'XX', 'B': 'C', 'C': 'D', 'D': 'C'}, set(['A']))
+        assert_equal(bosses['B'], ('loop', 'B C D C'))
+        assert_equal(bosses['C'], ('loop', 'C D C'))
+        assert_equal(bosses['D'], ('loop', 'D C D'))
+
+    def test_unknown_post(self):
+        bosses = get_top_level_bosses({'A': 'XX', 'B': 'C', 'C': 'Z'},
+                                      set(['A']))
+        assert_equal(bosses['B'], ('unknown post', 'Error with senior post "B": Error with senior post "C": Post reports to unknown post ref:"Z". Known post refs:"[\'A\', \'B\', \'C\']"'))
+
+class TestGetXlsFilepaths():
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        for filename in ('b.xls', 'a.xls', 'c.xlsx', 'notes.txt'):
+            open(os.path.join(self.dir, filename), 'w').close()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def test_file(self):
+        filepath = os.path.join(self.dir, 'b.xls')
+        assert_equal(get_xls_filepaths([filepath]), [filepath])
+
+    def test_directory(self):
+        assert_equal(get_xls_filepaths([self.dir]),
+                     [os.path.join(self.dir, filename)
+                      for filename in ('a.xls', 'b.xls', 'c.xlsx')])
+
+    def test_glob(self):
+        assert_equal(get_xls_filepaths([os.path.join(self.dir, '*.xls')]),
+                     [os.path.join(self.dir, filename)
+                      for filename in ('a.xls', 'b.xls')])
+
+class TestMainBatch():
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.dir, 'csv')
+        os.mkdir(self.output_folder)
+        self.summary_filename = os.path.join(self.dir, 'summary.json')
+        self.xls_filepaths = []
+        for filename in ('a.xls', 'b.xls'):
+            filepath = os.path.join(self.dir, filename)
+            with open(filepath, 'wb') as f:
+                f.write('not a spreadsheet')
+            self.xls_filepaths.append(filepath)
+        etl_to_csv.args = MockArgs()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def run_batch(self, workers):
+        summary = main_batch(self.xls_filepaths, self.output_folder,
+                             workers=workers,
+                             summary_filename=self.summary_filename)
+        with open(os.path.join(self.output_folder, 'index.json'), 'rb') as f:
+            index = json.load(f)
+        with open(self.summary_filename, 'rb') as f:
+            saved_summary = json.load(f)
+        assert_equal(saved_summary['files'], summary)
+        return index, saved_summary
+
+    def assert_invalid_files(self, workers):
+        index, summary = self.run_batch(workers)
+        assert_equal(index, [])
+        assert_equal(summary['failure_stage_counts'], {'load': 2})
+        assert_equal([(result['xls_filepath'], result['failure_stage'],
+                       result['index']) for result in summary['files']],
+                     [(filepath, 'load', None)
+                      for filepath in self.xls_filepaths])
+        assert summary['files'][0]['errors']
+
+    def test_invalid_files(self):
+        self.assert_invalid_files(workers=1)
+
+    def test_invalid_files_with_workers(self):
+        self.assert_invalid_files(workers=2)
+
+    def test_exception(self):
+        with mock.patch.object(etl_to_csv, 'load_xls_and_stop_on_errors',
+                               side_effect=ValueError('Bad file')):
+            index, summary = self.run_batch(workers=1)
+        assert_equal(index, [])
+        assert_equal(summary['failure_stage_counts'], {'exception': 2})
+        assert_equal([result['failure_stage']
+                      for result in summary['files']],
+                     ['exception', 'exception'])
+        assert_in('ValueError: Bad file', summary['files'][0]['errors'][0])
+
+class TestSaveCsv():
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def test_same_as_to_csv(self):
+        df = pd.DataFrame([
+            ['CEO', 120000.0, 1, u'Bob Smith', 'XX'],
+            ['1', nan, 2, None, u'Caf\xe9 "Unit", \xa3'],
+            ['2', 0.505, 3, nan, 5],
+            ], columns=['Post Unique Reference', 'FTE', 'Count', 'Name',
+                        u'Total Pay (\xa3)'])
+        df = blank_out_columns(df, {u'Total Pay (\xa3)': u''})
+        filename = os.path.join(self.dir, 'streamed.csv')
+        to_csv_filename = os.path.join(self.dir, 'to_csv.csv')
+        save_csv(filename, df)
+        df.to_csv(to_csv_filename, **CSV_OPTIONS)
+        with open(filename, 'rb') as f:
+            streamed = f.read()
+        with open(to_csv_filename, 'rb') as f:
+            assert_equal(streamed, f.read())
+        assert_equal(streamed.splitlines()[1],
+                     '"CEO","120000.00","1","Bob Smith",""')
+
 class MockArgs(object):
     date = None
     date_from_filename = False
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+from nose.tools import assert_equal, assert_raises
+
+import requests
+
+from http_client import HttpClient, RequestStats, RateLimiter
+from stub_server import StubServerTest, StubHandler
+
+
+class TestHttpClient(StubServerTest):
+    def test_post(self):
+        response = self.client.post(self.url + '/sparql',
+                                    data={'query': 'SELECT'})
+        assert_equal(response.json(), {'query': ['SELECT']})
+
+    def test_error_not_raised(self):
+        response = self.client.post(self.url + '/sparql',
+                                    data={'bad': 'x'}, raise_for_status=False)
+        assert_equal(response.status_code, 400)
+
+    def test_error_raised(self):
+        assert_raises(requests.HTTPError, self.client.post,
+                      self.url + '/sparql', data={'bad': 'x'})
+
+    def test_query_waits_for_results(self):
+        client = HttpClient(timeout=0.1, backoff=0)
+        response = client.post_query(self.url + '/slow/0.3',
+                                     data={'query': 'SELECT'})
+        assert_equal(response.json(), {'query': ['SELECT']})
+
+    def test_query_timeout_is_not_retried(self):
+        client = HttpClient(query_timeout=0.1, backoff=0)
+        assert_raises(requests.Timeout, client.post_query,
+                      self.url + '/slow/0.3', data={'query': 'SELECT'})
+        assert_equal(StubHandler.requests_by_path['/slow/0.3'], 1)
+
+    def test_timeout_is_retried(self):
+        client = HttpClient(timeout=0.1, retries=1, backoff=0)
+        assert_raises(requests.Timeout, client.post,
+                      self.url + '/slow/0.3', data={'query': 'SELECT'})
+        assert_equal(StubHandler.requests_by_path['/slow/0.3'], 2)
+
+    def test_stats(self):
+        self.client.get(self.url + '/flaky/1')
+        self.client.post(self.url + '/sparql', data={'query': 'SELECT'})
+        stats = self.client.stats
+        assert_equal(dict(stats.counts),
+                     {'requests': 3, 503: 1, 200: 2, 'retries': 1})
+        assert_equal(len(stats.latencies), 3)
+        assert stats.report().startswith(
+            'HTTP requests: 3 (200: 2, 503: 1, retries: 1)')
+
+
+class TestRequestStats(object):
+    def test_percentiles(self):
+        stats = RequestStats()
+        for i in range(1, 101):
+            stats.record(i / 100.0, 200)
+        stats.record(None, 200, from_cache=True)
+        assert_equal(stats.percentile(50), 0.5)
+        assert_equal(stats.percentile(90), 0.9)
+        assert_equal(stats.percentile(100), 1.0)
+        assert_equal(stats.counts['requests'], 101)
+        assert_equal(stats.counts['cached'], 1)
+
+    def test_no_requests(self):
+        stats = RequestStats()
+        assert_equal(stats.percentile(50), None)
+        assert_equal(stats.report(), 'HTTP requests: 0')
+
+
+class TestRateLimiter(object):
+    def test_spaces_out_requests(self):
+        limiter = RateLimiter(50)
+        start = time.time()
+        for i in range(6):
+            limiter.wait()
+        # the first is immediate, then 5 intervals of 0.02s
+        assert time.time() - start >= 0.095
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from nose.tools import assert_equal
+import mock
+
+import normalize
+from normalize import canonize, canonize_value, canonize_column, memoize
+
+
+class TestCanonize(object):
+    def test_canonize(self):
+        assert_equal(canonize(' Department for Culture, Media & Sport'),
+                     'department culture media sport')
+        assert_equal(canonize('The Advisory, Conciliation and Arbitration '
+                              'Service'),
+                     'advisory conciliation arbitration service')
+
+    def test_uri_is_just_lower_cased(self):
+        assert_equal(canonize('http://reference.data.gov.uk/id/Department/CO'),
+                     'http://reference.data.gov.uk/id/department/co')
+
+    def test_canonize_value(self):
+        assert_equal(canonize_value(' "Policy and Strategy." '),
+                     'policystrategy')
+
+
+class TestMemoize(object):
+    def test_memo_is_bounded(self):
+        calls = []
+
+        @memoize
+        def upper(value):
+            calls.append(value)
+            return value.upper()
+        with mock.patch.object(normalize, 'MEMO_SIZE', 2):
+            assert_equal([upper(value) for value in 'abab'], list('ABAB'))
+            assert_equal(calls, ['a', 'b'])
+            upper('c')
+            assert_equal(len(upper.memo), 1)
+            upper('a')
+        assert_equal(calls, ['a', 'b', 'c', 'a'])
+
+    def test_canonize_column_does_each_value_once(self):
+        canonize_ = mock.Mock(side_effect=canonize)
+        assert_equal(canonize_column(['Cabinet Office', 'Home Office',
+                                      'Cabinet Office'], canonize=canonize_),
+                     ['cabinet office', 'home office', 'cabinet office'])
+        assert_equal(canonize_.call_count, 2)
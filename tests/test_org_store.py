@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os.path
+import shutil
+import tempfile
+import threading
+
+from nose.tools import assert_equal
+import mock
+
+from departments_tidy import DguOrgs, canonize
+from org_store import OrgStore
+
+
+def org(name, title, revision_id):
+    return {'name': name, 'title': title, 'revision_id': revision_id,
+            'extras': [{'key': 'category', 'value': 'ministerial-department'}]}
+
+
+class StubCkan(object):
+    '''Stands in for ckanapi.RemoteCKAN, with the orgs given.'''
+    def __init__(self, orgs):
+        self.orgs = dict((org_['name'], org_) for org_ in orgs)
+        self.shown = []
+        self._lock = threading.Lock()
+        self.action = self
+
+    def organization_list(self, all_fields=False):
+        assert all_fields
+        return [dict(name=org_['name'], title=org_['title'],
+                     revision_id=org_['revision_id'])
+                for org_ in self.orgs.values()]
+
+    def organization_show(self, id):
+        with self._lock:
+            self.shown.append(id)
+        return self.orgs[id]
+
+
+class StoreTest(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'orgs.sqlite')
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+
+class TestOrgStore(StoreTest):
+    def test_refresh_and_look_up(self):
+        ckan = StubCkan([org('cabinet-office', 'Cabinet Office', 'r1'),
+                         org('home-office', 'Home Office', 'r1')])
+        store = OrgStore(self.filename, canonize)
+        assert_equal(store.age(), None)
+        assert_equal(store.refresh(ckan), (2, 0))
+        assert_equal(sorted(ckan.shown), ['cabinet-office', 'home-office'])
+        assert store.age() < 60
+        assert_equal(store.by('title')['Cabinet Office']['name'],
+                     'cabinet-office')
+        assert_equal(store.by('canonized_title').get('home office')['extras'],
+                     {'category': 'ministerial-department'})
+        assert 'home-office' in store.by('name')
+        assert_equal(store.by('name').get('x'), None)
+        assert_equal(sorted(store.by('canonized_title')),
+                     ['cabinet office', 'home office'])
+
+    def test_refresh_only_fetches_changes(self):
+        ckan = StubCkan([org('cabinet-office', 'Cabinet Office', 'r1'),
+                         org('home-office', 'Home Office', 'r1'),
+                         org('dft', 'Department for Transport', 'r1')])
+        OrgStore(self.filename, canonize).refresh(ckan)
+        ckan.orgs['home-office'] = org('home-office', 'The Home Office', 'r2')
+        ckan.orgs['hmt'] = org('hmt', 'HM Treasury', 'r1')
+        del ckan.orgs['dft']
+        ckan.shown = []
+
+        store = OrgStore(self.filename, canonize)
+        assert_equal(store.refresh(ckan), (2, 1))
+        assert_equal(sorted(ckan.shown), ['hmt', 'home-office'])
+        assert_equal(sorted(store.by('title')),
+                     ['Cabinet Office', 'HM Treasury', 'The Home Office'])
+        assert_equal(store.by('name')['home-office']['title'],
+                     'The Home Office')
+
+
+class TestDguOrgs(StoreTest):
+    def setup(self):
+        StoreTest.setup(self)
+        self.patch = mock.patch.object(DguOrgs, 'store_filename',
+                                       self.filename)
+        self.patch.start()
+
+    def teardown(self):
+        self.patch.stop()
+        StoreTest.teardown(self)
+
+    def test_refreshes_when_old(self):
+        ckan = StubCkan([org('cabinet-office', 'Cabinet Office', 'r1')])
+        dgu_orgs = DguOrgs(ckan)
+        assert_equal(dgu_orgs._by_canonized_title['cabinet office']['name'],
+                     'cabinet-office')
+        ckan.orgs['hmt'] = org('hmt', 'HM Treasury', 'r1')
+        ckan.shown = []
+        # fresh enough
+        DguOrgs(ckan)
+        assert_equal(ckan.shown, [])
+        with mock.patch.object(DguOrgs, 'max_age', -1):
+            dgu_orgs = DguOrgs(ckan)
+        assert_equal(ckan.shown, ['hmt'])
+        assert 'HM Treasury' in dgu_orgs._by_title
+
+    def test_notify_of_new_org(self):
+        ckan = StubCkan([org('cabinet-office', 'Cabinet Office', 'r1')])
+        dgu_orgs = DguOrgs(ckan)
+        ckan.orgs['hmt'] = org('hmt', 'HM Treasury', 'r1')
+        assert_equal(dgu_orgs.notify_of_new_org('hmt'), 'HM Treasury')
+        assert_equal(DguOrgs(ckan)._by_name['hmt']['title'], 'HM Treasury')
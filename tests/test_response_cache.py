@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+from nose.tools import assert_equal
+
+import requests
+
+from http_client import HttpClient
+from response_cache import ResponseCache, shard_name
+from stub_server import StubServerTest, StubHandler
+
+GRAPH_URL = 'http://reference.data.gov.uk/2012-09-30/doc/department/co/post.json'
+
+
+class CacheTest(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def cache(self, **kwargs):
+        return ResponseCache('test', cache_dir=self.dir, **kwargs)
+
+
+class TestResponseCache(CacheTest):
+    def test_miss(self):
+        cache = self.cache()
+        assert_equal(cache.get('GET', GRAPH_URL), None)
+        assert_equal(cache.stats.counts['miss'], 1)
+
+    def test_set_and_get(self):
+        cache = self.cache()
+        content = '{"result": "\xc2\xa3"}' * 100
+        cache.set('GET', GRAPH_URL, 200, 'OK',
+                  {'Content-Type': 'application/json',
+                   'Content-Encoding': 'gzip'}, content)
+        assert_equal(cache.get('GET', GRAPH_URL),
+                     {'status': 200, 'reason': 'OK',
+                      'headers': {'Content-Type': 'application/json'},
+                      'content': content})
+        assert_equal(cache.get('GET', GRAPH_URL + '?_page=2'), None)
+        # stored compressed
+        assert cache.info()[0][2] < len(content) / 10
+
+    def test_shard_per_graph(self):
+        assert_equal(shard_name(GRAPH_URL), '2012-09-30')
+        assert_equal(shard_name('https://data.gov.uk/api/action/x?id=y'),
+                     'data.gov.uk')
+        cache = self.cache()
+        cache.set('GET', GRAPH_URL, 200, 'OK', {}, 'a')
+        cache.set('GET', 'https://data.gov.uk/api/action/x', 200, 'OK', {},
+                  'b')
+        assert_equal(cache.shards(), ['2012-09-30', 'data.gov.uk'])
+        cache.clear('2012-09-30')
+        assert_equal(cache.shards(), ['data.gov.uk'])
+        assert_equal(cache.get('GET', GRAPH_URL), None)
+
+    def test_ttl(self):
+        cache = self.cache(ttl=0.05)
+        cache.set('GET', GRAPH_URL, 200, 'OK', {}, 'a')
+        assert cache.get('GET', GRAPH_URL)
+        time.sleep(0.1)
+        assert_equal(cache.get('GET', GRAPH_URL), None)
+        assert_equal(cache.stats.counts['expired'], 1)
+        assert_equal(cache.compact(), 1)
+        assert_equal(cache.info(), [('2012-09-30', 0, 0)])
+
+    def test_lru_eviction(self):
+        # room for about 3 responses
+        cache = self.cache(max_size_mb=3.5 * 1100 / 1024.0 / 1024)
+        cache.access_resolution = 0
+        content = os.urandom(1000)
+        for i in range(3):
+            cache.set('GET', GRAPH_URL + '?%s' % i, 200, 'OK', {}, content)
+            time.sleep(0.01)
+        cache.get('GET', GRAPH_URL + '?0')
+        time.sleep(0.01)
+        cache.set('GET', GRAPH_URL + '?3', 200, 'OK', {}, content)
+        # 1 was the least recently used
+        assert_equal([bool(cache.get('GET', GRAPH_URL + '?%s' % i))
+                      for i in range(4)], [True, False, True, True])
+        assert_equal(cache.stats.counts['evicted'], 1)
+
+    def test_persists(self):
+        self.cache().set('GET', GRAPH_URL, 200, 'OK', {}, 'a')
+        assert_equal(self.cache().get('GET', GRAPH_URL)['content'], 'a')
+
+    def test_shards_are_locked_separately(self):
+        cache = self.cache()
+        cache.set('GET', GRAPH_URL, 200, 'OK', {}, 'a')
+        results = []
+        # e.g. another thread is part way through a lookup in the graph's shard
+        with cache._shard_lock('2012-09-30'):
+            thread = threading.Thread(target=lambda: results.append(
+                cache.set('GET', 'https://data.gov.uk/api/action/x', 200,
+                          'OK', {}, 'b')))
+            thread.start()
+            thread.join(10)
+            assert not thread.is_alive()
+        assert_equal(results, [None])
+        assert_equal([(shard, count) for shard, count, size in cache.info()],
+                     [('2012-09-30', 1), ('data.gov.uk', 1)])
+
+
+class TestHttpClientCache(CacheTest, StubServerTest):
+    def setup(self):
+        CacheTest.setup(self)
+        StubHandler.requests_by_path.clear()
+        self.client = HttpClient(backoff=0, session=requests.Session(),
+                                 cache=self.cache())
+
+    def test_get_is_cached(self):
+        url = self.url + '/post/a.json?_page=1'
+        responses = [self.client.get(url) for i in range(2)]
+        assert_equal([response.json() for response in responses],
+                     [{'result': {'itemsPerPage': 3,
+                                  'items': ['a-0', 'a-1', 'a-2']}}] * 2)
+        assert_equal([response.from_cache for response in responses],
+                     [False, True])
+        assert_equal(StubHandler.requests_by_path['/post/a.json'], 1)
+        assert_equal(self.client.stats.counts['cached'], 1)
+        assert self.client.cache.stats.report('test').startswith(
+            'Response cache test: 2 lookups, 1 hits (50%)')
+
+    def test_errors_and_posts_are_not_cached(self):
+        for i in range(2):
+            self.client.get(self.url + '/flaky/1')
+            self.client.post(self.url + '/sparql', data={'query': 'SELECT'})
+        # the 503 wasn't cached, so was retried, but then the 200 was
+        assert_equal(StubHandler.requests_by_path['/flaky/1'], 2)
+        assert_equal(StubHandler.requests_by_path['/sparql'], 2)
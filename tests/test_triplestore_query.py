@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+from StringIO import StringIO
+from nose.tools import assert_equal, assert_raises
+
+from triplestore_query import iter_json_bindings, iter_xml_bindings
+
+BINDINGS = [
+    {'uri': {'type': 'uri',
+             'value': 'http://reference.data.gov.uk/id/department/co'},
+     'title': {'type': 'literal', 'value': u'Cabinet Office – CO'}},
+    {'count': {'type': 'typed-literal', 'value': '3723208',
+               'datatype': 'http://www.w3.org/2001/XMLSchema#integer'}},
+    ]
+JSON_RESULTS = json.dumps(
+    {'head': {'vars': ['uri', 'title', 'count']},
+     'results': {'bindings': BINDINGS}}, indent=2,
+    ensure_ascii=False).encode('utf-8')
+XML_RESULTS = '''<?xml version="1.0"?>
+<sparql xmlns="http://www.w3.org/2005/sparql-results#">
+  <head><variable name="uri"/><variable name="title"/></head>
+  <results>
+    <result>
+      <binding name="uri"><uri>http://reference.data.gov.uk/id/department/co</uri></binding>
+      <binding name="title"><literal>Cabinet Office \xe2\x80\x93 CO</literal></binding>
+    </result>
+    <result>
+      <binding name="count"><literal datatype="http://www.w3.org/2001/XMLSchema#integer">3723208</literal></binding>
+    </result>
+  </results>
+</sparql>'''
+
+
+def chunked(text, size):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+class TestIterJsonBindings(object):
+    def test_one_chunk(self):
+        assert_equal(list(iter_json_bindings([JSON_RESULTS])), BINDINGS)
+
+    def test_small_chunks(self):
+        # splits the bindings and the utf-8 characters across chunks
+        assert_equal(list(iter_json_bindings(chunked(JSON_RESULTS, 7))),
+                     BINDINGS)
+
+    def test_no_results(self):
+        results = '{"head": {"vars": ["bindings"]}, ' \
+            '"results": {"bindings": []}}'
+        assert_equal(list(iter_json_bindings(chunked(results, 3))), [])
+
+    def test_truncated(self):
+        assert_raises(ValueError, list,
+                      iter_json_bindings([JSON_RESULTS[:-40]]))
+
+
+class TestIterXmlBindings(object):
+    def test_bindings(self):
+        bindings = list(iter_xml_bindings(StringIO(XML_RESULTS)))
+        assert_equal(bindings[0], BINDINGS[0])
+        assert_equal(bindings[1]['count'],
+                     {'type': 'literal', 'value': '3723208',
+                      'datatype': 'http://www.w3.org/2001/XMLSchema#integer'})
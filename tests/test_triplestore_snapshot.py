@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from unittest import SkipTest
+from nose.tools import assert_equal
+import mock
+
+import compare_posts
+import triplestore_snapshot
+from triplestore_snapshot import Snapshot, term_to_json, uri_term
+
+G = '<http://reference.data.gov.uk/organogram/graph/2012-09-30>'
+BODY = 'http://reference.data.gov.uk/id/public-body/acas'
+POST = BODY + '/post/'
+UNIT = BODY + '/unit/delivery'
+SOURCE = 'http://organogram.data.gov.uk/data/acas/2012-09-30/acas'
+GOV = 'http://reference.data.gov.uk/def/central-government/'
+ORG = 'http://www.w3.org/ns/org#'
+LABEL = '<http://www.w3.org/2000/01/rdf-schema#label>'
+DECIMAL = '^^<http://www.w3.org/2001/XMLSchema#decimal>'
+NQUADS = u'''
+# senior posts
+<{POST}1> {LABEL} "Chief Executive" {G} .
+<{POST}1> <{ORG}postIn> <{BODY}> {G} .
+<{POST}1> <{ORG}postIn> <{UNIT}> {G} .
+<{POST}1> <{ORG}heldBy> <{SOURCE}#person1> {G} .
+<{POST}1> <{GOV}grade> "SCS3" {G} .
+<{SOURCE}#person1> <http://xmlns.com/foaf/0.1/name> "Bob \\"Bobby\\" Smith \\u00E9" {G} .
+<{SOURCE}#person1> <{GOV}tenure> _:tenure1 {G} .
+_:tenure1 <{GOV}workingTime> "1.0"{DECIMAL} {G} .
+<{POST}2> {LABEL} "Director" {G} .
+<{POST}2> <{ORG}postIn> <{BODY}> {G} .
+<{POST}2> <{ORG}postIn> <{UNIT}> {G} .
+<{POST}2> <{ORG}reportsTo> <{POST}1> {G} .
+<{UNIT}> {LABEL} "Delivery"@en {G} .
+# body
+<{BODY}> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <{ORG}Organization> {G} .
+<{BODY}> {LABEL} "ACAS" {G} .
+<{BODY}> <{GOV}parentDepartment> <http://reference.data.gov.uk/id/department/bis> {G} .
+<http://reference.data.gov.uk/id/department/bis> {LABEL} "BIS" {G} .
+# junior posts
+<{SOURCE}#juniorPosts4> <{GOV}reportingTo> <{POST}2> {G} .
+<{SOURCE}#juniorPosts4> {LABEL} "Adviser" {G} .
+<{SOURCE}#juniorPosts4> <{GOV}fullTimeEquivalent> "2.5"{DECIMAL} {G} .
+<{SOURCE}#juniorPosts4> <{GOV}inUnit> <{UNIT}> {G} .
+'''.format(**globals())
+TRIPLES = u'''<{BODY}> {LABEL} "ACAS (latest)" .
+'''.format(**globals())
+
+
+class MockArgs(object):
+    junior = True
+    include_salary_cost_of_reports = False
+    sparql = False
+
+
+class SnapshotTest(object):
+    @classmethod
+    def setup_class(cls):
+        cls.dir = tempfile.mkdtemp()
+        for filename, content in (('dump.nq', NQUADS),
+                                  ('dump.nt', TRIPLES)):
+            with open(os.path.join(cls.dir, filename), 'wb') as f:
+                f.write(content.encode('utf-8'))
+        cls.snapshot_path = os.path.join(cls.dir, 'snapshot.sqlite')
+        snapshot = Snapshot(cls.snapshot_path)
+        cls.counts = [snapshot.load(os.path.join(cls.dir, 'dump.nq')),
+                      snapshot.load(os.path.join(cls.dir, 'dump.nt'))]
+        snapshot.close()
+        cls.snapshot = Snapshot(cls.snapshot_path)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.snapshot.close()
+        shutil.rmtree(cls.dir)
+
+
+class TestSnapshot(SnapshotTest):
+    def test_load(self):
+        assert_equal(self.counts, [21, 1])
+        assert_equal(self.snapshot.graphs(), [G[1:-1]])
+        assert_equal(self.snapshot.count('2012-09-30'), 21)
+        assert_equal(self.snapshot.count('all'), 21)
+        assert_equal(self.snapshot.count(), 1)
+
+    def test_load_again_is_idempotent(self):
+        snapshot = Snapshot(self.snapshot_path)
+        snapshot.load(os.path.join(self.dir, 'dump.nq'))
+        assert_equal(snapshot.count('2012-09-30'), 21)
+        snapshot.close()
+
+    def test_term_caches_are_bounded(self):
+        snapshot = Snapshot(self.snapshot_path)
+        uris = [POST + '1', POST + '2', UNIT, BODY]
+        with mock.patch.object(triplestore_snapshot, 'TERM_CACHE_SIZE', 2):
+            term_ids = [snapshot.term_id(uri_term(uri)) for uri in uris]
+            terms = [snapshot.term(term_id) for term_id in term_ids]
+            assert_equal(snapshot.term_id(uri_term(POST + '3')), None)
+            assert len(snapshot._term_ids) <= 2
+            assert len(snapshot._terms) <= 2
+        snapshot.close()
+        assert_equal(terms, [uri_term(uri) for uri in uris])
+
+    def test_load_turtle(self):
+        if triplestore_snapshot.rdflib is None:
+            raise SkipTest('rdflib is not installed')
+        with open(os.path.join(self.dir, 'dump.ttl'), 'wb') as f:
+            f.write((u'<%s9> <%sjobFunction> """Runs it,\n'
+                     u'and \\\\ "the" rest""" ; %s "Chef"@en .\n'
+                     % (POST, GOV, LABEL)).encode('utf-8'))
+        snapshot = Snapshot(os.path.join(self.dir, 'turtle.sqlite'))
+        assert_equal(snapshot.load(os.path.join(self.dir, 'dump.ttl'),
+                                   graph='2012-09-30'), 2)
+        values = sorted(
+            (term_to_json(snapshot.term(o)) for s, p, o in snapshot.triples(
+                '2012-09-30', s=snapshot.term_id(uri_term(POST + '9')))),
+            key=lambda value: value['value'])
+        snapshot.close()
+        assert_equal(values,
+                     [{'type': 'literal', 'value': u'Chef', 'xml:lang': 'en'},
+                      {'type': 'literal',
+                       'value': u'Runs it,\nand \\ "the" rest'}])
+
+    def test_term_to_json(self):
+        assert_equal(term_to_json(u'"Bob \\"Bobby\\" Smith \\u00E9"'),
+                     {'type': 'literal', 'value': u'Bob "Bobby" Smith \xe9'})
+        assert_equal(term_to_json(u'"Delivery"@en'),
+                     {'type': 'literal', 'value': 'Delivery',
+                      'xml:lang': 'en'})
+        assert_equal(term_to_json(u'_:b1'), {'type': 'bnode', 'value': 'b1'})
+
+    def test_departments(self):
+        assert_equal(list(self.snapshot.departments_bindings('2012-09-30')),
+                     [{'uri': {'type': 'uri', 'value': BODY},
+                       'title': {'type': 'literal', 'value': 'ACAS'},
+                       'parent': {'type': 'uri', 'value': 'http://reference.data.gov.uk/id/department/bis'},
+                       'g': {'type': 'uri', 'value': G[1:-1]}}])
+
+    def test_properties(self):
+        assert_equal(self.snapshot.properties('2012-09-30',
+                                              class_uri=ORG + 'Organization'),
+                     ['http://reference.data.gov.uk/def/central-government/parentDepartment',
+                      'http://www.w3.org/1999/02/22-rdf-syntax-ns#type',
+                      'http://www.w3.org/2000/01/rdf-schema#label'])
+
+    def test_neighbourhood(self):
+        bindings = list(self.snapshot.neighbourhood_bindings(
+            '2012-09-30', [POST + '2'], 1, [ORG + 'reportsTo']))
+        # post 2 and its unit and body, but not post 1
+        assert_equal(set(binding['s']['value'] for binding in bindings),
+                     set([POST + '2', UNIT, BODY]))
+
+
+class TestComparePostsFromSnapshot(SnapshotTest):
+    def setup(self):
+        compare_posts.args = MockArgs()
+        compare_posts.args.snapshot = self.snapshot_path
+        self.memo_patch = mock.patch.object(
+            compare_posts, 'PARENT_DEPARTMENTS_FILENAME',
+            os.path.join(self.dir, 'parent_departments.memo'))
+        self.memo_patch.start()
+
+    def teardown(self):
+        self.memo_patch.stop()
+        compare_posts.args = None
+        compare_posts.parent_departments = None
+
+    def test_get_triplestore_posts(self):
+        senior_posts, junior_posts, num_eliminated_senior_posts, \
+            source_files = compare_posts.get_triplestore_posts(
+                BODY, '2012-09-30')
+        assert_equal([(post['uri'], post['name'], post['fte'],
+                       post['reports_to_uri']) for post in senior_posts],
+                     [(POST + '1', u'Bob "Bobby" Smith \xe9', 1.0, None),
+                      (POST + '2', '', '', POST + '1')])
+        assert_equal([(post['reports_to'], post['job_title'], post['fte'])
+                      for post in junior_posts], [('2', 'Adviser', 2.5)])
+
+    def test_parent_department(self):
+        assert_equal(compare_posts.get_triplestore_parent_department(
+            BODY, '2012-09-30'), 'BIS')
+
+    def test_prefetch_parent_departments(self):
+        department = 'http://reference.data.gov.uk/id/department/bis'
+        compare_posts.parent_departments = {}
+        # several bodies, which the crawler would do in threads
+        compare_posts.prefetch_triplestore_parent_departments(
+            [(BODY, '2012-09-30'), (department, '2012-09-30')])
+        assert_equal(compare_posts.parent_departments,
+                     {(BODY, '2012-09-30'): 'BIS',
+                      (department, '2012-09-30'): 'BIS'})
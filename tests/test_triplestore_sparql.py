@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from nose.tools import assert_equal
+import mock
+
+import compare_posts
+import triplestore_sparql
+from triplestore_query import graph_uri
+from triplestore_sparql import (TripleIndex, PROPERTIES, XSD, is_eliminated,
+                                neighbourhood_pattern)
+
+BODY = 'http://reference.data.gov.uk/id/public-body/acas'
+POST = BODY + '/post/'
+SOURCE = 'http://organogram.data.gov.uk/data/acas/2012-09-30/acas'
+UNIT = 'http://reference.data.gov.uk/id/public-body/acas/unit/delivery'
+BIS = 'http://reference.data.gov.uk/id/department/bis'
+
+
+def uri(value):
+    return {'type': 'uri', 'value': value}
+
+
+def literal(value, datatype=None):
+    term = {'type': 'literal', 'value': value}
+    if datatype:
+        term['type'] = 'typed-literal'
+        term['datatype'] = datatype
+    return term
+
+
+def binding(s, p, o):
+    return {'s': uri(s), 'p': uri(PROPERTIES[p]),
+            'o': o if isinstance(o, dict) else uri(o)}
+
+
+SENIOR_BINDINGS = [
+    binding(POST + '1', 'label', literal('Chief Executive')),
+    binding(POST + '1', 'postIn', BODY),
+    binding(POST + '1', 'postIn', UNIT),
+    binding(POST + '1', 'heldBy', SOURCE + '#person1'),
+    binding(POST + '1', 'grade', literal('SCS3')),
+    binding(POST + '1', 'salaryRange', literal(u'£100000 - £104999')),
+    binding(SOURCE + '#person1', 'name', literal('Bob')),
+    binding(SOURCE + '#person1', 'tenure', SOURCE + '#tenure1'),
+    binding(SOURCE + '#tenure1', 'workingTime', literal('1.0', XSD + 'decimal')),
+    binding(BODY, 'label', literal('ACAS')),
+    binding(UNIT, 'label', literal('Delivery')),
+    binding(POST + '2', 'label', literal('Director')),
+    binding(POST + '2', 'postIn', BODY),
+    binding(POST + '2', 'postIn', UNIT),
+    binding(POST + '2', 'reportsTo', POST + '3'),
+    binding(POST + '3', 'label', literal('Old Director')),
+    binding(POST + '3', 'postIn', BODY),
+    binding(POST + '3', 'postIn', UNIT),
+    binding(POST + '3', 'reportsTo', POST + '1'),
+    binding(POST + '3', 'postStatus', literal('Eliminated')),
+    ]
+JUNIOR_BINDINGS = [
+    binding(SOURCE + '#juniorPosts2', 'reportingTo', POST + '2'),
+    binding(SOURCE + '#juniorPosts2', 'label', literal('Adviser')),
+    binding(SOURCE + '#juniorPosts2', 'inUnit', UNIT),
+    binding(SOURCE + '#juniorPosts2', 'fullTimeEquivalent',
+            literal('2.5', XSD + 'decimal')),
+    binding(UNIT, 'label', literal('Delivery')),
+    ]
+
+
+class MockArgs(object):
+    junior = True
+    include_salary_cost_of_reports = False
+    sparql = True
+    sparql_endpoint = 'http://localhost/sparql'
+
+
+class TestTripleIndex(object):
+    def test_item(self):
+        index = TripleIndex()
+        index.add_bindings(SENIOR_BINDINGS)
+        item = index.item(POST + '1')
+        assert_equal(item['label'], ['Chief Executive'])
+        assert_equal(item['grade'], 'SCS3')
+        assert_equal(sorted(d['_about'] for d in item['postIn']),
+                     [BODY, UNIT])
+        assert_equal(item['heldBy'][0]['tenure']['workingTime'], 1.0)
+
+    def test_links_to_posts_are_not_expanded(self):
+        index = TripleIndex()
+        index.add_bindings(SENIOR_BINDINGS)
+        assert_equal(index.item(POST + '2')['reportsTo'], POST + '3')
+
+    def test_is_eliminated(self):
+        index = TripleIndex()
+        index.add_bindings(SENIOR_BINDINGS)
+        assert_equal([is_eliminated(index.item(POST + id_))
+                      for id_ in '123'], [False, False, True])
+
+    def test_neighbourhood_pattern(self):
+        pattern = neighbourhood_pattern(max_depth=2)
+        assert_equal(pattern.count('UNION'), 2)
+        assert '?item ?p1 ?o1 . ?o1 ?p2 ?s . ?s ?p ?o .' in pattern
+
+
+class TestGetTriplestorePosts(object):
+    def setup(self):
+        compare_posts.args = MockArgs()
+
+    def teardown(self):
+        compare_posts.args = None
+
+    @mock.patch.object(triplestore_sparql, 'sparql_select',
+                       side_effect=[SENIOR_BINDINGS, JUNIOR_BINDINGS])
+    def test_sparql(self, sparql_select):
+        senior_posts, junior_posts, num_eliminated_senior_posts, \
+            source_files = compare_posts.get_triplestore_posts(
+                BODY, '2012-09-30')
+        assert_equal(sparql_select.call_count, 2)
+        # the eliminated post 3 is added as a missing boss and post 2 then
+        # reports to its boss
+        assert_equal([(post['uri'], post['name'], post['reports_to_uri'])
+                      for post in senior_posts],
+                     [(POST + '1', 'Bob', None),
+                      (POST + '2', '', POST + '1'),
+                      (POST + '3', '', POST + '1')])
+        assert_equal(num_eliminated_senior_posts, 1)
+        assert_equal(senior_posts[0]['unit'], 'Delivery')
+        assert_equal(senior_posts[0]['fte'], 1.0)
+        assert_equal([(post['reports_to'], post['job_title'], post['fte'],
+                       post['row_index']) for post in junior_posts],
+                     [('2', 'Adviser', 2.5, 2)])
+
+
+def in_graph(graph, binding):
+    binding = dict(binding)
+    binding['g'] = uri(graph_uri(graph))
+    return binding
+
+
+class TestParentDepartments(object):
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        compare_posts.args = MockArgs()
+        compare_posts.parent_departments = None
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        compare_posts.args = None
+        compare_posts.parent_departments = None
+
+    @mock.patch.object(triplestore_sparql, 'sparql_select', return_value=[
+        in_graph('2012-03-31', binding(BODY, 'parentDepartment', BIS)),
+        in_graph('2012-03-31', binding(BIS, 'label', literal('BIS'))),
+        in_graph('2012-09-30', binding(BODY, 'parentDepartment', BIS)),
+        in_graph('2012-09-30', binding(BIS, 'label', literal('Dept for BIS'))),
+        ])
+    def test_prefetch_one_query_per_body(self, sparql_select):
+        compare_posts.prefetch_triplestore_parent_departments(
+            [(BODY, '2012-03-31'), (BODY, '2012-09-30')])
+        assert_equal(sparql_select.call_count, 1)
+        assert_equal([compare_posts.get_triplestore_parent_department(
+            BODY, graph) for graph in ('2012-03-31', '2012-09-30')],
+            ['BIS', 'Dept for BIS'])
+        # a later run gets them from disk
+        compare_posts.parent_departments = None
+        compare_posts.prefetch_triplestore_parent_departments(
+            [(BODY, '2012-03-31')])
+        assert_equal(compare_posts.get_triplestore_parent_department(
+            BODY, '2012-09-30'), 'Dept for BIS')
+        assert_equal(sparql_select.call_count, 1)
+
+    @mock.patch.object(triplestore_sparql, 'sparql_select', return_value=[
+        in_graph('2012-03-31', binding(BODY, 'parentDepartment', BIS)),
+        in_graph('2012-03-31', binding(BIS, 'label', literal('BIS'))),
+        ])
+    def test_memo_is_per_source(self, sparql_select):
+        compare_posts.prefetch_triplestore_parent_departments(
+            [(BODY, '2012-03-31')])
+        compare_posts.parent_departments = None
+        compare_posts.args.sparql_endpoint = 'http://localhost/other/sparql'
+        compare_posts.prefetch_triplestore_parent_departments(
+            [(BODY, '2012-03-31')])
+        assert_equal(sparql_select.call_count, 2)
+
+    @mock.patch.object(triplestore_sparql, 'sparql_select')
+    def test_refresh(self, sparql_select):
+        for label in ('BIS', 'Dept for BIS'):
+            sparql_select.return_value = [
+                in_graph('2012-03-31', binding(BODY, 'parentDepartment', BIS)),
+                in_graph('2012-03-31', binding(BIS, 'label', literal(label)))]
+            compare_posts.parent_departments = None
+            compare_posts.prefetch_triplestore_parent_departments(
+                [(BODY, '2012-03-31')])
+            compare_posts.args.refresh_parent_departments = True
+        assert_equal(sparql_select.call_count, 2)
+        # the refreshed label is used from then on
+        compare_posts.args.refresh_parent_departments = False
+        compare_posts.parent_departments = None
+        assert_equal(compare_posts.get_triplestore_parent_department(
+            BODY, '2012-03-31'), 'Dept for BIS')
@@ -56,12 +56,15 @@ Compare departments
 '''
 
 import argparse
+import codecs
 import json
+import re
 from pprint import pprint
 import sys
 import csv
 
-import requests
+import http_client
+from triplestore_snapshot import get_snapshot
 
 from uploads_scrape import VERSIONS
 
@@ -71,13 +74,15 @@ NEW_SPARQL_ENDPOINT = 'http://46.43.41.16/sparql/organogram/query'
 
 def departments_cmd():
     if args.legacy_endpoint and args.graph == 'all':
-        depts = []
-        for graph in VERSIONS:
-            args.graph = graph
-            graph_depts = departments_query(graph=graph)
-            depts += graph_depts
+        def legacy_depts():
+            for graph in VERSIONS:
+                args.graph = graph
+                for dept in departments_query(graph=graph):
+                    yield dept
+        depts = legacy_depts()
     else:
         depts = departments_query(graph=args.graph)
+    num_depts = 0
     depts_printed = set()
     uris = set()
     filename_bits = ['triplestore', 'departments']
@@ -85,7 +90,9 @@ def departments_cmd():
         filename_bits.append('new')
     filename = '_'.join(filename_bits) + '.csv'
     csv_writer = CsvWriter.init_if_enabled(filename, ('uri', 'title', 'graph', 'parent'))
+    # the rows are written as the results arrive, rather than all at the end
     for dept in depts:
+        num_depts += 1
         if args.display_full:
             pprint(dept)
         else:
@@ -101,8 +108,9 @@ def departments_cmd():
         if dept_json in depts_printed:
             print 'DUPLICATE DEPT'
         depts_printed.add(dept_json)
-    print '%s departments' % len(depts)
+    print '%s departments' % num_depts
     if csv_writer:
+        csv_writer.close()
         print csv_writer.filename
 
 
@@ -136,6 +144,7 @@ def compare_departments_cmd():
 
 
 def departments_query(graph=None):
+    '''Yields the departments (and other bodies), as the results arrive.'''
     if graph == 'all':
         query = '''
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -185,29 +194,20 @@ def departments_query(graph=None):
             }
         }
         order by (?uri)'''.strip()
-    resp = _run_query(query)
-    depts = []
-    if not args.legacy_endpoint:
-        for result in resp['results']['bindings']:
-            dept = {'title': result['title']['value'],
-                    'uri': result['uri']['value'],
-                    'parent': result['parent']['value'] if 'parent' in result else None}
-            if graph == 'all':
-                dept['graph'] = graph_name(result['g']['value'])
-            else:
-                dept['graph'] = args.graph
-            depts.append(dept)
+    if args.snapshot:
+        results = get_snapshot(args.snapshot).departments_bindings(graph)
     else:
-        for result in resp.findall('.//{http://www.w3.org/2005/sparql-results#}result'):
-            dept = {}
-            for binding in result.findall('{http://www.w3.org/2005/sparql-results#}binding'):
-                key = binding.attrib['name']
-                value = '; '.join([t for t in binding.itertext()])
-                dept[key] = value
-                # legacy only returns results from one graph
-                dept['graph'] = args.graph
-            depts.append(dept)
-    return depts
+        results = _run_select_query(query)
+    for result in results:
+        dept = {'title': result['title']['value'],
+                'uri': result['uri']['value'],
+                'parent': result['parent']['value'] if 'parent' in result else None}
+        if graph == 'all' and not args.legacy_endpoint:
+            dept['graph'] = graph_name(result['g']['value'])
+        else:
+            # legacy only returns results from one graph
+            dept['graph'] = args.graph
+        yield dept
 
 
 def describe_org_cmd():
@@ -225,10 +225,12 @@ def classes_cmd():
       ?s a ?class .
     }
     '''
-    resp = _run_query(query)
-    classes = [
-        result['class']['value']
-        for result in resp['results']['bindings']]
+    if args.snapshot:
+        classes = get_snapshot(args.snapshot).classes()
+    else:
+        classes = [
+            result['class']['value']
+            for result in _run_select_query(query)]
     pprint(classes)
 
 
@@ -248,11 +250,13 @@ def properties_cmd():
                ?property ?o .
                }
         ''' % args.class_
-    resp = _run_query(query)
-    #pprint(resp)
-    properties = [
-        result['property']['value']
-        for result in resp['results']['bindings']]
+    if args.snapshot:
+        properties = get_snapshot(args.snapshot).properties(
+            class_uri=args.class_)
+    else:
+        properties = [
+            result['property']['value']
+            for result in _run_select_query(query)]
     pprint(properties)
 
 
@@ -277,19 +281,18 @@ def graph_counts(graph=None):
     else:
         # i.e. default graph
         query = '''select (count(*) as ?count) { ?s ?p ?o }'''
-    resp = _run_query(query)
-    #pprint(resp)
-    properties = [
-        result['count']['value']
-        for result in resp['results']['bindings']]
-    return properties[0]
+    if args.snapshot:
+        return get_snapshot(args.snapshot).count(graph)
+    for result in _run_select_query(query):
+        return result['count']['value']
 
 
 def _run_query(query):
     sparql_endpoint = get_sparql_endpoint()
     print query
     print sparql_endpoint
-    resp = requests.post(sparql_endpoint, data={'query': query})
+    resp = http_client.get_client().post_query(
+        sparql_endpoint, data={'query': query}, raise_for_status=False)
     if not resp.ok:
         print 'Error for query: %s\n%s' % (resp.status_code, resp.content)
         import pdb; pdb.set_trace()
@@ -306,6 +309,119 @@ def _run_query(query):
         return root
 
 
+def _run_select_query(query):
+    '''Runs a SELECT query and yields the result bindings as they arrive, in
+    the form of SPARQL JSON results (for the legacy endpoint too). Unlike
+    _run_query, the results are never all in memory at once.'''
+    sparql_endpoint = get_sparql_endpoint()
+    print query
+    print sparql_endpoint
+    resp = http_client.get_client().post_query(
+        sparql_endpoint, data={'query': query}, stream=True,
+        headers={'Accept': SELECT_ACCEPT}, raise_for_status=False)
+    if not resp.ok:
+        print 'Error for query: %s\n%s' % (resp.status_code, resp.content)
+        import pdb; pdb.set_trace()
+    return iter_bindings(resp)
+
+
+def sparql_select(query, sparql_endpoint=NEW_SPARQL_ENDPOINT):
+    '''Runs a SELECT query on a (new-style) SPARQL endpoint and yields the
+    result bindings as they arrive. Unlike _run_select_query it doesn't depend
+    on the command-line args, so other modules can use it.'''
+    resp = http_client.get_client().post_query(
+        sparql_endpoint, data={'query': query}, stream=True,
+        headers={'Accept': SELECT_ACCEPT})
+    return iter_bindings(resp)
+
+
+SELECT_ACCEPT = 'application/sparql-results+json, ' \
+    'application/sparql-results+xml;q=0.9'
+SPARQL_RESULTS_NS = '{http://www.w3.org/2005/sparql-results#}'
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_bindings(resp):
+    '''Yields the bindings of a (streamed) response to a SELECT query, which
+    may be SPARQL JSON or SPARQL XML results.'''
+    try:
+        if 'xml' in resp.headers.get('Content-Type', ''):
+            # let urllib3 undo any gzip
+            resp.raw.decode_content = True
+            for binding in iter_xml_bindings(resp.raw):
+                yield binding
+        else:
+            chunks = resp.iter_content(chunk_size=CHUNK_SIZE)
+            for binding in iter_json_bindings(chunks):
+                yield binding
+    finally:
+        resp.close()
+
+
+BINDINGS_START_RE = re.compile(r'"bindings"\s*:\s*\[')
+BINDINGS_SEPARATOR_RE = re.compile(r'[\s,]*')
+
+
+def iter_json_bindings(chunks):
+    '''Yields the bindings of SPARQL JSON results, parsing each one as soon as
+    it has arrived, rather than waiting for the whole document.
+
+    chunks - iterable of the response's (utf-8) bytes
+    '''
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = (utf8_decoder.decode(chunk) for chunk in chunks)
+    buffer_ = u''
+    # skip the head, to the start of the bindings list
+    for chunk in chunks:
+        buffer_ += chunk
+        match = BINDINGS_START_RE.search(buffer_)
+        if match:
+            break
+    else:
+        raise ValueError('No bindings in the SPARQL results')
+    pos = match.end()
+    while True:
+        pos = BINDINGS_SEPARATOR_RE.match(buffer_, pos).end()
+        if buffer_[pos:pos + 1] == ']':
+            return
+        try:
+            binding, pos = decoder.raw_decode(buffer_, pos)
+        except ValueError:
+            # binding is incomplete - read some more
+            buffer_ = buffer_[pos:]
+            pos = 0
+            for chunk in chunks:
+                buffer_ += chunk
+                break
+            else:
+                raise ValueError('SPARQL results ended part way through: %r'
+                                 % buffer_[:100])
+            continue
+        yield binding
+
+
+def iter_xml_bindings(file_):
+    '''Yields the bindings of SPARQL XML results, converted to the form of
+    SPARQL JSON results, as they are parsed.'''
+    from lxml import etree
+    for event, result in etree.iterparse(
+            file_, tag=SPARQL_RESULTS_NS + 'result'):
+        binding = {}
+        for binding_element in result.iterfind(SPARQL_RESULTS_NS + 'binding'):
+            for term in binding_element:
+                value = {'type': etree.QName(term).localname,
+                         'value': term.text or ''}
+                if 'datatype' in term.attrib:
+                    value['datatype'] = term.attrib['datatype']
+                binding[binding_element.attrib['name']] = value
+        yield binding
+        # free the parsed elements, so memory doesn't grow
+        result.clear()
+        while result.getprevious() is not None:
+            del result.getparent()[0]
+
+
 def graph_uri(graph_name):
     return 'http://reference.data.gov.uk/organogram/graph/%s' % graph_name
 
@@ -333,10 +449,10 @@ class CsvWriter(object):
     def __init__(self, filename, headings):
         self.headings = headings
         self.rows_written = 0
-        csv_file = open(filename, 'wb')
+        self.csv_file = open(filename, 'wb')
         self.filename = filename
         self.date_columns = []
-        self.csv_writer = csv.writer(csv_file, dialect='excel')
+        self.csv_writer = csv.writer(self.csv_file, dialect='excel')
         self.csv_writer.writerow(headings)
 
     @classmethod
@@ -356,6 +472,9 @@ class CsvWriter(object):
         self.csv_writer.writerow(row)
         self.rows_written += 1
 
+    def close(self):
+        self.csv_file.close()
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
@@ -369,6 +488,11 @@ if __name__ == '__main__':
         dest='legacy_endpoint',
         action='store_true',
         help='Use the old sparql endpoint and syntax')
+    parser.add_argument(
+        '--snapshot',
+        help='Query this local snapshot of the triplestore (see '
+             'triplestore_snapshot.py), rather than a sparql endpoint')
+    http_client.add_http_arguments(parser)
     subparsers = parser.add_subparsers()
 
     # subparsers for commands which can have options/arguments
@@ -418,6 +542,8 @@ if __name__ == '__main__':
             parser_properties = subparsers.add_parser(name)
             parser_properties.set_defaults(func=func)
     args = parser.parse_args()
+    http_client.configure_client_from_args(args)
 
     # call the function
     args.func()
+    http_client.print_stats_from_args(args)
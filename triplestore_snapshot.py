@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+'''
+Local snapshot of the organogram triplestore, so that the triplestore tools
+can run offline (and at local disk speed) against a dump of it, rather than
+the live SPARQL endpoint and linked data API.
+
+A dump (N-Triples or N-Quads, optionally gzipped, or Turtle if rdflib is
+installed) is loaded into a SQLite file, which indexes the quads by subject,
+predicate and object (SPO, POS and OSP). It answers the lookups that
+triplestore_query.py and compare_posts.py make - not SPARQL in general.
+
+Load a dump of each graph (or one N-Quads dump of all of them):
+
+    ./triplestore_snapshot.py load organogram-2012-09-30.nt --graph 2012-09-30
+    ./triplestore_snapshot.py load organograms.nq.gz
+    ./triplestore_snapshot.py info
+
+and then use it with the tools:
+
+    python triplestore_query.py --snapshot triplestore_snapshot.sqlite departments -g all
+    python compare_posts.py triplestore-counts --junior --snapshot triplestore_snapshot.sqlite
+'''
+
+import argparse
+import gzip
+import os.path
+import re
+import sqlite3
+import threading
+import timeit
+
+try:
+    import rdflib
+except ImportError:
+    # only needed for loading Turtle
+    rdflib = None
+
+DEFAULT_SNAPSHOT = 'triplestore_snapshot.sqlite'
+GRAPH_BASE = 'http://reference.data.gov.uk/organogram/graph/'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+RDFS_LABEL = 'http://www.w3.org/2000/01/rdf-schema#label'
+ORG_ORGANIZATION = 'http://www.w3.org/ns/org#Organization'
+PARENT_DEPARTMENT = \
+    'http://reference.data.gov.uk/def/central-government/parentDepartment'
+DEFAULT_GRAPH_ID = 0
+# quads inserted per transaction, when loading
+BATCH_SIZE = 50000
+# term ids (and terms) remembered, when loading and looking them up
+TERM_CACHE_SIZE = 500000
+
+# A term, in the N-Triples syntax, which is also how the terms are stored
+TERM = r'(<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?)'
+STATEMENT_RE = re.compile(r'\s*%s\s+%s\s+%s\s*(?:%s\s*)?\.\s*$' %
+                          (TERM, TERM, TERM, TERM))
+LITERAL_RE = re.compile(r'"((?:[^"\\]|\\.)*)"(?:@([A-Za-z0-9-]+)|\^\^<([^>]*)>)?$')
+ESCAPE_RE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ESCAPES = {'t': u'\t', 'b': u'\b', 'n': u'\n', 'r': u'\r', 'f': u'\f',
+           '"': u'"', "'": u"'", '\\': u'\\'}
+
+
+def uri_term(uri):
+    return u'<%s>' % uri
+
+
+def unescape(lexical):
+    def replace(match):
+        if match.group(1) or match.group(2):
+            return unichr_(int(match.group(1) or match.group(2), 16))
+        return ESCAPES.get(match.group(3), match.group(3))
+    return ESCAPE_RE.sub(replace, lexical)
+
+
+def unichr_(code_point):
+    try:
+        return unichr(code_point)
+    except ValueError:
+        # narrow python build - use a surrogate pair
+        code_point -= 0x10000
+        return unichr(0xD800 + (code_point >> 10)) + \
+            unichr(0xDC00 + (code_point & 0x3FF))
+
+
+def term_to_json(term):
+    '''Converts a stored term to the form of a term in SPARQL JSON results,
+    e.g. {'type': 'uri', 'value': 'http://...'}'''
+    if term.startswith(u'<'):
+        return {'type': 'uri', 'value': term[1:-1]}
+    if term.startswith(u'_:'):
+        return {'type': 'bnode', 'value': term[2:]}
+    lexical, language, datatype = LITERAL_RE.match(term).groups()
+    json_term = {'type': 'literal', 'value': unescape(lexical)}
+    if language:
+        json_term['xml:lang'] = language
+    if datatype:
+        json_term['datatype'] = datatype
+    return json_term
+
+
+def graph_uri_for(graph):
+    '''Returns the graph URI for a graph name (e.g. "2012-09-30") or URI.'''
+    if graph is None or '://' in graph:
+        return graph
+    return GRAPH_BASE + graph
+
+
+def read_statements(dump_path):
+    '''Yields the (s, p, o, g) terms of an N-Triples/N-Quads file (where g is
+    None for a triple).'''
+    open_ = gzip.open if dump_path.endswith('.gz') else open
+    with open_(dump_path, 'rb') as dump:
+        for line_number, line in enumerate(dump, 1):
+            line = line.decode('utf-8')
+            if not line.strip() or line.lstrip().startswith(u'#'):
+                continue
+            match = STATEMENT_RE.match(line)
+            if not match:
+                raise ValueError('Could not parse line %s of %s: %r' %
+                                 (line_number, dump_path, line[:200]))
+            yield match.groups()
+
+
+def read_turtle_statements(dump_path):
+    if rdflib is None:
+        raise ImportError('Loading Turtle needs rdflib: pip install rdflib')
+    graph = rdflib.Graph()
+    graph.parse(dump_path, format='turtle')
+    for s, p, o in graph:
+        yield rdflib_term(s), rdflib_term(p), rdflib_term(o), None
+
+
+def rdflib_term(term):
+    '''Returns an rdflib term in the N-Triples syntax. (Its n3() can give a
+    literal in the Turtle long form, """...""", which isn't N-Triples.)'''
+    if isinstance(term, rdflib.BNode):
+        return u'_:%s' % term
+    if isinstance(term, rdflib.Literal):
+        return literal_term(unicode(term), term.language, term.datatype)
+    return uri_term(term)
+
+
+def literal_term(lexical, language=None, datatype=None):
+    '''Returns a literal in the N-Triples syntax.'''
+    term = u'"%s"' % (lexical.replace(u'\\', u'\\\\')
+                      .replace(u'"', u'\\"')
+                      .replace(u'\n', u'\\n')
+                      .replace(u'\r', u'\\r'))
+    if language:
+        return u'%s@%s' % (term, language)
+    if datatype:
+        return u'%s^^<%s>' % (term, datatype)
+    return term
+
+
+class Snapshot(object):
+    def __init__(self, path=DEFAULT_SNAPSHOT):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = unicode
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS terms (
+                id INTEGER PRIMARY KEY,
+                term TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS quads (
+                g INTEGER NOT NULL, s INTEGER NOT NULL,
+                p INTEGER NOT NULL, o INTEGER NOT NULL);
+            CREATE UNIQUE INDEX IF NOT EXISTS quads_spo ON quads (g, s, p, o);
+            ''')
+        # {term: id} and {id: term} of the terms looked up
+        self._term_ids = {}
+        self._terms = {}
+
+    def close(self):
+        self.db.close()
+
+    # Loading
+
+    def load(self, dump_path, graph=None, format_=None):
+        '''Loads a dump into the snapshot. Returns the number of statements
+        read.
+
+        graph - name or URI of the graph to put triples in (quads say their
+                own graph). Default: the default graph.
+        format_ - 'nt', 'nq' or 'ttl' (default: from the file extension)
+        '''
+        if format_ is None:
+            format_ = 'ttl' if '.ttl' in os.path.basename(dump_path) \
+                else 'nt'
+        statements = read_turtle_statements(dump_path) if format_ == 'ttl' \
+            else read_statements(dump_path)
+        default_graph = graph_uri_for(graph)
+        # the indexes for querying by predicate/object are much quicker to
+        # build after the load than to maintain during it
+        self.db.executescript('''
+            DROP INDEX IF EXISTS quads_pos;
+            DROP INDEX IF EXISTS quads_osp;
+            ''')
+        count = 0
+        batch = []
+        for s, p, o, g in statements:
+            if g is None and default_graph is not None:
+                g = uri_term(default_graph)
+            batch.append((self._load_term_id(g) if g else DEFAULT_GRAPH_ID,
+                          self._load_term_id(s), self._load_term_id(p),
+                          self._load_term_id(o)))
+            count += 1
+            if len(batch) >= BATCH_SIZE:
+                self._insert_quads(batch)
+                batch = []
+        self._insert_quads(batch)
+        self._term_ids = {}
+        self.db.executescript('''
+            CREATE INDEX IF NOT EXISTS quads_pos ON quads (g, p, o, s);
+            CREATE INDEX IF NOT EXISTS quads_osp ON quads (g, o, s, p);
+            ANALYZE;
+            ''')
+        self.db.commit()
+        return count
+
+    def _load_term_id(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            if len(self._term_ids) >= TERM_CACHE_SIZE:
+                self._term_ids = {}
+            self.db.execute('INSERT OR IGNORE INTO terms (term) VALUES (?)',
+                            (term,))
+            term_id = self.db.execute('SELECT id FROM terms WHERE term = ?',
+                                      (term,)).fetchone()[0]
+            self._term_ids[term] = term_id
+        return term_id
+
+    def _insert_quads(self, quads):
+        self.db.executemany('INSERT OR IGNORE INTO quads VALUES (?, ?, ?, ?)',
+                            quads)
+        self.db.commit()
+
+    # Terms
+
+    def term_id(self, term):
+        '''Returns the id of the stored term, or None if it is not in the
+        snapshot.'''
+        if term not in self._term_ids:
+            if len(self._term_ids) >= TERM_CACHE_SIZE:
+                self._term_ids = {}
+            row = self.db.execute('SELECT id FROM terms WHERE term = ?',
+                                  (term,)).fetchone()
+            self._term_ids[term] = row[0] if row else None
+        return self._term_ids[term]
+
+    def term(self, term_id):
+        if term_id not in self._terms:
+            if len(self._terms) >= TERM_CACHE_SIZE:
+                self._terms = {}
+            self._terms[term_id] = self.db.execute(
+                'SELECT term FROM terms WHERE id = ?',
+                (term_id,)).fetchone()[0]
+        return self._terms[term_id]
+
+    def graph_id(self, graph):
+        '''Returns the id of the graph (name or URI), or DEFAULT_GRAPH_ID for
+        None.'''
+        if graph is None:
+            return DEFAULT_GRAPH_ID
+        return self.term_id(uri_term(graph_uri_for(graph)))
+
+    # Lookups
+
+    def graphs(self):
+        '''Returns the URIs of the named graphs.'''
+        return sorted(self.term(row[0])[1:-1] for row in self.db.execute(
+            'SELECT DISTINCT g FROM quads WHERE g != ?', (DEFAULT_GRAPH_ID,)))
+
+    def count(self, graph=None):
+        '''Returns the number of triples in the graph (name or URI), the
+        default graph (None) or all graphs ('all').'''
+        if graph == 'all':
+            return self.db.execute(
+                'SELECT COUNT(*) FROM quads WHERE g != ?',
+                (DEFAULT_GRAPH_ID,)).fetchone()[0]
+        return self.db.execute('SELECT COUNT(*) FROM quads WHERE g = ?',
+                               (self.graph_id(graph),)).fetchone()[0]
+
+    def triples(self, graph, s=None, p=None, o=None):
+        '''Yields the (s, p, o) term ids of the triples in the graph that
+        match the given term ids. The indexes mean any combination is quick.
+        '''
+        graph_id = graph if isinstance(graph, (int, long)) \
+            else self.graph_id(graph)
+        conditions = ['g = ?']
+        values = [graph_id]
+        for column, value in (('s', s), ('p', p), ('o', o)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                values.append(value)
+        return self.db.execute(
+            'SELECT s, p, o FROM quads WHERE %s' % ' AND '.join(conditions),
+            values)
+
+    def subjects(self, graph, predicate_uri, object_uri):
+        '''Returns the URIs of the subjects of triples with the predicate and
+        object URIs.'''
+        p = self.term_id(uri_term(predicate_uri))
+        o = self.term_id(uri_term(object_uri))
+        if p is None or o is None:
+            return []
+        return [self.term(s)[1:-1]
+                for s, p_, o_ in self.triples(graph, p=p, o=o)]
+
+    def neighbourhood_bindings(self, graph, root_uris, max_depth,
+                               not_followed_from_root=()):
+        '''Yields the triples of the roots and of every resource up to
+        max_depth links away from them, as ?s ?p ?o SPARQL JSON bindings.
+        The equivalent of triplestore_sparql.neighbourhood_pattern().
+
+        not_followed_from_root - URIs of the predicates not to follow from the
+                                 roots
+        '''
+        graph_id = self.graph_id(graph)
+        if graph_id is None:
+            return
+        not_followed = set(self.term_id(uri_term(uri))
+                           for uri in not_followed_from_root)
+        seen = set()
+        frontier = [self.term_id(uri_term(uri)) for uri in root_uris]
+        for depth in range(max_depth + 1):
+            next_frontier = []
+            for s in frontier:
+                if s is None or s in seen:
+                    continue
+                seen.add(s)
+                s_json = term_to_json(self.term(s))
+                for s_, p, o in self.triples(graph_id, s=s).fetchall():
+                    o_term = self.term(o)
+                    yield {'s': s_json, 'p': term_to_json(self.term(p)),
+                           'o': term_to_json(o_term)}
+                    if depth < max_depth and \
+                            not o_term.startswith(u'"') and \
+                            not (depth == 0 and p in not_followed):
+                        next_frontier.append(o)
+            frontier = next_frontier
+
+    def departments_bindings(self, graph=None):
+        '''Yields the organizations (uri, title, parent and g) as SPARQL JSON
+        bindings, like triplestore_query.departments_query's SPARQL.
+
+        graph - name or URI of the graph, None for the default graph or 'all'
+        '''
+        if graph == 'all':
+            graph_ids = [self.graph_id(uri) for uri in self.graphs()]
+        else:
+            graph_ids = [self.graph_id(graph)]
+        type_ = self.term_id(uri_term(RDF_TYPE))
+        organization = self.term_id(uri_term(ORG_ORGANIZATION))
+        label = self.term_id(uri_term(RDFS_LABEL))
+        parent_department = self.term_id(uri_term(PARENT_DEPARTMENT))
+        if None in (type_, organization, label):
+            return
+        results = set()
+        for graph_id in graph_ids:
+            if graph_id is None:
+                continue
+            for s, p, o in self.triples(graph_id, p=type_,
+                                        o=organization).fetchall():
+                parents = [o_ for s_, p_, o_ in self.triples(
+                    graph_id, s=s, p=parent_department)] or [None]
+                for s_, p_, title in self.triples(graph_id, s=s, p=label):
+                    for parent in parents:
+                        results.add((s, title, parent, graph_id))
+        for s, title, parent, graph_id in sorted(
+                results, key=lambda result: [self.term(term_id)
+                                             for term_id in result[:2]]):
+            binding = {'uri': term_to_json(self.term(s)),
+                       'title': term_to_json(self.term(title))}
+            if parent is not None:
+                binding['parent'] = term_to_json(self.term(parent))
+            if graph_id != DEFAULT_GRAPH_ID:
+                binding['g'] = term_to_json(self.term(graph_id))
+            yield binding
+
+    def classes(self, graph=None):
+        '''Returns the URIs of the classes i.e. the objects of rdf:type.'''
+        type_ = self.term_id(uri_term(RDF_TYPE))
+        return sorted(set(self.term(o)[1:-1]
+                          for s, p, o in self.triples(graph, p=type_)))
+
+    def properties(self, graph=None, class_uri=None):
+        '''Returns the URIs of the predicates, optionally only those of
+        subjects of the given class.'''
+        if class_uri is None:
+            rows = self.db.execute('SELECT DISTINCT p FROM quads WHERE g = ?',
+                                   (self.graph_id(graph),))
+        else:
+            rows = self.db.execute(
+                'SELECT DISTINCT q.p FROM quads t JOIN quads q '
+                'ON q.g = t.g AND q.s = t.s '
+                'WHERE t.g = ? AND t.p = ? AND t.o = ?',
+                (self.graph_id(graph), self.term_id(uri_term(RDF_TYPE)),
+                 self.term_id(uri_term(class_uri))))
+        return sorted(self.term(row[0])[1:-1] for row in rows)
+
+
+# SQLite connections can only be used in the thread that made them
+_snapshots = threading.local()
+
+
+def get_snapshot(path):
+    '''Returns the Snapshot at the path, opening it once per thread.'''
+    snapshots = _snapshots.__dict__
+    if path not in snapshots:
+        if not os.path.exists(path):
+            raise IOError('Snapshot does not exist: %s - create it with: '
+                          'triplestore_snapshot.py load' % path)
+        snapshots[path] = Snapshot(path)
+    return snapshots[path]
+
+
+def load_cmd():
+    snapshot = Snapshot(args.snapshot)
+    for dump_path in args.dump:
+        start = timeit.default_timer()
+        count = snapshot.load(dump_path, graph=args.graph, format_=args.format)
+        print 'Loaded %s statements from %s in %.1fs' % (
+            count, dump_path, timeit.default_timer() - start)
+    snapshot.close()
+
+
+def info_cmd():
+    snapshot = get_snapshot(args.snapshot)
+    print 'default graph', snapshot.count()
+    for graph in snapshot.graphs():
+        print graph, snapshot.count(graph)
+
+
+args = None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshot', default=DEFAULT_SNAPSHOT,
+                        help='SQLite file of the snapshot '
+                             '(default: %(default)s)')
+    subparsers = parser.add_subparsers()
+    subparser = subparsers.add_parser('load', help='Load dump(s) into the '
+                                      'snapshot')
+    subparser.add_argument('dump', nargs='+',
+                           help='N-Triples/N-Quads/Turtle file, may be .gz')
+    subparser.add_argument('--graph',
+                           help='Graph for the triples e.g. 2012-09-30. '
+                                'Default: the default graph')
+    subparser.add_argument('--format', choices=['nt', 'nq', 'ttl'],
+                           help='Default: from the file extension')
+    subparser.set_defaults(func=load_cmd)
+    subparser = subparsers.add_parser('info', help='Count the triples in '
+                                      'each graph')
+    subparser.set_defaults(func=info_cmd)
+    args = parser.parse_args()
+    args.func()
@@ -0,0 +1,281 @@
+'''
+Gets all the posts of a body in a graph from the triplestore with a couple of
+bulk SPARQL queries, rather than crawling the linked data API a page or a post
+at a time.
+
+The triples are assembled into items of the same shape as the linked data
+API's JSON - keyed by its short property names (e.g. 'heldBy',
+'salaryRange'), with '_about' for the URI - so that compare_posts.py can
+process them just like the items it gets from the API.
+
+Example:
+
+from triplestore_sparql import get_post_items
+senior_items, junior_items = get_post_items(
+    'http://reference.data.gov.uk/id/department/co', '2015-09-30', junior=True)
+'''
+
+from collections import defaultdict
+
+from triplestore_query import (sparql_select, graph_uri, graph_name,
+                               NEW_SPARQL_ENDPOINT)
+
+GOV = 'http://reference.data.gov.uk/def/central-government/'
+ORG = 'http://www.w3.org/ns/org#'
+RDFS = 'http://www.w3.org/2000/01/rdf-schema#'
+SKOS = 'http://www.w3.org/2004/02/skos/core#'
+FOAF = 'http://xmlns.com/foaf/0.1/'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+
+# The linked data API's short names for the properties used by
+# compare_posts.py. Triples with other properties are ignored.
+PROPERTIES = {
+    'label': RDFS + 'label',
+    'comment': RDFS + 'comment',
+    'note': SKOS + 'note',
+    'prefLabel': SKOS + 'prefLabel',
+    'postIn': ORG + 'postIn',
+    'heldBy': ORG + 'heldBy',
+    'reportsTo': ORG + 'reportsTo',
+    'name': FOAF + 'name',
+    'email': FOAF + 'mbox',
+    'phone': FOAF + 'phone',
+    'postStatus': GOV + 'postStatus',
+    'salaryRange': GOV + 'salaryRange',
+    'grade': GOV + 'grade',
+    'tenure': GOV + 'tenure',
+    'workingTime': GOV + 'workingTime',
+    'profession': GOV + 'profession',
+    'parentDepartment': GOV + 'parentDepartment',
+    # junior posts
+    'reportingTo': GOV + 'reportingTo',
+    'inUnit': GOV + 'inUnit',
+    'atGrade': GOV + 'atGrade',
+    'payband': GOV + 'payband',
+    'withJob': GOV + 'withJob',
+    'withProfession': GOV + 'withProfession',
+    'fullTimeEquivalent': GOV + 'fullTimeEquivalent',
+    }
+SHORT_NAMES = dict((uri, name) for name, uri in PROPERTIES.items())
+# properties that the linked data API always gives as a list
+LIST_PROPERTIES = set(('label', 'postIn', 'heldBy'))
+# properties that link to another post, so are given as just the URI, rather
+# than the whole post
+LINK_PROPERTIES = set(('reportsTo', 'reportingTo'))
+# how many links from the post to follow e.g. for the FTE: post -heldBy->
+# person -tenure-> tenure -workingTime-> value
+MAX_DEPTH = 3
+
+SENIOR_POSTS_QUERY = '''
+SELECT DISTINCT ?s ?p ?o
+WHERE {
+    GRAPH <%(graph)s> {
+        ?item <%(postIn)s> <%(body)s> .
+        %(neighbourhood)s
+    }
+}'''
+JUNIOR_POSTS_QUERY = '''
+SELECT DISTINCT ?s ?p ?o
+WHERE {
+    GRAPH <%(graph)s> {
+        ?post <%(postIn)s> <%(body)s> .
+        ?item <%(reportingTo)s> ?post .
+        %(neighbourhood)s
+    }
+}'''
+BODY_QUERY = '''
+SELECT DISTINCT ?s ?p ?o
+WHERE {
+    GRAPH <%(graph)s> {
+        { <%(body)s> ?p ?o . BIND (<%(body)s> AS ?s) }
+        UNION { <%(body)s> ?p1 ?s . ?s ?p ?o . }
+    }
+}'''
+# BODY_QUERY for several graphs at once
+BODY_GRAPHS_QUERY = '''
+SELECT DISTINCT ?g ?s ?p ?o
+WHERE {
+    VALUES ?g { %(graphs)s }
+    GRAPH ?g {
+        { <%(body)s> ?p ?o . BIND (<%(body)s> AS ?s) }
+        UNION { <%(body)s> ?p1 ?s . ?s ?p ?o . }
+    }
+}'''
+
+
+def neighbourhood_pattern(max_depth=MAX_DEPTH):
+    '''Returns a SPARQL pattern that binds ?s ?p ?o to the triples of ?item
+    and of every resource up to max_depth links away from it (not following
+    the links to other posts).'''
+    link_filter = 'FILTER (?p1 NOT IN (%s))' % ', '.join(
+        '<%s>' % PROPERTIES[name] for name in sorted(LINK_PROPERTIES))
+    patterns = ['{ ?item ?p ?o . BIND (?item AS ?s) }']
+    for depth in range(1, max_depth + 1):
+        path = ['?item']
+        path.extend('?o%s' % i for i in range(1, depth))
+        path.append('?s')
+        triples = ' '.join('%s ?p%s %s .' % (path[i], i + 1, path[i + 1])
+                           for i in range(depth))
+        patterns.append('{ %s ?s ?p ?o . %s }' % (triples, link_filter))
+    return '\n        UNION '.join(patterns)
+
+
+def parse_term(term):
+    '''Converts a term of the SPARQL JSON results to (value, is_resource).
+    Typed numbers are converted, as the linked data API does.'''
+    if term['type'] == 'uri':
+        return term['value'], True
+    if term['type'] == 'bnode':
+        return '_:' + term['value'], True
+    datatype = term.get('datatype', '')
+    if datatype in (XSD + 'integer', XSD + 'int', XSD + 'long'):
+        return int(term['value']), False
+    if datatype in (XSD + 'decimal', XSD + 'double', XSD + 'float'):
+        return float(term['value']), False
+    return term['value'], False
+
+
+class TripleIndex(object):
+    '''The triples of the query results, indexed by subject, for assembling
+    into items.'''
+    def __init__(self):
+        # {subject: {short_name: [(value, is_resource), ...]}}
+        self.properties = defaultdict(lambda: defaultdict(list))
+
+    def add_bindings(self, bindings):
+        for binding in bindings:
+            name = SHORT_NAMES.get(binding['p']['value'])
+            if name is None:
+                continue
+            subject = parse_term(binding['s'])[0]
+            self.properties[subject][name].append(parse_term(binding['o']))
+
+    def subjects_with(self, name):
+        return sorted(subject for subject, properties
+                      in self.properties.items() if name in properties)
+
+    def item(self, uri, depth=0):
+        '''Returns the resource as a linked data API-style item - a dict of
+        its properties, with resources nested as dicts, as far as
+        MAX_DEPTH.'''
+        item = {'_about': uri}
+        for name, values in self.properties[uri].items():
+            rendered = []
+            for value, is_resource in values:
+                if is_resource and name not in LINK_PROPERTIES and \
+                        depth < MAX_DEPTH and value in self.properties:
+                    value = self.item(value, depth + 1)
+                rendered.append(value)
+            if len(rendered) == 1 and name not in LIST_PROPERTIES:
+                rendered = rendered[0]
+            item[name] = rendered
+        return item
+
+
+def get_post_items(body_uri, graph, junior=False,
+                   sparql_endpoint=NEW_SPARQL_ENDPOINT, print_queries=False,
+                   snapshot=None):
+    '''Returns the senior post items of the body in the graph, including any
+    eliminated posts, sorted by URI, and the junior post items (or None if
+    junior is False).
+
+    snapshot - get them from this triplestore_snapshot.Snapshot, rather than
+               the SPARQL endpoint
+    '''
+    params = dict(graph=graph_uri(graph), body=body_uri,
+                  postIn=PROPERTIES['postIn'],
+                  reportingTo=PROPERTIES['reportingTo'],
+                  neighbourhood=neighbourhood_pattern())
+    link_uris = [PROPERTIES[name] for name in LINK_PROPERTIES]
+    index = TripleIndex()
+    if print_queries:
+        print 'Getting senior posts: %s %s' % (body_uri, graph)
+    if snapshot is not None:
+        index.add_bindings(snapshot.neighbourhood_bindings(
+            graph, snapshot.subjects(graph, PROPERTIES['postIn'], body_uri),
+            MAX_DEPTH, link_uris))
+    else:
+        index.add_bindings(sparql_select(SENIOR_POSTS_QUERY % params,
+                                         sparql_endpoint))
+    senior_uris = [uri for uri in index.subjects_with('postIn')
+                   if body_uri in [value for value, is_resource
+                                   in index.properties[uri]['postIn']]]
+    senior_items = [index.item(uri) for uri in senior_uris]
+    if not junior:
+        return senior_items, None
+
+    index = TripleIndex()
+    if print_queries:
+        print 'Getting junior posts: %s %s' % (body_uri, graph)
+    if snapshot is not None:
+        junior_uris = [
+            junior_uri for senior_uri in senior_uris
+            for junior_uri in snapshot.subjects(
+                graph, PROPERTIES['reportingTo'], senior_uri)]
+        index.add_bindings(snapshot.neighbourhood_bindings(
+            graph, junior_uris, MAX_DEPTH, link_uris))
+    else:
+        index.add_bindings(sparql_select(JUNIOR_POSTS_QUERY % params,
+                                         sparql_endpoint))
+    junior_items = [index.item(uri)
+                    for uri in index.subjects_with('reportingTo')]
+    return senior_items, junior_items
+
+
+def get_body_item(body_uri, graph, sparql_endpoint=NEW_SPARQL_ENDPOINT,
+                  snapshot=None):
+    '''Returns the item for the body (department etc.), with its label and
+    parentDepartment, like the linked data API's primaryTopic.'''
+    index = TripleIndex()
+    if snapshot is not None:
+        index.add_bindings(snapshot.neighbourhood_bindings(
+            graph, [body_uri], 1))
+    else:
+        index.add_bindings(sparql_select(BODY_QUERY % dict(
+            graph=graph_uri(graph), body=body_uri), sparql_endpoint))
+    return index.item(body_uri)
+
+
+def get_body_items_by_graph(body_uri, graphs,
+                            sparql_endpoint=NEW_SPARQL_ENDPOINT,
+                            snapshot=None):
+    '''Returns the body's item (as get_body_item) in each of the graphs, as
+    {graph: item}, with one query for all the graphs. A graph the body isn't
+    in gives an item with just the '_about'.'''
+    if snapshot is not None:
+        # lookups in the snapshot are cheap anyway
+        return dict((graph, get_body_item(body_uri, graph, snapshot=snapshot))
+                    for graph in graphs)
+    indexes = dict((graph, TripleIndex()) for graph in graphs)
+    query = BODY_GRAPHS_QUERY % dict(
+        graphs=' '.join('<%s>' % graph_uri(graph) for graph in graphs),
+        body=body_uri)
+    for binding in sparql_select(query, sparql_endpoint):
+        index = indexes.get(graph_name(binding['g']['value']))
+        if index is not None:
+            index.add_bindings([binding])
+    return dict((graph, index.item(body_uri))
+                for graph, index in indexes.items())
+
+
+def is_eliminated(item):
+    '''Returns whether the post item has the Eliminated status. (The linked
+    data API's list of a body's posts leaves these out.)'''
+    statuses = item.get('postStatus') or []
+    if not isinstance(statuses, list):
+        statuses = [statuses]
+    for status in statuses:
+        if isinstance(status, dict):
+            status = ' '.join([status['_about']] +
+                              listify(status.get('prefLabel')))
+        if 'eliminated' in status.lower():
+            return True
+    return False
+
+
+def listify(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
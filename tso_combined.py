@@ -12,10 +12,12 @@ import unicodecsv
 
 from compare_departments import date_to_year_first
 from compare_posts import MOD_AGGREGATED_SUBPUBS
-from etl_to_csv import load_xls_and_get_errors
+from etl_to_csv import (
+    load_xls_and_get_errors, add_cache_arguments, get_cache_from_args)
 from csv2xls import int_if_possible
 
 args = None
+etl_cache = None
 
 
 def combine():
@@ -180,7 +182,7 @@ def combine():
 def check(xls_filename):
     try:
         senior, junior, errors, warnings, will_display = \
-            load_xls_and_get_errors(xls_filename)
+            load_xls_and_get_errors(xls_filename, cache=etl_cache)
     except Exception:
         print 'XLS VALIDATION EXCEPTION', xls_filename
         traceback.print_exc()
@@ -246,5 +248,8 @@ if __name__ == '__main__':
                         help='Check the XLS validates')
     parser.add_argument('--body')
     parser.add_argument('--graph')
+    add_cache_arguments(parser)
     args = parser.parse_args()
+    if args.check:
+        etl_cache = get_cache_from_args(args)
     combine()
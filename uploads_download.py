@@ -5,10 +5,7 @@ import unicodecsv
 import argparse
 import os
 
-import requests_cache
-import requests
-
-requests_cached = requests_cache.CachedSession('.scrape_cache')  # never expires
+import http_client
 
 
 DOWNLOAD_URL = 'http://organogram.data.gov.uk{path}'
@@ -41,7 +38,7 @@ def download(url_path, folder, filename):
         print 'Skipping downloading existing file %s %s' % (url, filepath)
         return
     print 'Requesting: {url} {filename}'.format(url=url, filename=filename)
-    response = requests.get(url)
+    response = http_client.get_client().get(url, raise_for_status=False)
     if not response.ok:
         print 'ERROR downloading %s' % url
         print response, response.reason
@@ -59,7 +56,9 @@ if __name__ == '__main__':
     parser.add_argument('csv_folder')
     parser.add_argument('--download', action='store_true')
     parser.add_argument('--include-private-info', action='store_true')
+    http_client.add_http_arguments(parser)
     args = parser.parse_args()
+    http_client.configure_client_from_args(args)
     xls_folder = args.xls_folder
     csv_folder = args.csv_folder
     for folder in (xls_folder, csv_folder):
@@ -67,3 +66,4 @@ if __name__ == '__main__':
             raise argparse.ArgumentTypeError(
                 'Error: Not an existing directory: %s' % folder)
     main(xls_folder, csv_folder)
+    http_client.print_stats_from_args(args)
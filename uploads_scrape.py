@@ -8,10 +8,11 @@ import datetime
 import unicodecsv
 
 from lxml import html
-import requests_cache
 import requests
 
-requests_cached = requests_cache.CachedSession('.scrape_cache')  # never expires
+from response_cache import cached_session
+
+requests_cached = cached_session('scrape')  # never expires
 
 INDEX_URL = 'http://organogram.data.gov.uk/?email={email}&filename=&date={date}&action=Download'
 